@@ -0,0 +1,109 @@
+# Micro-benchmark for image_processing.highlight_boundary
+# Compares the current implementation against the original per-pixel np.vectorize version on a synthetic
+# full resolution phone photo and checks that both produce the same annotated image
+#
+# Usage: python benchmarks/highlight_boundary.py [--size 3024 4032] [--objects 400] [--repeat 3]
+
+import argparse
+import sys
+import time
+from functools import reduce
+from pathlib import Path
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / 'src'))
+from image_processing import highlight_boundary
+
+COLORS = {1: 'red', 2: 'blue', 3: 'green', 4: 'yellow'}
+
+def legacy_highlight_boundary(img, mask, width=1, classes=1, class_dct={}, colors={}):
+    """The original implementation, kept verbatim as the reference output"""
+    class_dct.update({0:0})
+    mask_arr = np.asarray(mask, dtype=np.uint8)
+
+    f = lambda x: class_dct[x]
+    f = np.vectorize(f)
+    mask_arr = f(mask_arr)
+
+    classes_ids = np.unique(list(class_dct.values()))
+    colors_imgs = {}
+    class_imgs = {}
+    for i in classes_ids:
+        if i == 0: continue
+        mask_i = (mask_arr == i).astype(np.int32)
+        colors_imgs[i] = (Image.new(mode='RGB', size=img.size, color=colors[i]))
+        class_imgs[i] = mask_i
+
+    highlighted_img = img.copy()
+
+    for i in colors_imgs:
+        mask_arr = class_imgs[i]
+        right_arr = np.roll(mask_arr, shift=1, axis=0)
+        left_arr = np.roll(mask_arr, shift=-1, axis=0)
+        up_arr = np.roll(mask_arr, shift=1, axis=1)
+        down_arr = np.roll(mask_arr, shift=-1, axis=1)
+
+        shifts = [right_arr, left_arr, up_arr, down_arr]
+        xor_shifts = list(map(lambda x: np.logical_xor(x, mask_arr), shifts))
+
+        boundary = reduce(lambda x, y: np.logical_or(x, y), xor_shifts)
+        for roll in range(width - 1):
+            right_arr = np.roll(boundary, shift=1, axis=0)
+            left_arr = np.roll(boundary, shift=-1, axis=0)
+            up_arr = np.roll(boundary, shift=1, axis=1)
+            down_arr = np.roll(boundary, shift=-1, axis=1)
+            shifts = [right_arr, left_arr, up_arr, down_arr]
+            boundary = reduce(lambda x, y: np.logical_or(x, y), shifts, boundary)
+
+        boundary_img = Image.new(mode='1', size=mask.size)
+        boundary_img.putdata(boundary.flatten())
+
+        highlighted_img.paste(colors_imgs[i], box=(0, 0), mask=boundary_img)
+
+    return highlighted_img
+
+def synthetic_tray(size, objects, seed=0):
+    """Random touching and overlapping circles on a noisy background, similar to a dense oyster tray"""
+    rng = np.random.default_rng(seed)
+    width, height = size
+    img = Image.fromarray(rng.integers(0, 255, size=(height, width, 3), dtype=np.uint8))
+    mask = Image.new(mode='L', size=size, color=0)
+    canvas = ImageDraw.Draw(mask)
+
+    objects = min(objects, 255)
+    radius = max(4, int(min(size) / 40))
+    for label in range(1, objects + 1):
+        x, y = rng.integers(0, width), rng.integers(0, height)
+        canvas.ellipse((x - radius, y - radius, x + radius, y + radius), fill=label)
+    class_dct = {label: int(rng.integers(1, 5)) for label in range(1, objects + 1)}
+    return img, mask, class_dct
+
+def best_of(repeat, func):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        out = func()
+        times.append(time.perf_counter() - start)
+    return min(times), out
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--size', nargs=2, type=int, default=(3024, 4032), metavar=('WIDTH', 'HEIGHT'))
+    parser.add_argument('--objects', type=int, default=255)
+    parser.add_argument('--width', type=int, default=4)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    img, mask, class_dct = synthetic_tray(tuple(args.size), args.objects)
+
+    new_time, new_out = best_of(args.repeat, lambda: highlight_boundary(img, mask, width=args.width, class_dct=dict(class_dct), colors=COLORS))
+    old_time, old_out = best_of(1, lambda: legacy_highlight_boundary(img, mask, width=args.width, class_dct=dict(class_dct), colors=COLORS))
+
+    identical = np.array_equal(np.asarray(new_out), np.asarray(old_out))
+    print(f'image size: {args.size[0]}x{args.size[1]}, objects: {args.objects}, width: {args.width}')
+    print(f'legacy:  {old_time:8.3f} s')
+    print(f'current: {new_time:8.3f} s ({old_time / new_time:.1f}x faster)')
+    print(f'identical output: {identical}')
+    sys.exit(0 if identical else 1)
@@ -0,0 +1,92 @@
+# Startup benchmark for the desktop app
+# Starts a fresh interpreter that builds the main window the same way main.py does and measures the wall time until
+# the first paint, i.e. until the window has been drawn once, before the model libraries are warmed up. Each run is a
+# new process so nothing is already imported. With --importtime the slowest imports of the last run are listed,
+# parsed from python -X importtime, to spot heavy modules that slipped back onto the startup path
+#
+# Runs from the repository root like the app itself and needs a display, use xvfb-run on a headless machine
+#
+# Usage: python benchmarks/startup.py [--repeat 5] [--importtime] [--top 15]
+
+import argparse
+import os
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+
+# Printed by the child process once the window has been drawn
+PAINTED = 'painted'
+
+CHILD = f'''
+import sys
+sys.path.insert(0, {str(ROOT / 'src')!r})
+import tkinter as tk
+from pages import OysterPage
+root = tk.Tk()
+frame = OysterPage()
+frame.grid(row=0, column=0, sticky='NSEW')
+root.rowconfigure(0, weight=1)
+root.columnconfigure(0, weight=1)
+root.update()
+print({PAINTED!r}, flush=True)
+heavy = [name for name in ('tensorflow', 'stardist', 'csbdeep', 'pandas', 'scipy', 'matplotlib', 'cv2') if name in sys.modules]
+print('heavy modules imported: ' + (', '.join(heavy) or 'none'), flush=True)
+root.destroy()
+'''
+
+def time_to_first_paint(importtime=False):
+    """Runs the child once and returns the seconds until it reported the first paint, its output and the import log
+    """
+    command = [sys.executable] + (['-X', 'importtime'] if importtime else []) + ['-c', CHILD]
+    start = time.perf_counter()
+    process = subprocess.Popen(command, cwd=ROOT, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    elapsed = None
+    lines = []
+    for line in process.stdout:
+        if elapsed is None and line.strip() == PAINTED:
+            elapsed = time.perf_counter() - start
+        else:
+            lines.append(line.rstrip())
+    stderr = process.stderr.read()
+    if process.wait() != 0 or elapsed is None:
+        raise RuntimeError(f'startup failed:\n{stderr}')
+    return elapsed, lines, stderr
+
+def slowest_imports(stderr, top):
+    """Parses python -X importtime output into the top (cumulative microseconds, module) entries
+    """
+    entries = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|', 2)
+        entries.append((int(cumulative), name.strip()))
+    return sorted(entries, reverse=True)[:top]
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--importtime', action='store_true', help='list the slowest imports of one extra run')
+    parser.add_argument('--top', type=int, default=15)
+    args = parser.parse_args()
+
+    if sys.platform.startswith('linux') and not os.environ.get('DISPLAY') and not os.environ.get('WAYLAND_DISPLAY'):
+        sys.exit('No display found, run under xvfb-run')
+
+    times = []
+    for _ in range(args.repeat):
+        elapsed, lines, _ = time_to_first_paint()
+        times.append(elapsed)
+    times.sort()
+    print(f'time to first paint over {args.repeat} runs: best {times[0]:.3f} s, median {times[len(times) // 2]:.3f} s')
+    for line in lines:
+        print(line)
+
+    if args.importtime:
+        _, _, stderr = time_to_first_paint(importtime=True)
+        print(f'slowest imports (cumulative):')
+        for cumulative, name in slowest_imports(stderr, args.top):
+            print(f'{cumulative / 1e6:8.3f} s  {name}')
@@ -0,0 +1,216 @@
+# Motivation for this file:
+# The live camera preview used to read, copy, convert and resize every full resolution frame on the Tk thread,
+# which blocks the interface at high resolutions and drops frames. This file moves frame capture onto a dedicated
+# grabber thread. The grabber downscales each frame with cv2.resize before any colour conversion and keeps only the
+# latest preview in a single slot, so the Tk thread only wraps small ready-made arrays. Captures use a separate full
+# resolution still path that never goes through the preview scaling. On the Raspberry Pi camera the preview runs on
+# a small stream and a capture briefly switches the sensor to its full resolution still configuration
+
+import threading
+import time
+import cv2
+
+# Size of the picamera2 preview stream, captures switch to the full sensor resolution
+PICAMERA_PREVIEW_SIZE = (1280, 960)
+# Seconds waited after a failed read, and failed reads in a row after which the camera is considered gone
+READ_RETRY_DELAY = 0.02
+MAX_READ_FAILURES = 250
+
+class WebcamSource:
+    # Colour conversion of a frame for the preview (RGB), None when already in that order
+    preview_conversion = cv2.COLOR_BGR2RGB
+
+    def __init__(self, index=0, resolution=(9999, 9999)):
+        """An OpenCV video capture device, opened at the largest resolution it supports up to resolution
+
+        Args:
+            index (int, optional): The capture device index. Defaults to 0.
+            resolution (tuple, optional): Requested (width, height), the device picks its closest mode. Defaults to (9999, 9999).
+
+        Raises:
+            OSError: If the device could not be opened
+        """
+        self.cap = cv2.VideoCapture(index)
+        if not self.cap.isOpened():
+            raise OSError('Could not open webcam')
+        self.cap.set(cv2.CAP_PROP_FRAME_WIDTH, resolution[0])
+        self.cap.set(cv2.CAP_PROP_FRAME_HEIGHT, resolution[1])
+
+    @property
+    def size(self):
+        return int(self.cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+
+    def read(self):
+        # Blocks until the next frame, every frame is a new array so it can be handed on without copying
+        ok, frame = self.cap.read()
+        return frame if ok else None
+
+    def still(self, latest):
+        # A webcam has no separate still mode, the latest full resolution frame is the still, already in BGR order
+        return latest
+
+    def close(self):
+        self.cap.release()
+
+class PicameraSource:
+    preview_conversion = cv2.COLOR_RGBA2RGB
+
+    def __init__(self, preview_size=PICAMERA_PREVIEW_SIZE):
+        """The Raspberry Pi camera through picamera2, streaming a small preview and capturing full resolution stills
+
+        Args:
+            preview_size (tuple, optional): (width, height) of the preview stream. Defaults to PICAMERA_PREVIEW_SIZE.
+        """
+        from picamera2 import Picamera2 # type: ignore
+        self.picam = Picamera2()
+        self.picam.configure(self.picam.create_preview_configuration(main={'size': tuple(preview_size)}))
+        # RGB888 arrays are stored in BGR order, ready for OpenCV
+        self.still_config = self.picam.create_still_configuration(main={'format': 'RGB888'})
+        self.picam.start()
+
+    @property
+    def size(self):
+        cam_res = self.picam.capture_metadata()['ScalerCrop'][2:]
+        return tuple(cam_res) if cam_res else (640, 480)
+
+    def read(self):
+        return self.picam.capture_array()
+
+    def still(self, latest):
+        # Switches to the full sensor still configuration for one frame, then back to the preview stream
+        return self.picam.switch_mode_and_capture_array(self.still_config)
+
+    def close(self):
+        self.picam.stop()
+        self.picam.close()
+
+class FrameGrabber:
+    def __init__(self, source, preview_size):
+        """Reads frames from a camera source on a background thread, keeping only the latest frame and its preview
+
+        Args:
+            source (WebcamSource | PicameraSource): The camera
+            preview_size (tuple): (width, height) previews are scaled to
+        """
+        self.source = source
+        self.preview_size = tuple(preview_size)
+
+        self._lock = threading.Lock()
+        # Held while the camera is in use, so a still capture never overlaps a preview read
+        self._source_lock = threading.Lock()
+        self._stop = threading.Event()
+        # Single slot buffer, each new frame replaces the previous one whether or not it was shown
+        self._frame = None
+        self._preview = None
+        self._sequence = 0
+        # The source is closed by whichever of stop() and the grabber thread finishes last
+        self._running = False
+        self._close_source = False
+        self._source_closed = False
+        self._thread = threading.Thread(target=self._run, name='FrameGrabber', daemon=True)
+
+    def start(self):
+        self._running = True
+        self._thread.start()
+        return self
+
+    def _run(self):
+        failures = 0
+        try:
+            while not self._stop.is_set():
+                try:
+                    with self._source_lock:
+                        frame = self.source.read()
+                except Exception as e:
+                    print(f"Warning: Camera read failed: {str(e)}")
+                    break
+                if frame is None:
+                    # An unplugged webcam fails every read straight away, wait instead of spinning
+                    failures += 1
+                    if failures >= MAX_READ_FAILURES:
+                        print("Warning: Camera stopped sending frames")
+                        break
+                    time.sleep(READ_RETRY_DELAY)
+                    continue
+                failures = 0
+                preview = self._scale(frame, self.preview_size)
+                with self._lock:
+                    self._frame = frame
+                    self._preview = preview
+                    self._sequence += 1
+        finally:
+            with self._lock:
+                self._running = False
+                close = self._close_source
+            if close:
+                self._close()
+
+    def _scale(self, frame, size):
+        # Scaled before the colour conversion so the conversion only touches preview sized pixels
+        width, height = max(1, size[0]), max(1, size[1])
+        preview = cv2.resize(frame, (width, height), interpolation=cv2.INTER_AREA)
+        if self.source.preview_conversion is not None:
+            preview = cv2.cvtColor(preview, self.source.preview_conversion)
+        return preview
+
+    def set_preview_size(self, size):
+        self.preview_size = tuple(size)
+
+    def preview(self, after=0):
+        """Returns the latest preview if it is newer than a sequence number
+
+        Args:
+            after (int, optional): The sequence number of the last preview shown. Defaults to 0.
+
+        Returns:
+            tuple: (sequence number, RGB preview array), or None if no newer frame has arrived
+        """
+        with self._lock:
+            if self._preview is None or self._sequence <= after:
+                return None
+            return self._sequence, self._preview
+
+    def still(self):
+        """Returns a full resolution still in BGR order, blocking while a Raspberry Pi camera switches modes, so it is
+        called from a worker thread
+
+        Returns:
+            numpy.ndarray: The still, None if no frame has arrived yet or the camera was closed
+        """
+        with self._lock:
+            latest = self._frame
+        if latest is None:
+            return None
+        with self._source_lock:
+            if self._source_closed:
+                return None
+            return self.source.still(latest)
+
+    def stop(self, close_source=False, timeout=1.0):
+        """Stops the grabber thread
+
+        Args:
+            close_source (bool, optional): Also close the camera, but only once no read is in progress. If the thread is
+                                           still blocked in a read after timeout, it closes the camera when it exits. Defaults to False.
+            timeout (float, optional): Seconds to wait for the thread. Defaults to 1.0.
+        """
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join(timeout)
+        with self._lock:
+            self._close_source = close_source
+            close = close_source and not self._running
+        if close:
+            self._close()
+
+    def _close(self):
+        # Waits for a still capture in progress, the camera is never closed under it
+        with self._source_lock:
+            with self._lock:
+                if self._source_closed:
+                    return
+                self._source_closed = True
+            try:
+                self.source.close()
+            except Exception as e:
+                print(f"Warning: Could not close camera: {str(e)}")
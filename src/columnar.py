@@ -0,0 +1,131 @@
+# Motivation for this file:
+# Seasons of results are reloaded for analysis, and parsing years of CSV exports dominates that time. This file
+# writes and reads the same tables as Apache Parquet or Arrow IPC files with typed columns, through pyarrow when it
+# is installed. Arrow IPC files are memory mapped when read. Every file records the kind of table it holds and a
+# schema version in its metadata so older exports can still be told apart and upgraded when the columns change
+
+import os
+from pathlib import Path
+
+# Bump together with the schemas below, files written by a newer version are still read with a warning
+SCHEMA_VERSION = 1
+
+# File suffixes of each columnar format
+FORMAT_SUFFIXES = {
+    'parquet': '.parquet',
+    'arrow': '.arrow'
+}
+COLUMNAR_SUFFIXES = ('.parquet', '.arrow', '.feather')
+
+# Metadata keys written into every file
+KIND_KEY = b'devision.kind'
+VERSION_KEY = b'devision.schema-version'
+
+def has_pyarrow():
+    try:
+        import pyarrow # type: ignore
+        return True
+    except ImportError:
+        return False
+
+def _schemas():
+    import pyarrow as pa
+    return {
+        'oyster-data': pa.schema([
+            ('model', pa.string()),
+            ('group', pa.int64()),
+            ('file-name', pa.string()),
+            ('size-class', pa.string()),
+            ('seed-tray-weight', pa.float64()),
+            ('slide-weight', pa.float64()),
+            ('slide-and-seed-weight', pa.float64()),
+            ('subsample-count', pa.int64()),
+            ('total-number', pa.float64())
+        ]),
+        'oyster-stats': pa.schema([
+            ('group', pa.int64()),
+            ('mean', pa.float64()),
+            ('std', pa.float64()),
+            ('sem', pa.float64()),
+            ('dof', pa.int64()),
+            ('confidence95', pa.float64())
+        ]),
+        'devision-data': pa.schema([
+            ('Datetime', pa.timestamp('us')),
+            ('Model', pa.string()),
+            ('Filename', pa.string()),
+            ('Total Count', pa.int64()),
+            ('Class 0 Count', pa.int64()),
+            ('Class 1 Count', pa.int64()),
+            ('Class 2 Count', pa.int64()),
+            ('Class 3 Count', pa.int64())
+        ])
+    }
+
+def is_columnar(file_path):
+    """Returns whether a file path has a Parquet or Arrow IPC suffix
+    """
+    return Path(file_path).suffix.lower() in COLUMNAR_SUFFIXES
+
+def write_table(df, file_path, kind):
+    """Writes a dataframe as a typed Parquet or Arrow IPC file, chosen by the file suffix
+
+    Args:
+        df (pandas.DataFrame): The table, its columns must match the schema of kind
+        file_path (os.PathLike): The file to write, ending in .parquet, .arrow or .feather
+        kind (str): The table kind, one of 'oyster-data', 'oyster-stats' or 'devision-data'
+
+    Raises:
+        ImportError: If pyarrow is not installed
+    """
+    import pyarrow as pa
+
+    schema = _schemas()[kind].with_metadata({KIND_KEY: kind.encode(), VERSION_KEY: str(SCHEMA_VERSION).encode()})
+    table = pa.Table.from_pandas(df[schema.names], schema=schema, preserve_index=False)
+
+    file_path = Path(file_path)
+    os.makedirs(file_path.parent, exist_ok=True)
+    # Written next to the old file and renamed over it, so a failed write never leaves half a file
+    temp_path = file_path.with_name(file_path.name + '.tmp')
+    if file_path.suffix.lower() == '.parquet':
+        import pyarrow.parquet as pq
+        pq.write_table(table, temp_path)
+    else:
+        import pyarrow.ipc as ipc
+        with pa.OSFile(str(temp_path), 'wb') as sink:
+            with ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+    os.replace(temp_path, file_path)
+
+def read_table(file_path, kind=None):
+    """Reads a Parquet or Arrow IPC file into a dataframe, Arrow IPC files are memory mapped
+
+    Args:
+        file_path (os.PathLike): The file to read
+        kind (str, optional): The table kind expected, a file holding another kind is reported. Defaults to None.
+
+    Returns:
+        pandas.DataFrame: The table
+
+    Raises:
+        ImportError: If pyarrow is not installed
+        ValueError: If the file holds a different kind of table
+    """
+    import pyarrow as pa
+
+    if Path(file_path).suffix.lower() == '.parquet':
+        import pyarrow.parquet as pq
+        table = pq.read_table(file_path, memory_map=True)
+    else:
+        import pyarrow.ipc as ipc
+        with pa.memory_map(str(file_path), 'r') as source:
+            table = ipc.open_file(source).read_all()
+
+    metadata = table.schema.metadata or {}
+    file_kind = metadata.get(KIND_KEY, b'').decode() or None
+    if kind is not None and file_kind is not None and file_kind != kind:
+        raise ValueError(f'{file_path} holds {file_kind}, not {kind}')
+    version = int(metadata.get(VERSION_KEY, b'0') or 0)
+    if version > SCHEMA_VERSION:
+        print(f"Warning: {file_path} was written with schema version {version}, newer than {SCHEMA_VERSION}")
+    return table.to_pandas()
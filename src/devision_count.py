@@ -0,0 +1,302 @@
+# Motivation for this file:
+# Counting overnight on a server has no display to open the Tk pages on. This is a headless command line
+# entry point over the same prediction, annotation and oyster statistics code the pages use, without
+# importing tkinter or ttkbootstrap. Results are streamed to CSV as each image finishes so a long run can be
+# followed, and interrupted, without losing the images already counted. An image that cannot be read or predicted
+# gets a row with its error and the run carries on, --append resumes an interrupted run
+#
+# Usage:
+#   python src/devision_count.py MODEL IMAGES [IMAGES ...] --output DIR [--weights SIDECAR.csv] [--no-annotate] [--append]
+#
+# Examples:
+#   python src/devision_count.py 2-4mm "trays/2025-06-*/*.jpg" --weights trays/weights.csv --output results
+#   python src/devision_count.py models/frog-egg-counter photos/ --output results --no-annotate
+
+import argparse
+import csv
+import glob
+import os
+import sys
+from pathlib import Path
+
+from model import Predictor
+from pipeline import PredictionPipeline, ProcessPredictionPool
+from oyster_data import OysterData
+
+# Short model names accepted in place of a model directory
+MODEL_NAMES = {
+    '2-4mm': 'models/oyster_2-4mm',
+    '4-6mm': 'models/oyster_4-6mm',
+    'frog-egg-counter': 'models/frog-egg-counter',
+    'xenopus-4-class': 'models/xenopus-4-class-v2'
+}
+
+IMAGE_SUFFIXES = ('.jpg', '.jpeg', '.png', '.tif', '.tiff')
+
+COUNT_COLUMNS = ['File', 'Model', 'Total Count', 'Class 0 Count', 'Class 1 Count', 'Class 2 Count', 'Class 3 Count', 'Error']
+
+# Oyster sample fields every sidecar row must provide, in OysterData column names
+WEIGHT_FIELDS = ['group', 'size-class', 'seed-tray-weight', 'slide-weight', 'slide-and-seed-weight']
+
+def resolve_model(model):
+    """Turns a short model name, a model directory or a folder name inside models/ into a model directory
+
+    Args:
+        model (str): The model argument given on the command line
+
+    Returns:
+        pathlib.Path: The model directory
+
+    Raises:
+        FileNotFoundError: If no model directory matches
+    """
+    if model in MODEL_NAMES:
+        return Path(MODEL_NAMES[model])
+    if Path(model).is_dir():
+        return Path(model)
+    if (Path('models') / model).is_dir():
+        return Path('models') / model
+    raise FileNotFoundError(f'No model named {model}, use a model directory or one of {", ".join(MODEL_NAMES)}')
+
+def find_images(patterns):
+    """Expands folders and glob patterns into a sorted list of image files
+
+    Args:
+        patterns (list[str]): Folders, files or glob patterns, '**' searches recursively
+
+    Returns:
+        list[pathlib.Path]: Every matching image, without duplicates
+    """
+    found = []
+    for pattern in patterns:
+        if Path(pattern).is_dir():
+            matches = [str(path) for path in Path(pattern).iterdir()]
+        else:
+            matches = glob.glob(pattern, recursive=True)
+        found.extend(Path(match).resolve() for match in matches if Path(match).suffix.lower() in IMAGE_SUFFIXES)
+    return sorted(set(found))
+
+def image_labels(images):
+    """Names every image by its path relative to the folder all images share, so images with the same file name in
+    different folders stay apart. Images in a single folder keep their plain file names
+
+    Args:
+        images (list[pathlib.Path]): Resolved image files
+
+    Returns:
+        list[str]: The relative path of each image with / separators
+    """
+    if not images:
+        return []
+    root = Path(os.path.commonpath([str(path.parent) for path in images]))
+    return [path.relative_to(root).as_posix() for path in images]
+
+def read_weights(file_path):
+    """Reads the oyster weight sidecar, a CSV with a file name column and the sample fields in WEIGHT_FIELDS.
+    Columns may use either the exported (readable) or the internal OysterData names
+
+    Args:
+        file_path (os.PathLike): The sidecar CSV file
+
+    Returns:
+        dict: Sample fields keyed by the image file name or relative path given in the sidecar
+    """
+    readable_to_data = OysterData().readable_to_data
+    weights = {}
+    with open(file_path, newline='') as file:
+        for row in csv.DictReader(file):
+            row = {readable_to_data.get(k.strip(), k.strip()): v.strip() for k, v in row.items() if k}
+            missing = [field for field in ['file-name'] + WEIGHT_FIELDS if not row.get(field)]
+            if missing:
+                print(f"Warning: Skipping weights for {row.get('file-name', '?')}, missing {', '.join(missing)}", file=sys.stderr)
+                continue
+            weights[Path(row['file-name']).as_posix()] = row
+    return weights
+
+def annotation_name(label):
+    """Returns the annotation file of an image label, keeping the source suffix so a.jpg and a.png stay apart
+
+    Args:
+        label (str): The image label from image_labels
+
+    Returns:
+        pathlib.Path: The annotation file relative to the annotation folder
+    """
+    label = Path(label)
+    return label.parent / f'{label.stem}-{label.suffix[1:].lower()}-annotation.png'
+
+def counted_files(file_path):
+    """Reads the files an earlier run already counted from its counts CSV, rows with an error are not included so
+    those images are tried again
+
+    Args:
+        file_path (os.PathLike): The counts CSV
+
+    Returns:
+        set[str]: The labels of the counted images, empty if the file does not exist
+
+    Raises:
+        ValueError: If the file was written with other columns
+    """
+    if not os.path.exists(file_path) or os.path.getsize(file_path) == 0:
+        return set()
+    with open(file_path, newline='') as file:
+        reader = csv.DictReader(file)
+        if reader.fieldnames != COUNT_COLUMNS:
+            raise ValueError(f'{file_path} has the columns {reader.fieldnames}, expected {COUNT_COLUMNS}')
+        return {row['File'] for row in reader if not row['Error']}
+
+def open_stream(file_path, columns, append=False):
+    """Opens a CSV file for streaming, writing the header only when the file is new
+
+    Args:
+        file_path (os.PathLike): The CSV file
+        columns (list[str]): The header
+        append (bool, optional): Keep the rows already in the file, it is replaced otherwise. Defaults to False.
+
+    Returns:
+        tuple: The open file and its csv.writer
+    """
+    new_file = not append or not os.path.exists(file_path) or os.path.getsize(file_path) == 0
+    file = open(file_path, 'w' if new_file else 'a', newline='')
+    writer = csv.writer(file)
+    if new_file:
+        writer.writerow(columns)
+        file.flush()
+    return file, writer
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='devision-count', description='Count objects in images without opening the GUI.')
+    parser.add_argument('model', help=f'model directory, folder name inside models/, or one of: {", ".join(MODEL_NAMES)}')
+    parser.add_argument('images', nargs='+', help='image files, folders or glob patterns')
+    parser.add_argument('-o', '--output', required=True, help='folder the CSV files and annotations are written to')
+    parser.add_argument('-w', '--weights', help='oyster weight sidecar CSV with file-name, group, size-class, seed-tray-weight, slide-weight and slide-and-seed-weight columns')
+    parser.add_argument('--no-annotate', action='store_true', help='do not save annotated images')
+    parser.add_argument('--workers', type=int, default=0, help='worker processes, 0 predicts in this process (default: 0)')
+    parser.add_argument('--append', action='store_true', help='keep the rows of an earlier run in the output folder and skip the images it counted, '
+                                                              'the CSV files are replaced otherwise')
+    args = parser.parse_args(argv)
+
+    model_dir = resolve_model(args.model)
+    images = find_images(args.images)
+    if not images:
+        parser.error('no images matched')
+
+    output_dir = Path(args.output)
+    annotation_dir = output_dir / 'annotations'
+    os.makedirs(output_dir, exist_ok=True)
+    annotate = not args.no_annotate
+
+    weights = read_weights(args.weights) if args.weights else {}
+    oyster_path = output_dir / 'oyster-data.csv'
+    oyster_data = OysterData(file_name=str(oyster_path))
+
+    # Labels keep images of the same name in different folders apart in the CSV files, the weights and the annotations,
+    # which mirror the folders below the shared root
+    labels = image_labels(images)
+    name_counts = {}
+    for path in images:
+        name_counts[path.name] = name_counts.get(path.name, 0) + 1
+    annotation_fps = {
+        index: str(annotation_dir / annotation_name(label)) if annotate else None
+        for index, label in enumerate(labels)
+    }
+    
+    # Labels are taken over every image first, so a resumed run names the images the same way
+    indices = list(range(len(images)))
+    if args.append:
+        try:
+            counted = counted_files(output_dir / 'counts.csv')
+        except ValueError as e:
+            parser.error(f'cannot append, {e}')
+        indices = [index for index in indices if labels[index] not in counted]
+        if len(indices) < len(images):
+            print(f'Skipping {len(images) - len(indices)} images already counted', file=sys.stderr)
+        # The statistics cover the rows of the earlier run as well
+        if weights and os.path.exists(oyster_path):
+            oyster_data.read_csv(oyster_path)
+
+    def save(index, result):
+        if result.annotation is not None:
+            os.makedirs(os.path.dirname(annotation_fps[index]), exist_ok=True)
+            result.annotation.save(fp=annotation_fps[index])
+
+    weights_by_name = {Path(key).name: sample for key, sample in weights.items()}
+
+    def find_weights(index):
+        # A sidecar listing plain file names, or paths from another folder, still matches as long as the name is unique
+        sample = weights.get(labels[index])
+        if sample is None and name_counts[images[index].name] == 1:
+            sample = weights_by_name.get(images[index].name)
+        return sample
+
+    def progress(counts, total):
+        print(f"\r{counts['annotate']}/{total} images counted", end='', file=sys.stderr, flush=True)
+
+    print(f'Counting {len(indices)} images with {model_dir}', file=sys.stderr)
+    if args.workers >= 2:
+        pool = ProcessPredictionPool(model_dir, args.workers)
+        jobs = [(index, images[index], annotation_fps[index]) for index in indices]
+        results = pool.run(jobs, annotate=annotate, progress=progress)
+    else:
+        pool = None
+        pipeline = PredictionPipeline(Predictor(model_dir), annotate=annotate, save=save, progress=progress)
+        results = pipeline.run((index, images[index]) for index in indices)
+
+    counts_file, counts_writer = open_stream(output_dir / 'counts.csv', COUNT_COLUMNS, append=args.append)
+    oyster_file, oyster_writer = None, None
+    if weights:
+        oyster_columns = [oyster_data.data_to_readable[column] for column in oyster_data.columns]
+        oyster_file, oyster_writer = open_stream(oyster_path, oyster_columns, append=args.append)
+
+    failed = 0
+    try:
+        for index, result in results:
+            file_name = labels[index]
+            if isinstance(result, Exception):
+                # A corrupt or unreadable image is recorded and skipped, the rest of the run carries on
+                failed += 1
+                print(f"\nWarning: Could not count {file_name}: {str(result)}", file=sys.stderr)
+                counts_writer.writerow([file_name, model_dir.name, '', '', '', '', '', str(result) or type(result).__name__])
+                counts_file.flush()
+                continue
+            counts_writer.writerow([file_name, model_dir.name, result.count] + [result.count_dct.get(i, 0) for i in range(4)] + [''])
+            counts_file.flush()
+
+            sample = find_weights(index)
+            if sample is not None:
+                try:
+                    oyster_data.insert(
+                        model=model_dir.name,
+                        group_number=sample['group'],
+                        file_name=file_name,
+                        size_class=sample['size-class'],
+                        seed_tray_weight=float(sample['seed-tray-weight']),
+                        slide_weight=float(sample['slide-weight']),
+                        slide_and_seed_weight=float(sample['slide-and-seed-weight']),
+                        subsample_count=result.count
+                    )
+                except (ValueError, ZeroDivisionError) as e:
+                    print(f"\nWarning: Could not compute total for {file_name}: {str(e)}", file=sys.stderr)
+                else:
+                    oyster_writer.writerow(oyster_data.row(file_name))
+                    oyster_file.flush()
+    finally:
+        print(file=sys.stderr)
+        counts_file.close()
+        if oyster_file is not None:
+            oyster_file.close()
+        if pool is not None:
+            pool.close()
+
+    if len(oyster_data) > 0:
+        stats_path = output_dir / 'oyster-datastats.csv'
+        oyster_data.stats.to_csv(stats_path)
+        print(f'Stats csv saved successfully at: {stats_path}', file=sys.stderr)
+    if failed:
+        print(f'{failed} of {len(indices)} images could not be counted, see the Error column of counts.csv', file=sys.stderr)
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
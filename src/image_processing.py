@@ -1,15 +1,26 @@
 from PIL import Image, ImageDraw
-from PIL.ImageTk import PhotoImage
 from pathlib import Path
+import atexit
+import hashlib
 import json
 import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
-from functools import reduce
-from matplotlib import pyplot as plt
 
 THUMBNAIL_SIZE = (400, 400)
 DARKBLUE = (0, 0, 75)
 
+# Default memory budget of decoded full resolution images, a 12-MP RGB photo takes about 36 MB
+IMAGE_CACHE_MB = 512
+
+# Disk budget of the thumbnail cache, a thumbnail takes about 30 kB
+THUMBNAIL_CACHE_MB = 64
+
+# Seconds an ImageList waits after a change before saving, every change in that window is saved in one write
+IMAGE_LIST_FLUSH_DELAY = 1.0
+
 # Helper function for path resolution
 def get_data_path(relative_path: os.PathLike):
     """Helper function to get data path with environment variable support
@@ -43,141 +54,603 @@ def get_data_path(relative_path: os.PathLike):
             
     return path
 
+class ThumbnailCache:
+    def __init__(self, directory='data/thumbnails', size=THUMBNAIL_SIZE, budget_mb=THUMBNAIL_CACHE_MB):
+        """On-disk cache of thumbnails, each stored under a hash of the image path, modification time and file size,
+           so an edited or replaced image gets a new thumbnail and unchanged images are never reopened. The least
+           recently used thumbnails are removed once the folder outgrows its budget
+
+        Args:
+            directory (os.PathLike, optional): Folder the thumbnails are stored in. Defaults to 'data/thumbnails'.
+            size (tuple, optional): Thumbnail size. Defaults to THUMBNAIL_SIZE.
+            budget_mb (float, optional): Disk budget in megabytes. Defaults to THUMBNAIL_CACHE_MB.
+        """
+        self.directory = get_data_path(directory)
+        self.size = tuple(size)
+        self.budget = int(budget_mb * 1024 * 1024)
+        self.total = 0
+        
+        # File name -> size, least recently used first, read from the folder on first use
+        self._files = None
+        self._lock = threading.Lock()
+    
+    def key(self, path):
+        """Returns the cache key of an image file
+
+        Args:
+            path (os.PathLike): The image file
+
+        Returns:
+            str: Hex digest of the path, modification time, file size and thumbnail size
+        """
+        stat = os.stat(path)
+        identity = f'{Path(path).resolve()}|{stat.st_mtime_ns}|{stat.st_size}|{self.size[0]}x{self.size[1]}'
+        return hashlib.sha1(identity.encode()).hexdigest()
+    
+    def ensure(self, path):
+        """Creates the thumbnail of an image if it is not cached yet
+
+        Args:
+            path (os.PathLike): The image file
+
+        Returns:
+            pathlib.Path: The cached thumbnail file
+        """
+        thumbnail_path = self.directory / f'{self.key(path)}.jpg'
+        if thumbnail_path.exists():
+            self._touch(thumbnail_path)
+            return thumbnail_path
+        
+        with Image.open(path) as image:
+            # JPEG files are decoded straight at a reduced scale, other formats ignore the request
+            image.draft('RGB', self.size)
+            thumbnail = image.convert('RGB').resize(self.size)
+        
+        os.makedirs(self.directory, exist_ok=True)
+        # Written under a temporary name so a concurrent reader never sees a partial file
+        temp_path = thumbnail_path.with_name(f'{thumbnail_path.stem}.{threading.get_ident()}.tmp')
+        thumbnail.save(temp_path, format='JPEG', quality=90)
+        os.replace(temp_path, thumbnail_path)
+        self._add(thumbnail_path)
+        return thumbnail_path
+    
+    def get(self, path):
+        """Returns the thumbnail of an image, creating and storing it on a miss
+
+        Args:
+            path (os.PathLike): The image file
+
+        Returns:
+            PIL.Image.Image: The thumbnail
+        """
+        with Image.open(self.ensure(path)) as thumbnail:
+            thumbnail.load()
+        return thumbnail
+    
+    def _touch(self, thumbnail_path):
+        with self._lock:
+            self._index()
+            if thumbnail_path.name in self._files:
+                self._files.move_to_end(thumbnail_path.name)
+        try:
+            # The modification time orders the thumbnails when the folder is read again
+            os.utime(thumbnail_path)
+        except OSError:
+            pass
+    
+    def _add(self, thumbnail_path):
+        try:
+            size = os.path.getsize(thumbnail_path)
+        except OSError:
+            return
+        with self._lock:
+            self._index()
+            self.total += size - self._files.pop(thumbnail_path.name, 0)
+            self._files[thumbnail_path.name] = size
+            # Never remove the thumbnail just written
+            while self.total > self.budget and len(self._files) > 1:
+                name, old_size = self._files.popitem(last=False)
+                self.total -= old_size
+                try:
+                    os.remove(self.directory / name)
+                except OSError:
+                    pass
+    
+    def _index(self):
+        # Called with the lock held
+        if self._files is not None:
+            return
+        entries = []
+        if self.directory.exists():
+            for thumbnail_path in self.directory.glob('*.jpg'):
+                try:
+                    stat = thumbnail_path.stat()
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime_ns, thumbnail_path.name, stat.st_size))
+        self._files = OrderedDict((name, size) for _, name, size in sorted(entries))
+        self.total = sum(self._files.values())
+
 class ImageList(list):
-    def __init__(self, name, iterable=[]):
+    # Shared by every list, thumbnails of the same image are reused between lists and sessions
+    thumbnails = ThumbnailCache()
+    # The current list of every name, the ones flushed at shutdown
+    _instances = {}
+    
+    def __init__(self, name, iterable=[], persist=True):
         """Listlike object that contains paths and image references, but appends via image path for convienience
-           Use ImageList().paths to access the underlying path objects
+           Use ImageList().paths to access the underlying path objects. Thumbnails are only created when an item is
+           first accessed, so building a list never opens the images, and are read from the ThumbnailCache when the
+           image has been seen before. Changes are saved to data/ImageList<name>.json in the background, batched
+           over IMAGE_LIST_FLUSH_DELAY seconds, and at shutdown
             *args: Iterable of path-like objects
+            persist (bool, optional): Save the list to its json file, False when the paths are kept elsewhere such as
+                                      the pages' session database. Defaults to True.
             
         """
+        # PIL.ImageTk pulls in tkinter, it is imported here so the rest of this module works headless
+        from PIL.ImageTk import PhotoImage
+        
         self.name = name
+        self.persist = persist
         
         self.black_photoimage = PhotoImage(Image.new(mode='RGB', color=(0, 0, 0), size=THUMBNAIL_SIZE))
-        self.paths = []
-        images = []
-        for path in iterable:
-            path, image = self._process_path(path)
-            self.paths.append(path)
-            images.append(image)
+        self.paths = [self._process_path(path) for path in iterable]
+        
+        self._dirty = False
+        self._flush_timer = None
+        self._flush_lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        # A list replacing an older one of the same name must not be overwritten by that list's pending save
+        previous = ImageList._instances.get(name)
+        if previous is not None:
+            previous._cancel_flush()
+        if persist:
+            ImageList._instances[name] = self
+        else:
+            ImageList._instances.pop(name, None)
         
-        super().__init__(images)
-        self._json_dump()
+        # Placeholders until the thumbnail is requested
+        super().__init__([None] * len(self.paths))
+        self._mark_dirty()
+    
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return [self[index] for index in range(*key.indices(len(self)))]
+        
+        image = super().__getitem__(key)
+        if image is None:
+            image = self._thumbnail(self.paths[key])
+            super().__setitem__(key, image)
+        return image
+    
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
     
     def __setitem__(self, key, value):
-        path, image = self._process_path(value)
-        self.paths[key] = path
-        super().__setitem__(key, image)
-        self._json_dump()
+        self.paths[key] = self._process_path(value)
+        super().__setitem__(key, None)
+        self._mark_dirty()
 
     def __delitem__(self, key):
         del self.paths[key]
         return_value = super().__delitem__(key)
-        self._json_dump()
+        self._mark_dirty()
         return return_value
     
     def extend(self, iterable):
-        paths = []
-        images = []
-        for path in iterable:
-            path, image = self._process_path(path)
-            paths.append(path)
-            images.append(image)
-            
+        paths = [self._process_path(path) for path in iterable]
         self.paths.extend(paths)
-        super().extend(images)
-        self._json_dump()
+        super().extend([None] * len(paths))
+        self._mark_dirty()
 
     def append(self, path):
-        path, image = self._process_path(path)
-        self.paths.append(path)
-        super().append(image)
-        self._json_dump()
+        self.paths.append(self._process_path(path))
+        super().append(None)
+        self._mark_dirty()
     
     def _process_path(self, path):
         if path == None or path == 'None':
-            return None, self.black_photoimage
+            return None
+        return Path(path).resolve()
+    
+    def _thumbnail(self, path):
+        if path is None:
+            return self.black_photoimage
         
-        path = Path(path).resolve()
-        image = Image.open(path)
-        image_copy = PhotoImage(image.resize(THUMBNAIL_SIZE))
-        image.close()
+        from PIL.ImageTk import PhotoImage
         
-        return path, image_copy
+        try:
+            return PhotoImage(self.thumbnails.get(path))
+        except Exception as e:
+            print(f"Warning: Could not open image {path}: {str(e)}")
+            return self.black_photoimage
    
-    def _json_dump(self):
-        str_paths = list(map(lambda x: str(x), self.paths))
+    def flush(self):
+        """Saves the path list now if it changed since the last save
+        """
+        # Held across the write so a slow save can't land after a newer one
+        with self._write_lock:
+            with self._flush_lock:
+                if self._flush_timer is not None:
+                    self._flush_timer.cancel()
+                    self._flush_timer = None
+                if not self._dirty:
+                    return
+                self._dirty = False
+                str_paths = list(map(lambda x: str(x), list(self.paths)))
+            self._json_dump(str_paths)
+    
+    def _mark_dirty(self):
+        if not self.persist:
+            return
+        with self._flush_lock:
+            self._dirty = True
+            if self._flush_timer is None:
+                self._flush_timer = threading.Timer(IMAGE_LIST_FLUSH_DELAY, self.flush)
+                self._flush_timer.daemon = True
+                self._flush_timer.start()
+    
+    def _cancel_flush(self):
+        with self._flush_lock:
+            self._dirty = False
+            if self._flush_timer is not None:
+                self._flush_timer.cancel()
+                self._flush_timer = None
+    
+    @staticmethod
+    def _atomic_dump(str_paths, file_path):
+        # Written to a temporary file and renamed over the old list, so a crash mid write leaves the old list intact
+        temp_path = Path(f'{file_path}.tmp')
+        with open(temp_path, 'w') as file:
+            json.dump(obj=str_paths, fp=file, indent=2)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temp_path, file_path)
+    
+    def _json_dump(self, str_paths):
         file_path = get_data_path(f'data/ImageList{self.name}.json')
         # Ensure parent directory exists
         try:
-            with open(file_path, 'w') as file:
-                json.dump(obj=str_paths, fp=file, indent=2)
+            self._atomic_dump(str_paths, file_path)
         except Exception as e:
             print(f"Warning: Could not save image list to {file_path}: {str(e)}")
             # Try to write to a fallback location if needed
             try:
                 fallback_path = Path(f'ImageList{self.name}.json')
                 print(str(fallback_path))
-                with open(fallback_path, 'w') as file:
-                    json.dump(obj=str_paths, fp=file, indent=2)
+                self._atomic_dump(str_paths, fallback_path)
                 print(f"Saved image list to fallback location: {fallback_path}")
             except Exception as e2:
                 print(f"Failed to save image list to fallback location: {str(e2)}")
 
-def highlight_boundary(img: Image.Image, mask: Image.Image, width=1, classes=1, class_dct={}, colors={}):
-    """_summary_
+@atexit.register
+def _flush_image_lists():
+    for image_list in list(ImageList._instances.values()):
+        image_list.flush()
 
-    Args:
-        img (_type_): _description_
-    """
-    class_dct.update({0:0})
-    mask_arr = np.asarray(mask, dtype=np.uint8)
-
-    f = lambda x: class_dct[x]
-    f = np.vectorize(f)
-    mask_arr = f(mask_arr)
-        
-    classes_ids = np.unique(list(class_dct.values()))
-    colors_imgs = {}
-    class_imgs = {}
-    for i in classes_ids:
-        if i == 0: continue
-        mask_i = (mask_arr == i).astype(np.int32)
-        colors_imgs[i] = (Image.new(mode='RGB', size=img.size, color=colors[i]))
-        class_imgs[i] = mask_i
-        
-    highlighted_img = img.copy()
+class ImageCache:
+    def __init__(self, budget_mb=IMAGE_CACHE_MB):
+        """Least recently used cache of decoded images keyed by path, bounded by an approximate memory budget.
+           Misses are decoded from disk, and neighbouring images can be decoded ahead of time on a background thread
 
-    
-    for i in colors_imgs:
-        mask_arr = class_imgs[i]
-        right_arr = np.roll(mask_arr, shift=1, axis=0)
-        left_arr = np.roll(mask_arr, shift=-1, axis=0)
-        up_arr = np.roll(mask_arr, shift=1, axis=1)
-        down_arr = np.roll(mask_arr, shift=-1, axis=1)
+        Args:
+            budget_mb (float, optional): Memory budget of the decoded images in megabytes. Defaults to IMAGE_CACHE_MB.
+        """
+        self.budget = int(budget_mb * 1024 * 1024)
+        self.size = 0
         
-        shifts = [right_arr, left_arr, up_arr, down_arr]
-        xor_shifts = list(map(lambda x: np.logical_xor(x, mask_arr), shifts))
+        self._images = OrderedDict()
+        self._lock = threading.Lock()
+        self._pending = set()
+        # Bumped for a path whenever its cached image is replaced or dropped, and for every path by clear(). A decode
+        # that started before the bump read a stale file and is not stored
+        self._generations = {}
+        self._epoch = 0
+        self._prefetcher = ThreadPoolExecutor(max_workers=1, thread_name_prefix='ImageCachePrefetch')
+        # Files being written by save(), by path
+        self._writes = {}
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='ImageCacheWriter')
+    
+    def get(self, path):
+        """Returns the decoded image of a path, decoding it on a miss
+
+        Args:
+            path (os.PathLike): The image file
+
+        Returns:
+            PIL.Image.Image: The decoded image, None if path is None or the file could not be read
+        """
+        if path is None:
+            return None
         
-        boundary = reduce(lambda x, y: np.logical_or(x, y), xor_shifts)
-        for roll in range(width - 1):
-            right_arr = np.roll(boundary, shift=1, axis=0)
-            left_arr = np.roll(boundary, shift=-1, axis=0)
-            up_arr = np.roll(boundary, shift=1, axis=1)
-            down_arr = np.roll(boundary, shift=-1, axis=1)
-            shifts = [right_arr, left_arr, up_arr, down_arr]
-            boundary = reduce(lambda x, y: np.logical_or(x, y), shifts, boundary)
+        key = str(path)
+        with self._lock:
+            if key in self._images:
+                self._images.move_to_end(key)
+                return self._images[key]
+            generation = self._generation(key)
         
-        boundary_img = Image.new(mode='1', size=mask.size)
-        boundary_img.putdata(boundary.flatten())
+        image = self._decode(path)
+        if image is not None:
+            with self._lock:
+                if self._generation(key) == generation:
+                    self._store(key, image)
+        return image
+    
+    def peek(self, path):
+        """Returns the decoded image of a path only if it is already cached, never decoding
+        """
+        if path is None:
+            return None
+        with self._lock:
+            return self._images.get(str(path))
+    
+    def put(self, path, image):
+        """Stores an already decoded image, used when an image is created in memory rather than read from disk
+        """
+        key = str(path)
+        with self._lock:
+            self._generations[key] = self._generations.get(key, 0) + 1
+            self._store(key, image)
+    
+    def _store(self, key, image):
+        # Called with the lock held
+        if key in self._images:
+            self.size -= self._nbytes(self._images.pop(key))
+        self._images[key] = image
+        self.size += self._nbytes(image)
         
-        highlighted_img.paste(colors_imgs[i], box=(0, 0), mask=boundary_img)
+        # Evict the least recently used images, but never the one just stored
+        while self.size > self.budget and len(self._images) > 1:
+            _, evicted = self._images.popitem(last=False)
+            self.size -= self._nbytes(evicted)
+    
+    def _generation(self, key):
+        # Called with the lock held
+        return self._epoch, self._generations.get(key, 0)
+    
+    def save(self, path, image, **save_kwargs):
+        """Stores an image created in memory and writes it to its file in the background, so it can be shown right away
+
+        Args:
+            path (os.PathLike): The file the image is written to
+            image (PIL.Image.Image): The image
+            **save_kwargs: Passed on to PIL.Image.Image.save
+        """
+        key = str(path)
+        self.put(path, image)
+        with self._lock:
+            self._writes[key] = self._writer.submit(self._write, key, image, save_kwargs)
+    
+    def wait_for_write(self, path):
+        """Blocks until a file written by save() is on disk, returns right away for any other path
+        """
+        if path is None:
+            return
+        with self._lock:
+            write = self._writes.get(str(path))
+        if write is not None:
+            write.result()
+    
+    def _write(self, key, image, save_kwargs):
+        try:
+            image.save(key, **save_kwargs)
+        except Exception as e:
+            print(f"Warning: Could not save image {key}: {str(e)}")
+        finally:
+            with self._lock:
+                self._writes.pop(key, None)
+    
+    def invalidate(self, path):
+        """Drops a decoded image, the next access re-reads the file
+        """
+        if path is None:
+            return
+        key = str(path)
+        with self._lock:
+            self._generations[key] = self._generations.get(key, 0) + 1
+            image = self._images.pop(key, None)
+            if image is not None:
+                self.size -= self._nbytes(image)
+    
+    def prefetch(self, paths):
+        """Decodes images in the background so a later get is a hit
+
+        Args:
+            paths (Iterable[os.PathLike]): The images to decode, None entries are ignored
+        """
+        for path in paths:
+            if path is None:
+                continue
+            key = str(path)
+            with self._lock:
+                if key in self._images or key in self._pending:
+                    continue
+                self._pending.add(key)
+            self._prefetcher.submit(self._prefetch_one, path)
+    
+    def clear(self):
+        with self._lock:
+            self._images.clear()
+            self._generations.clear()
+            self._epoch += 1
+            self.size = 0
+    
+    def _prefetch_one(self, path):
+        try:
+            self.get(path)
+        finally:
+            with self._lock:
+                self._pending.discard(str(path))
+    
+    def _nbytes(self, image):
+        return image.width * image.height * len(image.getbands())
     
+    def _decode(self, path):
+        self.wait_for_write(path)
+        try:
+            with Image.open(path) as image:
+                image.load()
+            return image
+        except Exception as e:
+            print(f"Warning: Could not open image {path}: {str(e)}")
+            return None
+
+class ImageStore:
+    def __init__(self, image_list, cache=None, radius=1):
+        """Index based view of an ImageList backed by an ImageCache, decoding full resolution images on demand
+
+        Args:
+            image_list (ImageList): The list whose paths are decoded, changes to the list are picked up automatically
+            cache (ImageCache, optional): The cache holding decoded images, may be shared between stores. Defaults to a new cache.
+            radius (int, optional): Number of images on either side of the focused image decoded in the background. Defaults to 1.
+        """
+        self.image_list = image_list
+        self.cache = cache if cache is not None else ImageCache()
+        self.radius = radius
     
+    def __getitem__(self, index):
+        """Returns the decoded image at an index of the image list, None if there is no image there
+
+        Args:
+            index (int): Index into the image list
+
+        Returns:
+            PIL.Image.Image: The full resolution image or None
+        """
+        if index < 0 or index >= len(self.image_list.paths):
+            return None
+        return self.cache.get(self.image_list.paths[index])
+    
+    def __len__(self):
+        return len(self.image_list.paths)
+    
+    def get(self, path):
+        return self.cache.get(path)
+    
+    def path(self, index):
+        """Returns the path at an index of the image list, None if there is no image there
+        """
+        if index < 0 or index >= len(self.image_list.paths):
+            return None
+        return self.image_list.paths[index]
+    
+    def peek(self, index):
+        """Returns the decoded image at an index only if it is already cached, never decoding
+        """
+        return self.cache.peek(self.path(index))
+    
+    def put(self, path, image):
+        self.cache.put(path, image)
+    
+    def invalidate(self, path):
+        self.cache.invalidate(path)
+    
+    def focus(self, index):
+        """Marks the image at index as displayed and decodes its neighbours in the background so next and prev stay instant
+
+        Args:
+            index (int): Index of the displayed image
+        """
+        paths = self.image_list.paths
+        neighbours = [i for i in range(index - self.radius, index + self.radius + 1) if i != index and 0 <= i < len(paths)]
+        self.cache.prefetch(paths[i] for i in neighbours)
+
+def _boundary_classes(class_arr):
+    """Finds the boundary pixels of every class in one pass. A pixel is on the boundary of a class when it or one of
+    its four neighbours (wrapping around the image edges) belongs to that class and the other does not.
+    Where boundaries of several classes meet, the highest class id wins, matching the paint order of highlight_boundary
+
+    Args:
+        class_arr (numpy.ndarray): 2D array of class ids, 0 is background
+
+    Returns:
+        numpy.ndarray: Array of the same shape holding the highest boundary class id of each pixel, 0 off the boundaries
+    """
+    top = np.zeros_like(class_arr)
+    for axis in (0, 1):
+        # Every neighbouring pair (p, p+1) that differs is a boundary of both classes, owned by both pixels
+        following = np.roll(class_arr, -1, axis=axis)
+        edge = np.where(class_arr != following, np.maximum(class_arr, following), 0).astype(class_arr.dtype)
+        np.maximum(top, edge, out=top)
+        np.maximum(top, np.roll(edge, 1, axis=axis), out=top)
+    return top
+
+def _dilate(arr, iterations):
+    """Grey dilation with a 4-connected cross, repeated iterations times, wrapping around the image edges
+
+    Args:
+        arr (numpy.ndarray): 2D array to dilate
+        iterations (int): Number of dilation passes
+
+    Returns:
+        numpy.ndarray: The dilated array
+    """
+    for _ in range(iterations):
+        grown = arr.copy()
+        for axis in (0, 1):
+            for shift in (1, -1):
+                np.maximum(grown, np.roll(arr, shift, axis=axis), out=grown)
+        arr = grown
+    return arr
+
+def highlight_boundary(img: Image.Image, mask, width=1, classes=1, class_dct={}, colors={}):
+    """Outlines every labelled object of a mask on a copy of an image, coloured by the object's class
+
+    Args:
+        img (PIL.Image.Image): The image being annotated
+        mask (numpy.ndarray | PIL.Image.Image): Label image the same size as img, 0 is background and every object has its own label id.
+                                                Integer arrays are used as is, so label ids are not limited to 255
+        width (int, optional): Width of the outlines in pixels. Defaults to 1.
+        classes (int, optional): Unused, kept for compatibility. Defaults to 1.
+        class_dct (dict, optional): Class id of every label id in mask. Defaults to {}.
+        colors (dict, optional): Outline colour of every class id. Defaults to {}.
+
+    Returns:
+        PIL.Image.Image: The annotated copy of img
+    """
+    if isinstance(mask, np.ndarray):
+        mask_arr = mask
+    else:
+        mask_arr = np.asarray(mask)
+    if mask_arr.shape[:2] != (img.size[1], img.size[0]):
+        raise ValueError(f'Mask of shape {mask_arr.shape} does not match image of size {img.size}')
+    
+    # Remap label ids to class ids with a lookup table instead of a python call per pixel
+    max_label = int(mask_arr.max()) if mask_arr.size else 0
+    max_class = max([int(v) for v in class_dct.values()] + [0])
+    lut = np.zeros(max_label + 1, dtype=np.uint8 if max_class < 256 else np.int32)
+    for label, class_id in class_dct.items():
+        if 0 < label <= max_label:
+            lut[label] = class_id
+    class_arr = lut[mask_arr]
+    
+    boundary = _dilate(_boundary_classes(class_arr), width - 1)
+    
+    highlighted_img = img.copy()
+    class_ids = np.flatnonzero(np.bincount(boundary.ravel()))
+    class_ids = class_ids[class_ids != 0]
+    if len(class_ids) == 0:
+        return highlighted_img
+    
+    # Paint every outline in a single paste from a palette indexed by class id
+    palette = np.zeros((int(class_ids.max()) + 1, 3), dtype=np.uint8)
+    for i in class_ids:
+        palette[i] = Image.new(mode='RGB', size=(1, 1), color=colors[i]).getpixel((0, 0))
+    
+    overlay = Image.fromarray(palette[boundary])
+    boundary_img = Image.fromarray(np.where(boundary != 0, 255, 0).astype(np.uint8))
+    highlighted_img.paste(overlay, box=(0, 0), mask=boundary_img)
 
     return highlighted_img
     
         
 if __name__ == '__main__':
+    # Only the demo plots, importing it at module level slowed down every application start
+    from matplotlib import pyplot as plt
+    
     mask = Image.new(mode='L', size=(400, 400), color=0)
     img = Image.new(mode='RGB', size=(400, 400), color=(0, 0, 0))
     canvas = ImageDraw.Draw(img, mode='RGB')
@@ -1,12 +1,58 @@
 import tkinter as tk
+from tkinter import ttk
+import multiprocessing
+import threading
 from pages import OysterPage
+from widgets import ui_bus
+from pipeline import close_process_pools
+from model import warm_up
+
+# How often the window checks whether the model libraries have finished loading
+WARM_UP_POLL_MS = 200
+
+def start_warm_up(root, row):
+    """Imports TensorFlow and StarDist on a background thread while a model loading indicator is shown
+
+    Args:
+        root (tkinter.Tk): The application window
+        row (int): The grid row of root the indicator is placed in
+    """
+    loaded = threading.Event()
+    indicator = ttk.Label(root, text='Loading model libraries...', anchor='w')
+    indicator.grid(row=row, column=0, sticky='EW', padx=10)
+
+    def load():
+        try:
+            warm_up()
+        except Exception as e:
+            print(f"Warning: Could not load model libraries: {str(e)}")
+        finally:
+            loaded.set()
+
+    # Tk is only touched from this thread, the loader only sets the event
+    def check():
+        if loaded.is_set():
+            indicator.destroy()
+        else:
+            root.after(WARM_UP_POLL_MS, check)
+
+    threading.Thread(target=load, name='ModelWarmUp', daemon=True).start()
+    root.after(WARM_UP_POLL_MS, check)
 
 if __name__ == '__main__':
+    # Required for the prediction worker processes in the bundled executable
+    multiprocessing.freeze_support()
     root = tk.Tk()
     frame = OysterPage()
-    
+
     frame.grid(row=0, column=0, sticky='NSEW')
-    
+
     root.rowconfigure(0, weight=1)
     root.columnconfigure(0, weight=1)
-    root.mainloop()
\ No newline at end of file
+    # The window is drawn before the slow imports start
+    root.update_idletasks()
+    start_warm_up(root, row=1)
+    root.mainloop()
+    # Commands still waiting on the closed window are released
+    ui_bus.stop()
+    close_process_pools()
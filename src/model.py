@@ -1,12 +1,31 @@
-from stardist.models import StarDist2D
 from pathlib import Path
 from PIL import Image
 import numpy as np
-from csbdeep.utils import normalize
+import hashlib
 import os
 from importlib import import_module
-import pandas as pd
-from image_processing import highlight_boundary
+from collections import OrderedDict
+import threading
+import zipfile
+from image_processing import highlight_boundary, get_data_path
+
+# Number of loaded StarDist2D networks kept alive at once, switching between the oyster
+# size classes should not reload either model but every model holds its own TensorFlow graph
+MODEL_CACHE_SIZE = 3
+
+# Files inside a model directory whose modification invalidates the cached network
+MODEL_FILES = ('config.json', 'thresholds.json', 'weights_best.h5', 'weights_last.h5')
+
+# Disk budget of cached network outputs in megabytes, 0 turns the cache off
+PREDICTION_CACHE_MB = 1024
+PREDICTION_CACHE_DIR = 'data/predictions'
+# Entries of the predict_instances details kept in the cache, everything the counts and annotations need
+CACHED_DETAILS = ('points', 'class_id', 'prob')
+
+_model_cache = OrderedDict()
+_model_cache_lock = threading.Lock()
+# Content fingerprints keyed by model_key, so the weights are only hashed again after they change
+_fingerprints = {}
 
 def count_by_class(class_arr):
     class_dict = {}
@@ -14,36 +33,105 @@ def count_by_class(class_arr):
         class_dict[class_id-1] = class_dict.get(class_id-1, 0) + 1
     return class_dict
 
-class ModelAPI:
-    def __init__(self, 
-                 model_dir: os.PathLike,
-                 img: Image.Image,
-                 classes: int=1, # Useless parameter
-                 annotate: bool=True):
-        """StarDist2D Prediction wrapper, provides methods to return object count and create an annotated PIL image from model outputs
+def resolve_model_dir(model_dir: os.PathLike):
+    """Resolves a model directory, remapping relative 'models/...' paths onto DEVISION_MODELS in bundled apps
 
-        Args:
-            model_dir (os.PathLike): The directory containing the .config file for the stardist model 
-            img (PIL.Image.Image): The image the prediction is being run on
-            classes (int): The number of predicted classes the stardist model is set to run on, defaults to 1.
-        """        
-        
-        model_dir = Path(model_dir)
-        
-        # If we're running as a bundled app, check for environment variable path
-        if getattr(import_module('sys'), 'frozen', False) and os.environ.get('DEVISION_MODELS'):
-            # If the model_dir is a relative path starting with 'models', use the environment variable
-            if str(model_dir).startswith('models'):
-                # Extract the subdirectory path after 'models/'
-                subdir = str(model_dir).split('models/', 1)[1] if 'models/' in str(model_dir) else ''
-                model_dir = Path(os.environ.get('DEVISION_MODELS')) / subdir
-                print(f"Using bundled model path: {model_dir}")
+    Args:
+        model_dir (os.PathLike): The directory containing the .config file for the stardist model
+
+    Returns:
+        pathlib.Path: The absolute model directory
+    """
+    model_dir = Path(model_dir)
+    
+    # If we're running as a bundled app, check for environment variable path
+    if getattr(import_module('sys'), 'frozen', False) and os.environ.get('DEVISION_MODELS'):
+        # If the model_dir is a relative path starting with 'models', use the environment variable
+        if str(model_dir).startswith('models'):
+            # Extract the subdirectory path after 'models/'
+            subdir = str(model_dir).split('models/', 1)[1] if 'models/' in str(model_dir) else ''
+            model_dir = Path(os.environ.get('DEVISION_MODELS')) / subdir
+            print(f"Using bundled model path: {model_dir}")
+    
+    return model_dir.resolve()
+
+def model_key(model_dir: os.PathLike):
+    """Cache key of a model directory, the resolved path plus the modification times of its config and weights
+
+    Args:
+        model_dir (os.PathLike): A resolved model directory
+
+    Returns:
+        tuple: Hashable key that changes whenever the model on disk is retrained or replaced
+    """
+    model_dir = Path(model_dir)
+    mtimes = []
+    for file_name in MODEL_FILES:
+        try:
+            mtimes.append(os.stat(model_dir / file_name).st_mtime_ns)
+        except OSError:
+            mtimes.append(None)
+    return (str(model_dir), *mtimes)
+
+def model_fingerprint(model_dir: os.PathLike):
+    """Identifies a model by the contents of its config, thresholds and weights, so predictions stay valid when the
+       model folder is moved and are invalidated when it is retrained
+
+    Args:
+        model_dir (os.PathLike): A resolved model directory
+
+    Returns:
+        str: The folder name and a digest of the model files, e.g. 'oyster_2-4mm@3f1c2a9b0d4e'
+    """
+    key = model_key(model_dir)
+    fingerprint = _fingerprints.get(key)
+    if fingerprint is None:
+        digest = hashlib.sha256()
+        for file_name in MODEL_FILES:
+            file_path = Path(model_dir) / file_name
+            if not file_path.exists():
+                continue
+            digest.update(file_name.encode())
+            with open(file_path, 'rb') as file:
+                for chunk in iter(lambda: file.read(1 << 20), b''):
+                    digest.update(chunk)
+        fingerprint = f'{Path(model_dir).name}@{digest.hexdigest()[:12]}'
+        _fingerprints[key] = fingerprint
+    return fingerprint
+
+def warm_up():
+    """Imports StarDist, csbdeep and TensorFlow, which takes several seconds. They are otherwise only imported by the
+       first prediction, so calling this on a background thread after the window is shown hides that wait
+    """
+    import stardist.models
+    import csbdeep.utils
+
+def load_model(model_dir: os.PathLike):
+    """Returns a loaded StarDist2D for the model directory, loading it only on the first request.
+       Models are kept in a process-wide LRU cache of MODEL_CACHE_SIZE entries
+
+    Args:
+        model_dir (os.PathLike): The directory containing the .config file for the stardist model
+
+    Returns:
+        stardist.models.StarDist2D: The loaded model
+    """
+    model_dir = resolve_model_dir(model_dir)
+    key = model_key(model_dir)
+    
+    # The lock is held while loading so that two threads asking for the same model load it once
+    with _model_cache_lock:
+        if key in _model_cache:
+            _model_cache.move_to_end(key)
+            return _model_cache[key]
         
         basedir = model_dir.parent
         name = model_dir.stem
         
+        # Imported here, TensorFlow is only needed once a model is used
+        from stardist.models import StarDist2D
         try:
-            self._model = StarDist2D(
+            model = StarDist2D(
                 config=None,
                 basedir=basedir,
                 name=name
@@ -56,64 +144,392 @@ class ModelAPI:
                 print(f"Files in {basedir}: {os.listdir(basedir)}")
             raise
         
-        # Resize the image if the resolution is incorrect
-        '''
-        if img.size != (3024, 4032):
-            img = img.resize((3024, 4032))
-        '''
-            
+        # Drop any stale entry of the same directory before caching the reloaded model
+        for stale_key in [k for k in _model_cache if k[0] == key[0]]:
+            del _model_cache[stale_key]
+        
+        _model_cache[key] = model
+        while len(_model_cache) > MODEL_CACHE_SIZE:
+            _model_cache.popitem(last=False)
+        
+        return model
+
+def clear_model_cache():
+    """Drops every cached model, the next prediction reloads from disk
+    """
+    with _model_cache_lock:
+        _model_cache.clear()
+
+class PredictionCache:
+    def __init__(self, directory=PREDICTION_CACHE_DIR, budget_mb=PREDICTION_CACHE_MB):
+        """Content addressed disk cache of predict_instances outputs. Entries are keyed by the network input, the model
+           fingerprint and the detection thresholds, so predicting the same photo again, switching back to a model or
+           toggling annotation reuses the network output. Labels are stored compressed with the points and class ids,
+           and the least recently used entries are removed once the cache outgrows its budget
+
+        Args:
+            directory (os.PathLike, optional): Folder the entries are stored in. Defaults to PREDICTION_CACHE_DIR.
+            budget_mb (float, optional): Disk budget in megabytes. Defaults to PREDICTION_CACHE_MB.
+        """
+        self.directory = Path(directory)
+        self.budget = int(budget_mb * 1024 * 1024)
+        self.size = 0
+        
+        # File name -> size, least recently used first, read from the folder on first use
+        self._files = None
+        self._lock = threading.Lock()
+    
+    def key(self, fingerprint, thresholds, arr):
+        """Returns the cache key of a prediction
+
+        Args:
+            fingerprint (str): The model fingerprint
+            thresholds (tuple): The (prob, nms) thresholds predict_instances uses
+            arr (numpy.ndarray): The prepared network input
+
+        Returns:
+            str: The hex key
+        """
+        arr = np.ascontiguousarray(arr)
+        digest = hashlib.blake2b(digest_size=20)
+        digest.update(f'{fingerprint}|{thresholds}|{arr.shape}|{arr.dtype.str}'.encode())
+        digest.update(memoryview(arr).cast('B'))
+        return digest.hexdigest()
+    
+    def get(self, key):
+        """Returns the cached (labels, details) pair of a key, None on a miss
+        """
+        path = self.directory / f'{key}.npz'
+        try:
+            with np.load(path, allow_pickle=False) as data:
+                labels = data['labels']
+                details = {name: data[name] for name in CACHED_DETAILS if name in data.files}
+        except FileNotFoundError:
+            return None
+        except (OSError, KeyError, ValueError, EOFError, zipfile.BadZipFile) as e:
+            # A truncated or corrupt entry, e.g. from a crash on a file system without atomic renames, is a miss
+            print(f"Warning: Removing unreadable cached prediction {path.name}: {str(e)}")
+            self._remove(path.name)
+            return None
+        with self._lock:
+            self._index()
+            if path.name in self._files:
+                self._files.move_to_end(path.name)
+        try:
+            # The modification time orders the entries when the folder is read again
+            os.utime(path)
+        except OSError:
+            pass
+        return labels, details
+    
+    def put(self, key, labels, details):
+        """Stores the outputs of a prediction and removes the least recently used entries beyond the budget
+        """
+        if self.budget <= 0:
+            return
+        path = self.directory / f'{key}.npz'
+        temp_path = self.directory / f'{key}.npz.tmp'
+        arrays = {name: np.asarray(details[name]) for name in CACHED_DETAILS if name in details}
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(temp_path, 'wb') as file:
+                np.savez_compressed(file, labels=labels, **arrays)
+            os.replace(temp_path, path)
+        except OSError as e:
+            print(f"Warning: Could not cache prediction: {str(e)}")
+            return
+        
+        with self._lock:
+            # Worker processes share the folder with their own caches, so it is read again before evicting to count
+            # the entries the other processes added
+            self._files = None
+            self._index()
+            if path.name in self._files:
+                self._files.move_to_end(path.name)
+            while self.size > self.budget and len(self._files) > 1:
+                name, old_size = self._files.popitem(last=False)
+                self.size -= old_size
+                try:
+                    os.remove(self.directory / name)
+                except OSError:
+                    pass
+    
+    def clear(self):
+        with self._lock:
+            self._index()
+            for name in self._files:
+                try:
+                    os.remove(self.directory / name)
+                except OSError:
+                    pass
+            self._files.clear()
+            self.size = 0
+    
+    def _remove(self, name):
+        with self._lock:
+            self._index()
+            self.size -= self._files.pop(name, 0)
+        try:
+            os.remove(self.directory / name)
+        except OSError:
+            pass
+    
+    def _index(self):
+        # Called with the lock held
+        if self._files is not None:
+            return
+        entries = []
+        if self.directory.exists():
+            for path in self.directory.glob('*.npz'):
+                try:
+                    stat = path.stat()
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime_ns, path.name, stat.st_size))
+        self._files = OrderedDict((name, size) for _, name, size in sorted(entries))
+        self.size = sum(self._files.values())
+
+_prediction_cache = None
+
+def get_prediction_cache():
+    """Returns the prediction cache shared by every Predictor of the process, None if it is turned off
+    """
+    global _prediction_cache
+    if _prediction_cache is None:
+        _prediction_cache = PredictionCache(get_data_path(PREDICTION_CACHE_DIR))
+    return _prediction_cache if _prediction_cache.budget > 0 else None
+
+def configure_prediction_cache(budget_mb=PREDICTION_CACHE_MB, directory=None):
+    """Replaces the shared prediction cache, used to apply the prediction-cache-mb setting
+
+    Args:
+        budget_mb (float, optional): Disk budget in megabytes, 0 turns the cache off. Defaults to PREDICTION_CACHE_MB.
+        directory (os.PathLike, optional): Folder of the entries. Defaults to PREDICTION_CACHE_DIR in the data folder.
+    """
+    global _prediction_cache
+    _prediction_cache = PredictionCache(directory or get_data_path(PREDICTION_CACHE_DIR), budget_mb)
+
+def prediction_cache_settings():
+    """Returns the budget and folder of the shared prediction cache, so worker processes can be configured the same way
+
+    Returns:
+        tuple: (budget in megabytes, folder as a str)
+    """
+    global _prediction_cache
+    if _prediction_cache is None:
+        _prediction_cache = PredictionCache(get_data_path(PREDICTION_CACHE_DIR))
+    return _prediction_cache.budget / (1024 * 1024), str(_prediction_cache.directory)
+
+# Boundary colours used when annotating, keyed by class id
+COLOR_DCT = {
+    1: 'red',
+    2: 'blue',
+    3: 'green',
+    4: 'yellow'
+}
+
+class Prediction:
+    def __init__(self, count, count_dct, class_dct, labels, details, annotation=None, model=None):
+        """The outputs of a single StarDist2D prediction
+
+        Args:
+            count (int): The number of predicted objects
+            count_dct (dict): Object count per zero-indexed class, empty for single class models
+            class_dct (dict): Class id of every label id in labels
+            labels (numpy.ndarray): The label image returned by predict_instances, None if it was not kept
+            details (dict): The details dictionary returned by predict_instances
+            annotation (PIL.Image.Image, optional): The annotated image, None if annotation was disabled. Defaults to None.
+            model (str, optional): The fingerprint of the model that made the prediction. Defaults to None.
+        """
+        self.count = count
+        self.count_dct = count_dct
+        self.class_dct = class_dct
+        self.labels = labels
+        self.details = details
+        self.annotation = annotation
+        self.model = model
+
+class Predictor:
+    def __init__(self, model_dir: os.PathLike, annotate: bool=True):
+        """Long lived StarDist2D prediction object, built once per model and reused for every image
+        predicted with that model. Prediction is split into prepare, infer and finish so batch callers
+        can run each step on a different thread
+
+        Args:
+            model_dir (os.PathLike): The directory containing the .config file for the stardist model
+            annotate (bool, optional): Default for whether predict creates an annotated image. Defaults to True.
+        """
+        self.model_dir = resolve_model_dir(model_dir)
+        self._model = load_model(self.model_dir)
+        self.fingerprint = model_fingerprint(self.model_dir)
         self.annotate = annotate
         
-        self._image = img
-        self._nclasses = self._model.config.n_classes if self._model.config.n_classes != None else 1
+        # Values derived from the model config once instead of per image
+        thresholds = self._model.thresholds
+        self.thresholds = (float(thresholds.prob), float(thresholds.nms))
+        config = self._model.config
+        self.n_channel_in = config.n_channel_in
+        self.n_classes = config.n_classes if config.n_classes != None else 1
+        self.colors = COLOR_DCT
         
-        if self._model.config.n_channel_in == 3:
+        # Tiling guesses keyed by normalized array shape, trays are usually shot at one resolution
+        self._n_tiles = {}
+        
+    def prepare(self, img: Image.Image):
+        """Converts an image into the normalized (H, W, C) array the network expects
+
+        Args:
+            img (PIL.Image.Image): The image being predicted
+
+        Returns:
+            numpy.ndarray: The normalized image array
+        """
+        if self.n_channel_in == 3:
             img = img.convert('RGB')
-        elif self._model.config.n_channel_in == 1:
+        elif self.n_channel_in == 1:
             img = img.convert('L') 
         
         img_arr = np.array(img)
         # Ensure the array is always 3D (H, W, C)
         if img_arr.ndim == 2:
             img_arr = np.expand_dims(img_arr, axis=-1)
-        self._arr = normalize(img_arr, 1, 99.8, axis=(0, 1))
-        self._prediction_flag = False
-        
-        self._count = None
-        self._out_image = None
+        from csbdeep.utils import normalize
+        return normalize(img_arr, 1, 99.8, axis=(0, 1))
+    
+    def infer(self, arr):
+        """Runs the network on a prepared array
+
+        Args:
+            arr (numpy.ndarray): An array returned by prepare
+
+        Returns:
+            tuple: The (labels, details) pair returned by predict_instances, details only holds CACHED_DETAILS
+                   when the pair comes from the prediction cache
+        """
+        cache = get_prediction_cache()
+        if cache is not None:
+            key = cache.key(self.fingerprint, self.thresholds, arr)
+            cached = cache.get(key)
+            if cached is not None:
+                return cached
         
-    def _predict(self):
-        n_tiles = self._model._guess_n_tiles(self._arr)
-        lbls, details = self._model.predict_instances(self._arr, n_tiles=n_tiles, axes='YXC')
+        if arr.shape not in self._n_tiles:
+            self._n_tiles[arr.shape] = self._model._guess_n_tiles(arr)
+        lbls, details = self._model.predict_instances(arr, n_tiles=self._n_tiles[arr.shape], axes='YXC')
+        if cache is not None:
+            cache.put(key, lbls, details)
+        return lbls, details
+    
+    def finish(self, img: Image.Image, lbls, details, annotate=None):
+        """Counts the network outputs and optionally annotates the original image
+
+        Args:
+            img (PIL.Image.Image): The image that was predicted
+            lbls (numpy.ndarray): The label image returned by infer
+            details (dict): The details dictionary returned by infer
+            annotate (bool, optional): Overrides the predictor annotate default. Defaults to None.
+
+        Returns:
+            Prediction: The prediction result
+        """
+        if annotate is None:
+            annotate = self.annotate
         
-        if self._nclasses > 1:
+        if self.n_classes > 1:
             class_dct = {k+1:v for k, v in enumerate(details['class_id'])}
         else:
             class_dct = {k+1:1 for k in range(len(details['points']))}
-            
-        mask_image = Image.new(mode='L', color=0, size=self._image.size)
-        mask_image.putdata(lbls.flatten())
         
-        self._count = len(details['points'])
+        count = len(details['points'])
         
         if 'class_id' in details:
-            self.count_dct = count_by_class(details['class_id'])
+            count_dct = count_by_class(details['class_id'])
         else:
-            self.count_dct = {}
-            
-        self.color_dct = {
-            1: 'red',
-            2: 'blue',
-            3: 'green',
-            4: 'yellow'
-        }
-        
-        if self.annotate:
-            self._out_image = highlight_boundary(self._image, mask_image, width=4, classes=self._nclasses, class_dct=class_dct, colors=self.color_dct)
+            count_dct = {}
+        
+        if annotate:
+            # The int32 label array goes straight to annotation, an 8-bit mask image would wrap label ids above 255
+            annotation = highlight_boundary(img, lbls, width=4, classes=self.n_classes, class_dct=class_dct, colors=self.colors)
         else:
-            self._out_image = None
-    def df(self):
+            annotation = None
+            
+        return Prediction(count, count_dct, class_dct, lbls, details, annotation, model=self.fingerprint)
+    
+    def predict(self, img: Image.Image, annotate=None):
+        """Predicts a single image
+
+        Args:
+            img (PIL.Image.Image): The image being predicted
+            annotate (bool, optional): Overrides the predictor annotate default. Defaults to None.
+
+        Returns:
+            Prediction: The prediction result
+        """
+        lbls, details = self.infer(self.prepare(img))
+        return self.finish(img, lbls, details, annotate)
+    
+    def predict_many(self, images, annotate=None):
+        """Predicts every image of an iterable with the same warmed up network
+
+        Args:
+            images (Iterable[PIL.Image.Image]): The images being predicted
+            annotate (bool, optional): Overrides the predictor annotate default. Defaults to None.
+
+        Yields:
+            Prediction: The prediction result of each image, in order
+        """
+        for img in images:
+            yield self.predict(img, annotate)
+
+class ModelAPI:
+    def __init__(self, 
+                 model_dir: os.PathLike,
+                 img: Image.Image,
+                 classes: int=1, # Useless parameter
+                 annotate: bool=True,
+                 predictor: Predictor=None):
+        """StarDist2D Prediction wrapper, provides methods to return object count and create an annotated PIL image from model outputs.
+           Kept for compatibility, new code should hold on to a Predictor instead
+
+        Args:
+            model_dir (os.PathLike): The directory containing the .config file for the stardist model 
+            img (PIL.Image.Image): The image the prediction is being run on
+            classes (int): The number of predicted classes the stardist model is set to run on, defaults to 1.
+            predictor (Predictor, optional): An existing predictor to reuse instead of creating one for model_dir. Defaults to None.
+        """        
+        
+        if predictor is None:
+            predictor = Predictor(model_dir, annotate)
+        self._predictor = predictor
+        self._model = predictor._model
         
+        # Resize the image if the resolution is incorrect
+        '''
+        if img.size != (3024, 4032):
+            img = img.resize((3024, 4032))
+        '''
+            
+        self.annotate = annotate
+        
+        self._image = img
+        self._nclasses = predictor.n_classes
+        self._arr = predictor.prepare(img)
+        self._prediction_flag = False
+        
+        self._count = None
+        self._out_image = None
+        
+    def _predict(self):
+        lbls, details = self._predictor.infer(self._arr)
+        result = self._predictor.finish(self._image, lbls, details, self.annotate)
+        
+        self._count = result.count
+        self.count_dct = result.count_dct
+        self.color_dct = self._predictor.colors
+        self._out_image = result.annotation
+        
+    def df(self):
+        import pandas as pd
         
         data_lst = [str(self._image_path.name), 
                     self._count] + [self.count_dct.get(i, 0) for i in range(4)]
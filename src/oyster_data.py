@@ -1,8 +1,10 @@
-import pandas as pd
+# pandas and scipy are imported where they are used, importing them here slowed down every application start
 from datetime import datetime
-from scipy.stats import t
 from pathlib import Path
+import csv
+import math
 import os
+from columnar import FORMAT_SUFFIXES, is_columnar, read_table, write_table
 
 if not os.path.exists('excel'):
     os.mkdir('excel')
@@ -35,6 +37,25 @@ def get_csv_path(relative_path):
             os.makedirs(os.path.dirname(path), exist_ok=True)
         return path
 
+# Columns of the data file, in order
+COLUMNS = [
+    'model',
+    'group',
+    'file-name',
+    'size-class',
+    'seed-tray-weight', 
+    'slide-weight', 
+    'slide-and-seed-weight', 
+    'subsample-count', 
+    'total-number'
+]
+
+# Columns of the statistics file, in order
+STATS_COLUMNS = ['mean', 'std', 'sem', 'dof', 'confidence95']
+
+# An appended data file is rewritten without its replaced rows once they make up this share of it
+COMPACT_RATIO = 0.25
+
 class OysterData():
     id = 0
     def __init__(self, *, file_name='oyster-data.csv', staff_name=''):
@@ -45,22 +66,18 @@ class OysterData():
         
         formatted_datetime = datetime.now().strftime('%m/%d/%Y %I:%M:%S %p')
         
-        # Goes into the info file
-        self.info_df = pd.DataFrame([[formatted_datetime, staff_name]], columns=['Date', 'Staff'])
+        # Goes into the info file, see info_df
+        self._info = [formatted_datetime, staff_name]
         
-        # Goes into the data file
+        # Goes into the data file, stored as append only columns and exposed as a dataframe through self.df
         # Mass is in grams unless otherwise specified
-        self.df = pd.DataFrame(columns=[
-            'model',
-            'group',
-            'file-name',
-            'size-class',
-            'seed-tray-weight', 
-            'slide-weight', 
-            'slide-and-seed-weight', 
-            'subsample-count', 
-            'total-number'
-        ])
+        self._columns = {column: [] for column in COLUMNS}
+        # Rows replaced by a newer row of the same file name stay in the columns but are no longer alive
+        self._alive = []
+        # Positions of the alive rows of every file name, more than one only after insert() repeats a file name
+        self._index = {}
+        self._repeated = set()
+        self._df = None
         
         self.data_to_readable = {
             'model':'Model',
@@ -75,8 +92,70 @@ class OysterData():
         
         self.readable_to_data = {self.data_to_readable[k]:k for k in self.data_to_readable}
         
-        # Goes into the statistics file
-        self.stats = None
+        # Running [count, mean, sum of squared deviations] of the total number of every group (Welford's algorithm)
+        self._groups = {}
+        # (group, total number, +1 for added or -1 for removed) rows not yet folded into self._groups by compute()
+        self._changes = []
+        # Statistics row of every group, None until the first compute()
+        self._stats_rows = None
+        self._stats = None
+        
+        # Append mode state of write_csv: the open data file, the rows already in it, how many of those have
+        # been replaced since, and whether any group statistics changed since the stats file was written
+        self._csv_file = None
+        self._csv_writer = None
+        self._csv_path = None
+        self._written = 0
+        self._written_dead = 0
+        self._stats_changed = True
+    
+    def __len__(self):
+        return sum(self._alive)
+    
+    @property
+    def columns(self):
+        return list(COLUMNS)
+    
+    @property
+    def info_df(self):
+        import pandas as pd
+        return pd.DataFrame([self._info], columns=['Date', 'Staff'])
+    
+    @property
+    def df(self):
+        """The alive rows as a dataframe, rebuilt only after the data changed
+        """
+        import pandas as pd
+        if self._df is None:
+            alive = [position for position, is_alive in enumerate(self._alive) if is_alive]
+            data = {column: [values[position] for position in alive] for column, values in self._columns.items()}
+            self._df = pd.DataFrame(data, columns=COLUMNS)
+        return self._df
+    
+    @property
+    def stats(self):
+        """Mean, standard deviation, standard error, degrees of freedom and the deviation of the 95% confidence
+           interval of every group, None until compute() has run
+        """
+        if self._stats is None and self._stats_rows is not None:
+            import pandas as pd
+            groups = sorted(self._stats_rows)
+            self._stats = pd.DataFrame([self._stats_rows[group] for group in groups], index=pd.Index(groups, name='group'), columns=STATS_COLUMNS)
+        return self._stats
+    
+    def row(self, file_name):
+        """Returns the latest alive row of a file name
+
+        Args:
+            file_name (str): The file name of the row
+
+        Returns:
+            list: The row values in column order, None if there is no row with that file name
+        """
+        positions = self._index.get(file_name)
+        if not positions:
+            return None
+        return [self._columns[column][positions[-1]] for column in COLUMNS]
         
     def insert(self, *, model, group_number, file_name, size_class,
                         seed_tray_weight, slide_weight,
@@ -96,7 +175,7 @@ class OysterData():
         
         
         total_count = (subsample_count / (slide_and_seed_weight - slide_weight)) * seed_tray_weight
-        insert_row = pd.DataFrame([[
+        self._append([
                 str(model),
                 int(group_number),
                 str(file_name), 
@@ -106,88 +185,215 @@ class OysterData():
                 float(slide_and_seed_weight),
                 int(subsample_count),
                 int(total_count)
-            ]], columns=self.df.columns
-        )
-        
-        
-        self.df = pd.concat([self.df, insert_row], ignore_index=True)
+            ])
         self.compute()
         
-    # Takes in a dataframe (of insertable values) and concats it to the current dataframe
+    # Takes in a dataframe (of insertable values) and appends it to the current data
     def extend(self, insert_df):
-        """Insert all the values in a given dataframe into this objects dataframe
+        """Insert all the values in a given dataframe into this objects dataframe, a row with the file name of an
+           existing row replaces it
 
         Args:
             insert_df (pandas.DataFrame): The dataframe being inserted, it must have columns of the same name as this objects dataframe
         """
-        
-        pd.options.mode.chained_assignment = None
-
         insert_df = insert_df[['model', 'group', 'file-name', 'size-class', 'seed-tray-weight', 'slide-weight', 'slide-and-seed-weight', 'subsample-count']]
         
-        insert_df['group'] = insert_df['group'].astype(int)
-        
         total_count = insert_df['subsample-count'] / (insert_df['slide-and-seed-weight'] - insert_df['slide-weight']) * insert_df['seed-tray-weight']
-        insert_df['total-number'] = total_count
         
-        if len(self.df) == 0: 
-            self.df = insert_df
-        else:
-            self.df = pd.concat([self.df, insert_df], ignore_index=True)
-        # Remove duplicate entries by file-name, keeping only the most recent
-        self.df = self.df.drop_duplicates(subset=['file-name'], keep='last').reset_index(drop=True)
+        columns = [insert_df[column].tolist() for column in insert_df.columns]
+        columns[1] = insert_df['group'].astype(int).tolist()
+        # Restored sessions hold pathlib.Path file names, rows are keyed and exported by the string
+        columns[2] = insert_df['file-name'].astype(str).tolist()
+        columns.append(total_count.tolist())
+        
+        touched = set()
+        for row in zip(*columns):
+            self._append(list(row))
+            touched.add(row[2])
+        # Remove duplicate entries by file-name, keeping only the most recent. Repeats left by insert() are
+        # collapsed here as well
+        touched.update(self._repeated)
+        self._repeated.clear()
+        for file_name in touched:
+            positions = self._index[file_name]
+            for position in positions[:-1]:
+                self._remove(position)
+            del positions[:-1]
        
         self.compute()
-        pd.options.mode.chained_assignment = 'warn'
+    
+    def _append(self, row):
+        position = len(self._alive)
+        for column, value in zip(COLUMNS, row):
+            self._columns[column].append(value)
+        self._alive.append(True)
+        positions = self._index.setdefault(row[2], [])
+        positions.append(position)
+        if len(positions) > 1:
+            self._repeated.add(row[2])
+        self._changes.append((row[1], row[-1], 1))
+        self._df = None
+    
+    def _remove(self, position):
+        self._alive[position] = False
+        if position < self._written:
+            self._written_dead += 1
+        self._changes.append((self._columns['group'][position], self._columns['total-number'][position], -1))
+        self._df = None
         
     def compute(self):
         """Computes mean, standard deviation, standard error, and the deviation of the 95% confidence interval 
-           on all groups and saves them into this objects stats attribute as a dataframe
+           on all groups and saves them into this objects stats attribute as a dataframe. Only groups with rows
+           added or removed since the last call are updated
         """
-        groups = self.df[['group', 'total-number']].groupby('group')
+        touched = set()
+        for group, value, sign in self._changes:
+            touched.add(group)
+            n, mean, m2 = self._groups.get(group, (0, 0.0, 0.0))
+            value = float(value)
+            if sign > 0:
+                n += 1
+                delta = value - mean
+                mean += delta / n
+                m2 += delta * (value - mean)
+            elif n <= 1:
+                n, mean, m2 = 0, 0.0, 0.0
+            else:
+                n -= 1
+                delta = value - mean
+                mean -= delta / n
+                m2 -= delta * (value - mean)
+            self._groups[group] = (n, mean, max(m2, 0.0))
+        self._changes = []
+        
+        if self._stats_rows is None:
+            self._stats_rows = {}
+        for group in touched:
+            n, mean, m2 = self._groups[group]
+            if n == 0:
+                del self._groups[group]
+                self._stats_rows.pop(group, None)
+                continue
+            self._stats_rows[group] = self._group_stats(n, mean, m2)
+        self._stats = None
+        if touched:
+            self._stats_changed = True
+    
+    def _group_stats(self, n, mean, m2):
+        from scipy.stats import t
         
         # Student's T parameters
-        dof = groups.size() - 1 # degrees of freedom
+        dof = n - 1 # degrees of freedom
         alpha = .05 # also known as p-value
         ppf = t.ppf(1-(alpha/2), dof) # Critical t-value for given degrees of freedom at alpha threshold
         
-        # Aggregated statistics
-        mean = groups.mean().rename(columns={'total-number':'mean'})
-        std = groups.std().rename(columns={'total-number':'std'})
-        sem = groups.sem().rename(columns={'total-number':'sem'})
-        dof = dof.rename('dof')
+        # Sample statistics, undefined for a single sample like pandas
+        std = math.sqrt(m2 / dof) if dof > 0 else math.nan
+        sem = std / math.sqrt(n)
         
-        confidence95 = sem.apply(lambda x: x*ppf).rename(columns={'sem':'confidence95'})
-        
-        # Write to dataframe
-        self.stats = pd.concat([mean, std, sem, dof, confidence95], axis=1)
+        confidence95 = sem * ppf
+        return [mean, std, sem, dof, confidence95]
     
-    def write_csv(self, base_path=None):
-        """Writes this object into a single CSV file containing all data entries."""
-        # Determine full file path (override if provided) and ensure directory exists
-        if base_path:
-            file_path = Path(base_path).with_suffix('.csv')
-            os.makedirs(file_path.parent, exist_ok=True)
-        else:
-            file_base = get_csv_path(f'excel/data{self.id}')
-            file_path = Path(f"{file_base}.csv")
-        
-        # Convert data to human-readable columns
-        export_df = self.df.copy().rename(columns=self.data_to_readable)
-        export_df.index.name = 'Index'
+    def write_csv(self, base_path=None, append=False):
+        """Writes this object into a single CSV file containing all data entries.
+
+        Args:
+            base_path (os.PathLike, optional): The data file path, its stats file is written next to it. Defaults to excel/data<id>.csv.
+            append (bool, optional): Keep the data file open and only write rows added since the last call. Replaced rows
+                                     stay in the file until a compaction rewrites it, readers keep the last row of a file name.
+                                     The stats file is only rewritten when a group changed. Defaults to False.
+        """
+        file_path = self._file_path(base_path, '.csv')
         
         try:
-            export_df.to_csv(file_path, index=False)
+            rewrite = (
+                not append
+                or self._csv_file is None
+                or self._csv_path != file_path
+                or not file_path.exists()
+                or self._written_dead > COMPACT_RATIO * max(1, self._written)
+            )
+            if rewrite:
+                self._rewrite_csv(file_path)
+            else:
+                self._append_csv()
+            if not append:
+                self.close()
             print(f"CSV file saved successfully at: {file_path}")
         except Exception as e:
             print(f"Error saving CSV file: {str(e)}")
 
+        if append and not self._stats_changed:
+            return
         try:
             path = file_path.parent / Path(file_path.stem + 'stats' + file_path.suffix)
             self.stats.to_csv(path)
+            self._stats_changed = False
             print(f"Stats csv saved successfully at: {path}")
         except Exception as e:
             print(f"Error saving CSV file: {str(e)}")
+    
+    def write_columnar(self, base_path=None, format='parquet'):
+        """Writes the data and stats as typed Parquet or Arrow IPC files, next to where write_csv puts the CSV files.
+           Requires pyarrow
+
+        Args:
+            base_path (os.PathLike, optional): The data file path, its stats file is written next to it. Defaults to excel/data<id>.
+            format (str, optional): 'parquet' or 'arrow'. Defaults to 'parquet'.
+        """
+        file_path = self._file_path(base_path, FORMAT_SUFFIXES[format])
+        try:
+            write_table(self.df, file_path, 'oyster-data')
+            print(f"{format.capitalize()} file saved successfully at: {file_path}")
+            if self.stats is not None:
+                path = file_path.parent / Path(file_path.stem + 'stats' + file_path.suffix)
+                write_table(self.stats.reset_index(), path, 'oyster-stats')
+                print(f"Stats {format} saved successfully at: {path}")
+        except Exception as e:
+            print(f"Error saving {format} file: {str(e)}")
+    
+    def _file_path(self, base_path, suffix):
+        # Determine full file path (override if provided) and ensure directory exists
+        if base_path:
+            file_path = Path(base_path).with_suffix(suffix)
+            os.makedirs(file_path.parent, exist_ok=True)
+        else:
+            file_base = get_csv_path(f'excel/data{self.id}')
+            file_path = Path(f"{file_base}{suffix}")
+        return file_path
+    
+    def _rewrite_csv(self, file_path):
+        self.close()
+        # Convert data to human-readable columns
+        export_df = self.df.copy().rename(columns=self.data_to_readable)
+        export_df.index.name = 'Index'
+        
+        # Written next to the old file and renamed over it, so a failed write never leaves half a file
+        temp_path = file_path.with_name(file_path.name + '.tmp')
+        export_df.to_csv(temp_path, index=False)
+        os.replace(temp_path, file_path)
+        
+        self._csv_path = file_path
+        self._csv_file = open(file_path, 'a', newline='')
+        self._csv_writer = csv.writer(self._csv_file)
+        self._written = len(self._alive)
+        self._written_dead = 0
+    
+    def _append_csv(self):
+        for position in range(self._written, len(self._alive)):
+            if self._alive[position]:
+                self._csv_writer.writerow([_csv_value(self._columns[column][position]) for column in COLUMNS])
+        self._csv_file.flush()
+        self._written = len(self._alive)
+    
+    def close(self):
+        """Closes the data file kept open by write_csv(append=True)
+        """
+        if self._csv_file is not None:
+            self._csv_file.close()
+        self._csv_file = None
+        self._csv_writer = None
+        self._csv_path = None
             
     # For backward compatibility
     def write_excel(self):
@@ -195,10 +401,10 @@ class OysterData():
         self.write_csv()
     
     def read_csv(self, file_path=None):
-        """Reads data from a CSV file
+        """Reads data from a CSV file, or from a Parquet or Arrow IPC file written by write_columnar
         
         Args:
-            file_path: Path to the CSV file to read. If None, uses self.file_name
+            file_path: Path to the CSV, Parquet or Arrow file to read. If None, uses self.file_name
             
         Returns:
             DataFrame containing the loaded data
@@ -206,9 +412,13 @@ class OysterData():
         if not file_path:
             file_path = self.file_name
         
+        import pandas as pd
         try:
-            df = pd.read_csv(file_path)
-            df = df.rename(columns=self.readable_to_data)
+            if is_columnar(file_path):
+                df = read_table(file_path, kind='oyster-data')
+            else:
+                df = pd.read_csv(file_path)
+                df = df.rename(columns=self.readable_to_data)
             
             self.extend(df)
             return df
@@ -221,11 +431,18 @@ class OysterData():
         """Legacy method for backward compatibility"""
         return self.read_csv(file_path)
 
+def _csv_value(value):
+    # Matches how pandas writes missing values
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return ''
+    return value
+
 # For backward compatibility
 OysterExcel = OysterData
 
 # Testing function
 if __name__ == '__main__':  
+    import pandas as pd
     import_df = pd.read_csv('test/oyster-example-data.csv')
     data_obj = OysterData(file_name='test/oyster-data-out.csv')
     
@@ -3,8 +3,9 @@
 # Pages is specifically for image prediction pages like MainFrame and OysterPage, but the concept is
 # able to be generalized
 
+# TensorFlow, StarDist, pandas and OpenCV are imported where they are first used so the window appears quickly,
+# see model.warm_up
 import numpy as np
-from csbdeep.utils import normalize
 from markdown import Markdown
 
 import datetime
@@ -16,21 +17,25 @@ from tkinter import ttk
 from widgets import *
 from settings_window import SettingsWindow, Settings
 from oyster_data import OysterExcel
-from image_processing import ImageList, THUMBNAIL_SIZE, highlight_boundary
+from session import SessionStore
+from columnar import has_pyarrow, is_columnar, write_table, FORMAT_SUFFIXES
+from image_processing import ImageList, ImageStore, ImageCache, THUMBNAIL_SIZE, IMAGE_CACHE_MB, highlight_boundary
 
 from PIL.ImageTk import PhotoImage, getimage
 from PIL import Image
 
 import os
+import shutil
 from pathlib import Path
 
-import pandas as pd
-
-from model import ModelAPI
+from model import Predictor, Prediction, configure_prediction_cache, prediction_cache_settings, PREDICTION_CACHE_MB
+from pipeline import PredictionPipeline, ProcessPredictionPool, PredictionWorker, STAGES
+from image_processing import get_data_path
 
 import tempfile
-import cv2
 import sys
+import threading
+from collections import OrderedDict
 
 # Raspberry Pi detection and picamera2 import check
 def is_raspberry_pi():
@@ -64,8 +69,31 @@ def has_picamera2():
     except ImportError:
         return False
 
+def get_columnar_format():
+    """Returns the columnar format full exports are also written in, None for CSV only or when pyarrow is missing
+    """
+    export_format = SettingsWindow._settings.get('export-format', 'csv')
+    if export_format not in FORMAT_SUFFIXES:
+        return None
+    if not has_pyarrow():
+        print(f"Warning: export-format is {export_format} but pyarrow is not installed, only CSV files are written")
+        return None
+    return export_format
+
 INTIAL_DIR = Path.cwd()
 
+# How often finished capture counts are collected while the capture worker is busy
+CAPTURE_POLL_MS = 100
+
+# Number of rendered display images kept, a few images at a few window sizes
+RENDER_CACHE_SIZE = 16
+
+# Quiet period after the last resize event before images are rendered at full quality
+RESIZE_DEBOUNCE_MS = 150
+
+# Files that can be decoded straight at a reduced scale, see Page._open_draft
+DRAFT_SUFFIXES = ('.jpg', '.jpeg')
+
 
 class IdNotFoundError(Exception):
     def __init__(self, value):
@@ -112,6 +140,9 @@ class Page(ttk.Frame):
         
         # Default display for empty image frames so that the frame will be sized appropriately
         self.black_photoimage = PhotoImage(Page.black_image)
+        
+        self.settings_obj = SettingsWindow()
+        self.settings = self.settings_obj.settings
 
         # Below are attributes that keep track of the various save states of widgets on subframes
         self.file_name_dict = {}
@@ -144,22 +175,55 @@ class Page(ttk.Frame):
         
         self.image_pointer = 0
         
-        # Reading and writing image data from file
-        
-        true_json = [] 
-        pred_json = []
-        if os.path.exists(f'data/ImageListTrue{self.name}.json'):
-            with open(f'data/ImageListTrue{self.name}.json', 'r') as file:
-                true_json = list(json.load(file))
-        if os.path.exists(f'data/ImageListPred{self.name}.json'):
-            with open(f'data/ImageListPred{self.name}.json', 'r') as file:
-                pred_json = list(json.load(file))
-        self.images = ImageList(iterable=true_json, name=f'True{self.name}')
-        self.prediction_images = ImageList(iterable=pred_json, name=f'Pred{self.name}')
-        
-        # Store original PIL images for resizing
-        self._original_images = []
-        self._original_pred_images = []
+        # Reading and writing image data from file, the session database is the source of truth. The image list files
+        # of older versions are read once to move their session into it and are then renamed, so they are neither
+        # written nor read again
+        self.session = SessionStore(get_data_path('data/session.db'), page=self.name)
+        if not self.session.is_empty():
+            self._session_state = self.session.load()
+            true_json = self._session_state['images']
+            pred_json = self._session_state['prediction_images']
+        else:
+            true_json = [] 
+            pred_json = []
+            if os.path.exists(f'data/ImageListTrue{self.name}.json'):
+                with open(f'data/ImageListTrue{self.name}.json', 'r') as file:
+                    true_json = list(json.load(file))
+            if os.path.exists(f'data/ImageListPred{self.name}.json'):
+                with open(f'data/ImageListPred{self.name}.json', 'r') as file:
+                    pred_json = list(json.load(file))
+            pred_json = (pred_json + [None] * len(true_json))[:len(true_json)]
+            self.session.put_images(0, true_json, pred_json)
+            self._session_state = {'inputs': {}, 'predictions': {}}
+            # An emptied session must not bring the old lists back on the next start
+            for list_name in ('True', 'Pred'):
+                list_path = f'data/ImageList{list_name}{self.name}.json'
+                if os.path.exists(list_path):
+                    try:
+                        os.replace(list_path, f'{list_path}.migrated')
+                    except OSError as e:
+                        print(f"Warning: Could not retire {list_path}: {str(e)}")
+        self.images = ImageList(iterable=true_json, name=f'True{self.name}', persist=False)
+        self.prediction_images = ImageList(iterable=pred_json, name=f'Pred{self.name}', persist=False)
+        
+        # Full resolution PIL images for resizing, decoded only when displayed and sharing one memory budget
+        self._image_cache = ImageCache(SettingsWindow._settings.get('image-cache-mb', IMAGE_CACHE_MB))
+        # Network outputs are cached on disk in one cache shared by every page
+        configure_prediction_cache(SettingsWindow._settings.get('prediction-cache-mb', PREDICTION_CACHE_MB))
+        self._image_store = ImageStore(self.images, self._image_cache)
+        self._pred_image_store = ImageStore(self.prediction_images, self._image_cache)
+        
+        # Background counting of camera captures, see count_capture
+        self._capture_worker = None
+        self._capture_worker_key = None
+        self._retired_capture_workers = []
+        self._capture_poll_job = None
+        self._capture_annotations = {}
+        
+        # Rendered PhotoImages keyed by (path, box width, box height, draft)
+        self._render_cache = OrderedDict()
+        self._render_lock = threading.Lock()
+        self._refine_job = None
         # Manual setup for images frame
         self.images_frame = ttk.Frame(self)
         self.images_frame_kwargs = {
@@ -237,33 +301,47 @@ class Page(ttk.Frame):
         self.settings_frame.rowconfigure(0, weight=1)
         self.top_frame.rowconfigure(0, weight=1)
             
-        # Writing images read from disk onto frame in order, if applicable
+        # Restoring images read from disk, only the last image is decoded to be displayed
         for index in range(len(self.images)):
-            file_path = self.images.paths[index]
-            with Image.open(file_path) as og_img:
-                self._original_images.append(og_img.copy())
-            
-            # Reload prediction images    
-            file_path_pred = self.prediction_images.paths[index]
-            try:
-                with Image.open(file_path_pred) as og_pred_img:
-                    self._original_pred_images.append(og_pred_img.copy())
-            except:
-                self._original_pred_images.append(None)
-            self.file_name_dict[index] = file_path
-            self.next()
+            self.file_name_dict[index] = self.images.paths[index]
+        if len(self.images) > 0:
+            self.image_pointer = len(self.images) - 1
+            self.set_image()
         
+    def restore_session(self):
+        """Restores the saved inputs and predictions of every image, called by subclasses once their widgets exist
+        """
+        for img_pointer, saves in self._session_state['inputs'].items():
+            self.top_frame_saves[img_pointer] = saves['top']
+            self.output_frame_saves[img_pointer] = saves['output']
+        for img_pointer, prediction in self._session_state['predictions'].items():
+            self.restore_prediction(img_pointer, prediction)
+        # Only needed at startup
+        self._session_state = None
+        if len(self.images) > 0:
+            self.write_frame()
+    
+    #Abstract method
+    def restore_prediction(self, img_pointer, prediction):
+        """Restores a prediction read from the session onto the page
+
+        Args:
+            img_pointer (int): The index of the predicted image
+            prediction (dict): 'count', 'count_dct', 'model' and 'annotation_path' of the prediction
+        """
+        pass
+    
     def disable_move_buttons(self):
-        self.images_frame.next_button.config(state='disabled')
-        self.images_frame.prev_button.config(state='disabled')
-        self.images_frame.file_select.config(state='disabled')
-        self.images_frame.clear_images.config(state='disabled')     
+        ui_bus.call(self._set_move_buttons, 'disabled', key=(id(self), 'move-buttons'))
     
     def enable_move_buttons(self):
-        self.images_frame.next_button.config(state='enabled')
-        self.images_frame.prev_button.config(state='enabled')
-        self.images_frame.file_select.config(state='enabled')
-        self.images_frame.clear_images.config(state='enabled')
+        ui_bus.call(self._set_move_buttons, 'enabled', key=(id(self), 'move-buttons'))
+    
+    def _set_move_buttons(self, state):
+        self.images_frame.next_button.config(state=state)
+        self.images_frame.prev_button.config(state=state)
+        self.images_frame.file_select.config(state=state)
+        self.images_frame.clear_images.config(state=state)
         
     def add_input(self, widget, **kwargs):
         """Adds and manages a subclass of Inputable onto the top frame, these
@@ -312,6 +390,9 @@ class Page(ttk.Frame):
         Returns:
             dict: Dictionary in dataframe format containing all top frame widget data from this image
         """
+        # The widgets are read on the Tk thread, export commands call this from worker threads
+        if not ui_bus.on_ui_thread():
+            return ui_bus.invoke(self.get_frame_inputs)
         return {self.image_pointer:{iid:self.top_frame_widgets[iid].value for iid in self.top_frame_widgets}}   
     
     def get_all_inputs(self):
@@ -320,6 +401,9 @@ class Page(ttk.Frame):
         Returns:
             dict: Dictionary in dataframe format containing all top frame widget data from all images
         """
+        # Saving and rewriting the frame clears and refills the entry widgets, which only the Tk thread may do
+        if not ui_bus.on_ui_thread():
+            return ui_bus.invoke(self.get_all_inputs)
         if len(self.images) == 0:
             return {}
         
@@ -346,6 +430,9 @@ class Page(ttk.Frame):
         out_widget_data = tuple(map(lambda x: self.output_frame_widgets[x].pop(), out_widgets))
         self.output_frame_saves[self.image_pointer] = tuple(zip(out_widgets, out_widget_data))
         
+        if self.image_pointer < len(self.images):
+            self.session.save_inputs(self.image_pointer, self.top_frame_saves[self.image_pointer], self.output_frame_saves[self.image_pointer])
+        
     def write_frame(self):
         """Writes data from saved dictionaries to frame based on the current image selected
         """
@@ -454,22 +541,19 @@ class Page(ttk.Frame):
         )
         if not file_paths:
             return
-        last_file_path = None
-        for file_path in file_paths:
-            if Path(file_path).suffix not in ['.jpg', '.JPG', '.jpeg', '.png', '.PNG', '.tif', '.TIF']:
-                continue
-            # Store original PIL image
-            pil_img = Image.open(file_path)
-            self._original_images.append(pil_img.copy())
-            pil_img.close()
-            self.images.append(file_path)
-            self.prediction_images.append(None)
-            self._original_pred_images.append(None)
-            self.update_image(file_path)
-            last_file_path = file_path
+        file_paths = [file_path for file_path in file_paths if Path(file_path).suffix in ['.jpg', '.JPG', '.jpeg', '.png', '.PNG', '.tif', '.TIF']]
+        if not file_paths:
+            return
+        # One extend per list, thumbnails are only created if an item is accessed
+        first_pointer = len(self.images)
+        self.images.extend(file_paths)
+        self.prediction_images.extend([None] * len(file_paths))
+        self.session.put_images(first_pointer, self.images.paths[first_pointer:])
+        for img_pointer, file_path in enumerate(file_paths[:-1], start=first_pointer):
+            self.file_name_dict[img_pointer] = Path(file_path).name
         # Only update the UI to the last image added
-        if last_file_path:
-            self.set_image()
+        self.update_image(file_paths[-1])
+        self.set_image()
         
     def update_image(self, file_path):
         """_summary_
@@ -482,14 +566,19 @@ class Page(ttk.Frame):
         self.file_name_dict[self.image_pointer] = Path(file_path).name
         self.write_frame()
                 
-    def set_image(self):
-        """Update the displayed images, resizing to fit the label size, keeping aspect ratio, and centering."""
-        pil_img = None
-        pil_pred_img = None
-        if self._original_images and self.image_pointer < len(self._original_images):
-            pil_img = self._original_images[self.image_pointer]
-        if self._original_pred_images and self.image_pointer < len(self._original_pred_images):
-            pil_pred_img = self._original_pred_images[self.image_pointer]
+    def set_image(self, draft=False):
+        """Update the displayed images, resizing to fit the label size, keeping aspect ratio, and centering.
+        Rendered images are cached by image and label size, so revisiting an image or size is free
+
+        Args:
+            draft (bool, optional): Render a fast, lower quality preview, used while the window is being resized. Defaults to False.
+        """
+        # Predictions finish on worker threads, the redraw runs on the Tk thread and only the latest one is kept
+        if not ui_bus.on_ui_thread():
+            ui_bus.call(self.set_image, draft, key=(id(self), 'set_image'))
+            return
+        self._image_store.focus(self.image_pointer)
+        self._pred_image_store.focus(self.image_pointer)
         lw = self.images_frame.left_window
         rw = self.images_frame.right_window
         
@@ -501,28 +590,13 @@ class Page(ttk.Frame):
         rw_w = rw_w if rw_w not in (None, 0, 1) else THUMBNAIL_SIZE[0]
         rw_h = rw.winfo_height()
         rw_h = rw_h if rw_h not in (None, 0, 1) else THUMBNAIL_SIZE[1]
-                
-        def resize_and_center(pil_img, box_w, box_h):
-            if pil_img is None:
-                return self.black_photoimage
-            img_w, img_h = pil_img.size
-            scale = min(box_w / img_w, box_h / img_h)
-            new_w = int(img_w * scale)
-            new_h = int(img_h * scale)
-            img_resized = pil_img.copy().resize((new_w, new_h), Image.LANCZOS)
-            # Create black background
-            bg = Image.new('RGB', (box_w, box_h), (0, 0, 0))
-            # Center the image
-            x = (box_w - new_w) // 2
-            y = (box_h - new_h) // 2
-            bg.paste(img_resized, (x, y))
-            return PhotoImage(bg)
+        
         # Left image
-        lw_img = resize_and_center(pil_img, lw_w, lw_h)
+        lw_img = self._render(self._image_store, lw_w, lw_h, draft)
         lw.image = lw_img
         lw.config(image=lw_img)
         # Right image
-        rw_img = resize_and_center(pil_pred_img, rw_w, rw_h)
+        rw_img = self._render(self._pred_image_store, rw_w, rw_h, draft)
         rw.image = rw_img
         rw.config(image=rw_img)
         if len(self.images) == 0:
@@ -530,36 +604,122 @@ class Page(ttk.Frame):
         else:
             self.images_frame.counter.config(text=f'{self.image_pointer + 1}/{len(self.images)}')
     
+    def _render(self, store, box_w, box_h, draft=False):
+        """Renders the current image of a store into a box sized PhotoImage, reusing cached renders
+
+        Args:
+            store (ImageStore): The store holding the image
+            box_w (int): Width of the label the image is displayed in
+            box_h (int): Height of the label the image is displayed in
+            draft (bool, optional): Render a fast, lower quality preview. Defaults to False.
+
+        Returns:
+            PIL.ImageTk.PhotoImage: The rendered image
+        """
+        path = store.path(self.image_pointer)
+        if path is None:
+            return self.black_photoimage
+        
+        # A full quality render is always good enough for a draft request
+        hq_key = (str(path), box_w, box_h, False)
+        keys = [hq_key, (str(path), box_w, box_h, True)] if draft else [hq_key]
+        with self._render_lock:
+            for key in keys:
+                if key in self._render_cache:
+                    self._render_cache.move_to_end(key)
+                    return self._render_cache[key]
+        
+        if draft:
+            # Avoid a full decode while resizing, JPEG files can be decoded straight at a reduced scale. Other formats,
+            # like the PNG annotations, are decoded in full once through the image cache so later renders reuse them
+            pil_img = store.peek(self.image_pointer)
+            if pil_img is None and Path(path).suffix.lower() in DRAFT_SUFFIXES:
+                pil_img = self._open_draft(path, box_w, box_h)
+            elif pil_img is None:
+                pil_img = store[self.image_pointer]
+        else:
+            pil_img = store[self.image_pointer]
+        if pil_img is None:
+            return self.black_photoimage
+        
+        img_w, img_h = pil_img.size
+        scale = min(box_w / img_w, box_h / img_h)
+        new_w = max(1, int(img_w * scale))
+        new_h = max(1, int(img_h * scale))
+        if draft:
+            # Integer box reduction first, then a cheap bilinear pass to the exact size
+            factor = max(1, min(img_w // new_w, img_h // new_h))
+            img_resized = (pil_img.reduce(factor) if factor > 1 else pil_img).resize((new_w, new_h), Image.BILINEAR)
+        else:
+            img_resized = pil_img.resize((new_w, new_h), Image.LANCZOS)
+        # Create black background
+        bg = Image.new('RGB', (box_w, box_h), (0, 0, 0))
+        # Center the image
+        x = (box_w - new_w) // 2
+        y = (box_h - new_h) // 2
+        bg.paste(img_resized, (x, y))
+        photo = PhotoImage(bg)
+        
+        key = (str(path), box_w, box_h, draft)
+        with self._render_lock:
+            self._render_cache[key] = photo
+            while len(self._render_cache) > RENDER_CACHE_SIZE:
+                self._render_cache.popitem(last=False)
+        return photo
+    
+    def _open_draft(self, path, box_w, box_h):
+        try:
+            with Image.open(path) as image:
+                image.draft('RGB', (box_w, box_h))
+                image.load()
+            return image
+        except Exception as e:
+            print(f"Warning: Could not open image {path}: {str(e)}")
+            return None
+    
+    def _invalidate_render(self, path):
+        """Drops every cached render of an image, used when the file behind a path changes
+        """
+        if path is None:
+            return
+        with self._render_lock:
+            for key in [key for key in self._render_cache if key[0] == str(path)]:
+                del self._render_cache[key]
+    
     def set_prediction_image(self, prediction_image_pointer, file_path):
         if len(self.images) == 0:
             return
         assert prediction_image_pointer >= 0 and prediction_image_pointer <= len(self.images) - 1
         self.image_pointer = prediction_image_pointer
-        # Store original PIL prediction image
-        if file_path == None:
-            pil_pred_img = None
-        else:
-            pil_pred_img = Image.open(file_path)
-            
-        if len(self._original_pred_images) <= prediction_image_pointer:
-            self._original_pred_images.extend([None] * (prediction_image_pointer + 1 - len(self._original_pred_images)))
-        try:
-            self._original_pred_images[prediction_image_pointer] = pil_pred_img.copy()
-        except AttributeError:
-            self._original_pred_images[prediction_image_pointer] = None
+        # Annotation files are reused between predictions, drop any stale decoded copy and render
+        for path in (self.prediction_images.paths[prediction_image_pointer], file_path):
+            self._pred_image_store.invalidate(path)
+            self._invalidate_render(path)
         self.prediction_images[prediction_image_pointer] = file_path
+        self.session.set_prediction_image(prediction_image_pointer, self.prediction_images.paths[prediction_image_pointer])
         self.set_image()
     
     def clear_all_images(self):
         self.image_pointer = 0
         self.images_frame.right_window.config(image=self.black_photoimage)
         self.images_frame.left_window.config(image=self.black_photoimage)
-        self.images = ImageList(name=f'True{self.name}')
+        self.images = ImageList(name=f'True{self.name}', persist=False)
         self.top_frame_saves = {}
         self.output_frame_saves = {}
-        self.prediction_images = ImageList(name=f'Pred{self.name}')
-        self._original_images = []
-        self._original_pred_images = []
+        self.prediction_images = ImageList(name=f'Pred{self.name}', persist=False)
+        self.session.clear()
+        # Counts still owed for captures of the cleared images are dropped
+        for worker in self._retired_capture_workers + [self._capture_worker]:
+            if worker is not None:
+                worker.close(discard=True)
+        self._capture_worker = None
+        self._retired_capture_workers = []
+        self._capture_annotations = {}
+        self._image_cache.clear()
+        with self._render_lock:
+            self._render_cache.clear()
+        self._image_store = ImageStore(self.images, self._image_cache)
+        self._pred_image_store = ImageStore(self.prediction_images, self._image_cache)
         widgets = self.top_frame_widgets
         for key in self.top_frame_widgets:
             widgets[key].push(None)
@@ -568,8 +728,308 @@ class Page(ttk.Frame):
             widgets[key].push(None)
         self.images_frame.counter.config(text='-/0')
 
+    #Abstract method
+    def get_model_dir(self):
+        """Returns the directory of the selected model, None if no model is selected
+        """
+        return None
+    
+    #Abstract method
+    def annotation_file(self, img_pointer):
+        """Returns the file an annotation of an image is saved to, None if it is not saved
+        """
+        return None
+    
+    #Abstract method
+    def record_prediction(self, img_pointer, result, annotation_fp):
+        """Stores a finished prediction on the page
+        """
+        pass
+    
+    def save_annotation(self, annotation, annotation_fp):
+        """Writes an annotated image to disk, failures are reported but do not stop predictions
+
+        Args:
+            annotation (PIL.Image.Image): The annotated image
+            annotation_fp (os.PathLike): The file to save to, nothing is saved if None
+        """
+        if annotation is None or annotation_fp is None:
+            return
+        try:
+            os.makedirs(os.path.dirname(annotation_fp), exist_ok=True)
+            annotation.save(fp=annotation_fp)
+        except Exception as e:
+            print(f"Warning: Could not save annotation: {str(e)}")
+    
+    def predict_batch(self, img_pointers, predictor):
+        """Predicts several images through a PredictionPipeline, overlapping decoding, inference and annotation.
+        Results are recorded on the calling thread as each image finishes. The batch stops early when the command
+        running it is cancelled, images already predicted stay recorded
+
+        Args:
+            img_pointers (list[int]): The indices of the images to predict
+            predictor (model.Predictor): The predictor used for every image
+
+        Returns:
+            bool: False if the batch was cancelled before every image was predicted, images that failed count as done
+        """
+        annotate = self.settings['toggles']['annotate-default']
+        # Images already counted with this model, in this or an earlier session, are restored instead of predicted
+        img_pointers = self.resume_from_checkpoints(img_pointers, predictor.fingerprint, annotate)
+        if command_executor.cancelled():
+            return False
+        # Resolved up front so any folder prompt happens once, before the pipeline starts
+        annotation_fps = {img_pointer: self.annotation_file(img_pointer) if annotate else None for img_pointer in img_pointers}
+        
+        def save(img_pointer, result):
+            self.save_annotation(result.annotation, annotation_fps[img_pointer])
+        
+        pipeline = None
+        
+        def progress(counts, total):
+            # Every stage counts for a third of the bar
+            self.progress = 100 * sum(counts.values()) / (len(STAGES) * total)
+            self.progress_bar.push(self.progress)
+            # Progress is reported even while no image finishes, so a cancel stops the stages without waiting for a result
+            if pipeline is not None and command_executor.cancelled():
+                pipeline.cancel()
+        
+        workers = int(SettingsWindow._settings.get('prediction-workers', 0) or 0)
+        if workers >= 2:
+            pool = self.get_process_pool(predictor.model_dir, workers)
+            # Worker processes read the files, captured images may still be being written
+            for img_pointer in img_pointers:
+                self._image_cache.wait_for_write(self.images.paths[img_pointer])
+            jobs = [(img_pointer, self.images.paths[img_pointer], annotation_fps[img_pointer]) for img_pointer in img_pointers]
+            results = pool.run(jobs, annotate=annotate, progress=progress)
+        else:
+            pipeline = PredictionPipeline(predictor, annotate=annotate, save=save, progress=progress)
+            # Images already decoded, like camera stills, skip the decoder's disk read
+            jobs = [(img_pointer, self.cached_image(img_pointer) or self.images.paths[img_pointer]) for img_pointer in img_pointers]
+            results = pipeline.run(jobs)
+        
+        predicted = 0
+        failed = 0
+        for img_pointer, result in results:
+            predicted += 1
+            if isinstance(result, Exception):
+                # An unreadable image is skipped, the rest of the batch carries on
+                print(f"Warning: Could not predict {self.images.paths[img_pointer]}: {str(result)}")
+                failed += 1
+                self.model_error_label.push(f'Could not count {failed} image{"s" if failed > 1 else ""}')
+            else:
+                self.record_prediction(img_pointer, result, annotation_fps[img_pointer])
+                self.predict_counter.push(result.count)
+            # Leaving the loop closes the generator, which stops the pipeline or cancels the queued worker jobs
+            if command_executor.cancelled():
+                break
+        return predicted == len(img_pointers)
+    
+    def cached_image(self, img_pointer):
+        """Returns the decoded image at an index if the image cache holds it, such as a camera still whose JPEG may
+        still be being written, never reading the file
+
+        Returns:
+            PIL.Image.Image: The decoded image, None if it is not cached
+        """
+        return self._image_cache.peek(self.images.paths[img_pointer])
+    
+    def open_image(self, img_pointer):
+        """Returns the decoded image at an index for prediction, from the image cache when possible
+
+        Returns:
+            PIL.Image.Image: The decoded image
+        """
+        image = self.cached_image(img_pointer)
+        if image is not None:
+            return image
+        with Image.open(self.images.paths[img_pointer]) as image:
+            image.load()
+        return image
+    
+    def content_hash(self, img_pointer):
+        """Returns the content hash of an image, None if the file cannot be read
+        """
+        # The hash is read from the file, a captured image may still be being written
+        self._image_cache.wait_for_write(self.images.paths[img_pointer])
+        try:
+            return self.session.content_hash(self.images.paths[img_pointer])
+        except OSError as e:
+            print(f"Warning: Could not hash image {img_pointer}: {str(e)}")
+            return None
+    
+    def resume_from_checkpoints(self, img_pointers, model, annotate):
+        """Records the checkpointed prediction of every image already predicted with a model, found by image content
+
+        Args:
+            img_pointers (list[int]): The indices of the images to predict
+            model (str): The fingerprint of the model the batch predicts with
+            annotate (bool): Whether the batch annotates, a checkpoint whose annotated image is gone is predicted again
+
+        Returns:
+            list[int]: The indices of the images that still have to be predicted, every image not yet looked at when
+                       the batch was cancelled is included
+        """
+        remaining = []
+        for done, img_pointer in enumerate(img_pointers):
+            # The first run over a folder hashes every image, which takes a while on large folders
+            self.progress = 100 * done / len(img_pointers)
+            self.progress_bar.push(self.progress)
+            if command_executor.cancelled():
+                return remaining + img_pointers[done:]
+            
+            content_hash = self.content_hash(img_pointer)
+            checkpoint = None if content_hash is None else self.session.find_checkpoint(content_hash, model)
+            if checkpoint is None:
+                remaining.append(img_pointer)
+                continue
+            annotation_fp = self.claim_annotation(img_pointer, checkpoint['annotation_path']) if annotate else None
+            if annotate and annotation_fp is None:
+                remaining.append(img_pointer)
+                continue
+            result = Prediction(checkpoint['count'], checkpoint['count_dct'], {}, labels=None, details=None, model=model)
+            self.record_prediction(img_pointer, result, annotation_fp)
+            self.predict_counter.push(result.count)
+        return remaining
+    
+    def claim_annotation(self, img_pointer, annotation_fp):
+        """Moves a checkpointed annotation onto the annotation file of an image's current position. Annotation files are
+        named by position, so a file written while the image sat at another position would later be overwritten by
+        whichever image is predicted there
+
+        Args:
+            img_pointer (int): The current index of the image
+            annotation_fp (os.PathLike): The checkpointed annotation file, None if there is none
+
+        Returns:
+            os.PathLike: The annotation file of the image's position, None if there is no annotation or it could not be copied
+        """
+        if annotation_fp is None:
+            return None
+        target_fp = self.annotation_file(img_pointer)
+        if target_fp is None:
+            return None
+        if os.path.abspath(target_fp) == os.path.abspath(annotation_fp):
+            return target_fp
+        try:
+            os.makedirs(os.path.dirname(target_fp), exist_ok=True)
+            temp_fp = f'{target_fp}.tmp'
+            shutil.copyfile(annotation_fp, temp_fp)
+            os.replace(temp_fp, target_fp)
+        except OSError as e:
+            print(f"Warning: Could not copy annotation {annotation_fp}: {str(e)}")
+            return None
+        return target_fp
+    
+    def cancel_batch(self):
+        """Cancels the page's batch prediction, runs on the Tk thread from the Cancel button
+        """
+        if self.batch_button.cancel():
+            self.model_error_label.push('Cancelling...')
+    
+    def count_capture(self, img_pointer, image):
+        """Queues a captured image on the page's background capture worker, its count is recorded once it finishes
+        while the camera keeps running
+
+        Args:
+            img_pointer (int): The index of the captured image
+            image (PIL.Image.Image): The captured image
+
+        Returns:
+            bool: False if no model is selected
+        """
+        model_dir = self.get_model_dir()
+        if model_dir is None:
+            return False
+        annotate = self.settings['toggles']['annotate-default']
+        self._capture_annotations[img_pointer] = self.annotation_file(img_pointer) if annotate else None
+        self.get_capture_worker(model_dir, annotate).submit(img_pointer, image)
+        if self._capture_poll_job is None:
+            self._capture_poll_job = self.after(CAPTURE_POLL_MS, self._poll_captures)
+        return True
+    
+    def get_capture_worker(self, model_dir, annotate):
+        """Returns the page's capture worker for a model, replacing it when the model or annotation setting changes.
+        The model itself comes from the model cache, so replacing the worker does not reload it, and a model that is not
+        cached yet loads on the worker thread
+
+        Returns:
+            pipeline.PredictionWorker: The capture worker
+        """
+        key = (str(model_dir), annotate)
+        if self._capture_worker is not None and self._capture_worker_key == key:
+            return self._capture_worker
+        if self._capture_worker is not None:
+            # The old worker finishes its queue and keeps being polled until its results are collected
+            self._capture_worker.close()
+            self._retired_capture_workers.append(self._capture_worker)
+        
+        # Bound to this worker's annotation paths, a clear all replaces the page's dictionary
+        capture_annotations = self._capture_annotations
+        
+        def save(img_pointer, result):
+            self.save_annotation(result.annotation, capture_annotations.get(img_pointer))
+        
+        self._capture_worker = PredictionWorker(model_dir, annotate=annotate, save=save)
+        self._capture_worker_key = key
+        return self._capture_worker
+    
+    def _poll_captures(self):
+        self._capture_poll_job = None
+        for worker in self._retired_capture_workers + [self._capture_worker]:
+            if worker is not None:
+                self._collect_captures(worker)
+        self._retired_capture_workers = [worker for worker in self._retired_capture_workers if worker.pending > 0]
+        if self._retired_capture_workers or (self._capture_worker is not None and self._capture_worker.pending > 0):
+            self._capture_poll_job = self.after(CAPTURE_POLL_MS, self._poll_captures)
+    
+    def _collect_captures(self, worker):
+        for img_pointer, result in worker.results():
+            if isinstance(result, Exception):
+                print(f"Warning: Could not count capture {img_pointer}: {str(result)}")
+                self.model_error_label.push(f'Could not count image {img_pointer + 1}')
+                continue
+            # Recording moves the page to the counted image, stay on the image being shown
+            img_pointer_shown = self.image_pointer
+            self.record_prediction(img_pointer, result, self._capture_annotations.pop(img_pointer, None))
+            if img_pointer == img_pointer_shown:
+                self.predict_counter.push(result.count)
+            else:
+                self.image_pointer = img_pointer_shown
+                self.set_image()
+    
+    def get_process_pool(self, model_dir, workers):
+        """Returns the page's worker process pool for a model, replacing the pool when the model or worker count changes.
+        Workers stay alive between batches so each loads its model only once
+
+        Args:
+            model_dir (os.PathLike): The model directory the workers predict with
+            workers (int): The number of worker processes
+
+        Returns:
+            pipeline.ProcessPredictionPool: The worker pool
+        """
+        # Workers copy the prediction cache settings when they start, a new budget needs new workers
+        key = (str(model_dir), workers, prediction_cache_settings())
+        pool = getattr(self, '_process_pool', None)
+        if pool is not None and self._process_pool_key == key:
+            return pool
+        if pool is not None:
+            pool.close()
+        self._process_pool = ProcessPredictionPool(model_dir, workers)
+        self._process_pool_key = key
+        return self._process_pool
+
     def _on_images_frame_resize(self, event):
-        """Handle resizing of the images_frame to update image sizes."""
+        """Handle resizing of the images_frame to update image sizes. A draft is shown right away and
+        the full quality render waits until resizing has stopped for RESIZE_DEBOUNCE_MS"""
+        self.set_image(draft=True)
+        if self._refine_job is not None:
+            self.after_cancel(self._refine_job)
+        self._refine_job = self.after(RESIZE_DEBOUNCE_MS, self._refine_image)
+    
+    def _refine_image(self):
+        self._refine_job = None
         self.set_image()
 
     def take_image(self):
@@ -579,39 +1039,26 @@ class Page(ttk.Frame):
         self._open_camera_window()
 
     def _open_camera_window(self):
-        import threading
         import tkinter.messagebox as mb
         from PIL import Image, ImageTk
         import tkinter as tk
+        import cv2
+        from camera import FrameGrabber, WebcamSource, PicameraSource
         # Camera setup
         use_picamera2 = False
         if is_raspberry_pi() and has_picamera2():
             use_picamera2 = True
-        if use_picamera2:
-            try:
-                from picamera2 import Picamera2 # type: ignore
-                import numpy as np
-            except ImportError:
-                mb.showerror('Camera Error', 'picamera2 is not installed')
-                self.images_frame.take_image.config(state='normal')  # Re-enable button on error
-                return
-            picam = Picamera2()
-            config = picam.create_preview_configuration()
-            picam.configure(config)
-            picam.start()
-            # Get camera resolution
-            cam_res = picam.capture_metadata()['ScalerCrop'][2:]
-            native_width, native_height = cam_res if cam_res else (640, 480)
-        else:
-            cap = cv2.VideoCapture(0)
-            if not cap.isOpened():
-                mb.showerror('Camera Error', 'Could not open webcam')
-                self.images_frame.take_image.config(state='normal')  # Re-enable button on error
-                return
-            cap.set(cv2.CAP_PROP_FRAME_WIDTH, 9999)
-            cap.set(cv2.CAP_PROP_FRAME_HEIGHT, 9999)
-            native_width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-            native_height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        try:
+            source = PicameraSource() if use_picamera2 else WebcamSource()
+        except ImportError:
+            mb.showerror('Camera Error', 'picamera2 is not installed')
+            self.images_frame.take_image.config(state='normal')  # Re-enable button on error
+            return
+        except OSError as e:
+            mb.showerror('Camera Error', str(e))
+            self.images_frame.take_image.config(state='normal')  # Re-enable button on error
+            return
+        native_width, native_height = source.size
         aspect = native_width / native_height if native_height != 0 else 4/3
         # Get screen size and set initial window size
         root = self.winfo_toplevel()
@@ -642,38 +1089,28 @@ class Page(ttk.Frame):
         btn_frame.pack(pady=(10, 20))
         capture_btn = ttk.Button(btn_frame, text='Capture')
         cancel_btn = ttk.Button(btn_frame, text='Cancel')
+        # Capture and count keeps the camera open and counts every capture in the background
+        count_var = tk.BooleanVar(value=False)
+        count_check = ttk.Checkbutton(btn_frame, text='Capture and count', variable=count_var)
         capture_btn.grid(row=0, column=0, padx=20)
         cancel_btn.grid(row=0, column=1, padx=20)
+        count_check.grid(row=0, column=2, padx=20)
         btn_frame.grid_columnconfigure(0, weight=1)
         btn_frame.grid_columnconfigure(1, weight=1)
-        # State
+        btn_frame.grid_columnconfigure(2, weight=1)
+        # State, frames are read and scaled on the grabber thread, this thread only shows the latest preview
         self._camera_running = True
-        self._camera_frame = None
-        self._last_preview_size = (preview_w, preview_h)
+        grabber = FrameGrabber(source, (preview_w, preview_h)).start()
+        shown = [0]
         def update_frame():
             if not self._camera_running:
                 return
-            if use_picamera2:
-                frame = picam.capture_array()
-                self._camera_frame = frame.copy()
-                w, h = self._last_preview_size
-                preview_img = cv2.cvtColor(frame, cv2.COLOR_RGBA2RGB)
-                preview_pil = Image.fromarray(preview_img)
-                preview_pil = preview_pil.resize((w, h))
-                imgtk = ImageTk.PhotoImage(image=preview_pil)
+            latest = grabber.preview(after=shown[0])
+            if latest is not None:
+                shown[0], preview = latest
+                imgtk = ImageTk.PhotoImage(image=Image.fromarray(preview))
                 video_frame.imgtk = imgtk
                 video_frame.config(image=imgtk)
-            else:
-                ret, frame = cap.read()
-                if ret:
-                    self._camera_frame = frame.copy()
-                    w, h = self._last_preview_size
-                    preview_img = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-                    preview_pil = Image.fromarray(preview_img)
-                    preview_pil = preview_pil.resize((w, h))
-                    imgtk = ImageTk.PhotoImage(image=preview_pil)
-                    video_frame.imgtk = imgtk
-                    video_frame.config(image=imgtk)
             cam_win.after(20, update_frame)
         def on_resize(event):
             win_w = cam_win.winfo_width() - 20
@@ -684,38 +1121,43 @@ class Page(ttk.Frame):
             else:
                 new_h = max(1, win_h)
                 new_w = max(1, int(win_h * aspect))
-            self._last_preview_size = (new_w, new_h)
+            grabber.set_preview_size((new_w, new_h))
         cam_win.bind('<Configure>', on_resize)
         def on_capture():
-            if self._camera_frame is not None:
+            # The still, a full sensor mode switch on the Raspberry Pi camera, is taken on a worker thread so the
+            # preview keeps running, the result comes back to this thread through the UI dispatcher
+            capture_btn.config(state='disabled')
+            def take_still():
+                frame = grabber.still()
+                still = None if frame is None else Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+                ui_bus.call(on_still, still)
+            if command_executor.submit((id(grabber), 'still'), take_still) is None:
+                capture_btn.config(state='normal')
+        def on_still(still):
+            if not self._camera_running:
+                return
+            capture_btn.config(state='normal')
+            if still is not None:
                 with tempfile.NamedTemporaryFile(suffix='.jpg', delete=False) as tmp:
-                    img_path = tmp.name
-                    # Convert color before saving captured frame
-                    frame = self._camera_frame.copy()
-                    if use_picamera2:
-                        # Convert RGBA camera frame to BGR for correct color saving
-                        frame_to_save = cv2.cvtColor(frame, cv2.COLOR_RGBA2BGR)
-                    else:
-                        # Frame is already in BGR format
-                        frame_to_save = frame
-                    cv2.imwrite(img_path, frame_to_save)
-                pil_img = Image.open(img_path)
-                self._original_images.append(pil_img.copy())
+                    img_path = str(Path(tmp.name).resolve())
+                # The still goes straight into the image cache, the JPEG is written in the background
+                self._image_cache.save(img_path, still, format='JPEG', quality=95)
                 self.images.append(img_path)
                 self.prediction_images.append(None)
-                self._original_pred_images.append(None)
+                self.session.put_images(len(self.images) - 1, [self.images.paths[-1]])
                 self.update_image(img_path)
                 self.set_image() 
+                if count_var.get():
+                    if self.count_capture(len(self.images) - 1, still):
+                        cancel_btn.config(text='Done')
+                        return
+                    count_var.set(False)
             cleanup()
         def on_cancel():
             cleanup()
         def cleanup():
-            if use_picamera2:
-                picam.stop()
-                picam.close()
-            else:
-                cap.release()
             self._camera_running = False
+            grabber.stop(close_source=True)
             self.images_frame.take_image.config(state='normal')  # Re-enable the button
             cam_win.destroy()
         capture_btn.config(command=on_capture)
@@ -729,13 +1171,9 @@ class Page(ttk.Frame):
         from PIL import ImageTk
         # Get the image to display
         if which == 'left':
-            pil_img = None
-            if self._original_images and self.image_pointer < len(self._original_images):
-                pil_img = self._original_images[self.image_pointer]
+            pil_img = self._image_store[self.image_pointer]
         elif which == 'right':
-            pil_img = None
-            if self._original_pred_images and self.image_pointer < len(self._original_pred_images):
-                pil_img = self._original_pred_images[self.image_pointer]
+            pil_img = self._pred_image_store[self.image_pointer]
         else:
             return
         if pil_img is None:
@@ -845,8 +1283,6 @@ class OysterPage(Page):
         self.help_window_open = False
         self.brood_count_dict = {}
         self.excel_obj = OysterExcel()
-        self.settings_obj = SettingsWindow()
-        self.settings = self.settings_obj.settings
         
         if 'csv_path' not in SettingsWindow._settings:
             SettingsWindow._settings['csv_path'] = ''
@@ -867,10 +1303,13 @@ class OysterPage(Page):
        
         # Add the settings buttons in a single row
         self.predict_button = self.add_settings(IOButton, text='Predict Brood Count', command=self.get_prediction, disable_during_run=True)
-        self.add_settings(IOButton, text='Append to CSV File', command=self.load_csv)
-        self.add_settings(IOButton, text='Predict all and Export', command=self.to_csv, disable_during_run=True)
-        self.add_settings(IOButton, text='Settings', command=self.open_settings)
-        self.add_settings(IOButton, text='Help', command=self.open_help)
+        # Both buttons change the open CSV data, only one of them runs at a time
+        self.add_settings(IOButton, text='Append to CSV File', command=self.load_csv, flight_key=(id(self), 'csv'))
+        self.batch_button = self.add_settings(IOButton, text='Predict all and Export', command=self.to_csv, disable_during_run=True, flight_key=(id(self), 'csv'))
+        self.add_settings(IOButton, text='Cancel', command=self.cancel_batch, threaded=False)
+        # Both open windows, which is only allowed on the Tk thread
+        self.add_settings(IOButton, text='Settings', command=self.open_settings, threaded=False)
+        self.add_settings(IOButton, text='Help', command=self.open_help, threaded=False)
         
         self.predict_counter = self.add_output(Counter, text='Oyster Brood Count')
         self.model_error_label = self.add_output(ErrorLabel, text='')
@@ -886,79 +1325,109 @@ class OysterPage(Page):
                 self.model_error_label.push(None)
         self.model_select.menu_var.trace_add('write', clear_error_on_select)
         
-    def get_prediction(self, img_pointer=None, auto_export=True):
-        # Hide error label by default
-        self.model_error_label.push(None)
-        
-        if img_pointer is None:
-            img_pointer = self.image_pointer
-        
-        if len(self.images) == 0  or img_pointer >= len(self.images) or img_pointer < 0:
-            return 0
+        self.restore_session()
         
+    def get_model_dir(self):
+        """Resolves the model dropdown into a model directory, showing an error if no model is selected
+
+        Returns:
+            os.PathLike: The model directory, or None if no valid model is selected
+        """
         model_path = self.model_select.value
         if model_path is None:
             self.model_error_label.push('Please select a model before predicting.')
-            return 0
-        classes = 1  # Default value
+            return None
         if model_path == '2-4mm model':
             model_path = get_model_path('models/oyster_2-4mm')
         elif model_path == '4-6mm model':
             model_path = get_model_path('models/oyster_4-6mm')
         elif model_path == 'choose a model from folder':
-            model_path = get_model_path(askdirectory(title='Please select a model directory'))
+            model_path = get_model_path(ui_bus.invoke(askdirectory, title='Please select a model directory'))
         else:
             self.model_error_label.push('Please select a model before predicting.')
+            return None
+        return model_path
+    
+    def get_prediction(self, img_pointer=None, auto_export=True, predictor=None):
+        # Hide error label by default
+        self.model_error_label.push(None)
+        
+        if img_pointer is None:
+            img_pointer = self.image_pointer
+        
+        if len(self.images) == 0  or img_pointer >= len(self.images) or img_pointer < 0:
             return 0
         
+        # Batch callers pass in one predictor for every image
+        if predictor is None:
+            model_path = self.get_model_dir()
+            if model_path is None:
+                return 0
+            predictor = Predictor(model_path)
+        
         # Always use img_pointer for image and annotation
-        with Image.open(self.images.paths[img_pointer]) as img:  
-            annotate = self.settings['toggles']['annotate-default']
-            api = ModelAPI(model_path, img, classes, annotate)   
-            count, annotation = api.get()
+        annotate = self.settings['toggles']['annotate-default']
+        result = predictor.predict(self.open_image(img_pointer), annotate)
+        count, annotation = result.count, result.annotation
 
         # Determine where to save annotations
         if annotation:
-            anno_dir = self.settings['annotation_path']
-            if self.settings['toggles']['autosave-image-default']:
-                # Prompt user for annotation directory on first use
-                if not anno_dir:
-                    selected = askdirectory(
-                        initialdir=get_annotation_path('annotations'),
-                        title='Select folder to save annotation images'
-                    )
-                    if selected:
-                        anno_dir = selected
-                        # Persist choice
-                        SettingsWindow._settings['annotation_path'] = anno_dir
-                        self.settings_obj.write_user_settings()
-                # Build full annotation file path
-                if anno_dir:
-                    annotation_fp = os.path.join(anno_dir, f"oysterannotation{img_pointer}.png")
-                else:
-                    # Fallback to persistent annotations folder
-                    fallback_dir = get_output_dir('annotations')
-                    annotation_fp = os.path.join(fallback_dir, f"oysterannotation{img_pointer}.png")
-                # Save the annotation image
-                try:
-                    os.makedirs(os.path.dirname(annotation_fp), exist_ok=True)
-                    annotation.save(fp=annotation_fp)
-                except Exception as e:
-                    print(f"Warning: Could not save annotation: {str(e)}")
+            annotation_fp = self.annotation_file(img_pointer)
+            self.save_annotation(annotation, annotation_fp)
         else:
             annotation_fp = None
-        self.brood_count_dict[img_pointer] = count
-        self.set_prediction_image(img_pointer, annotation_fp)
+        self.record_prediction(img_pointer, result, annotation_fp)
         
         # Auto-export to CSV only if enabled and this call allows it
         if auto_export and self.settings['toggles']['excel-default']:
             self.to_csv(predict_all=False)
         
         if self.settings['toggles']['clear-excel-default']:
-            self.excel_obj = OysterExcel()
+            self.reset_excel_obj()
             
         return count
     
+    def annotation_file(self, img_pointer):
+        """Returns the file an annotation of an image is saved to, prompting for the annotation folder on first use
+
+        Args:
+            img_pointer (int): The index of the annotated image
+
+        Returns:
+            os.PathLike: The annotation file path, or None if annotations are not autosaved
+        """
+        if not self.settings['toggles']['autosave-image-default']:
+            return None
+        
+        anno_dir = self.settings['annotation_path']
+        # Prompt user for annotation directory on first use
+        if not anno_dir:
+            selected = ui_bus.invoke(
+                askdirectory,
+                initialdir=get_annotation_path('annotations'),
+                title='Select folder to save annotation images'
+            )
+            if selected:
+                anno_dir = selected
+                # Persist choice
+                SettingsWindow._settings['annotation_path'] = anno_dir
+                self.settings_obj.write_user_settings()
+        # Build full annotation file path
+        if anno_dir:
+            return os.path.join(anno_dir, f"oysterannotation{img_pointer}.png")
+        # Fallback to persistent annotations folder
+        fallback_dir = get_output_dir('annotations')
+        return os.path.join(fallback_dir, f"oysterannotation{img_pointer}.png")
+    
+    def record_prediction(self, img_pointer, result, annotation_fp):
+        self.brood_count_dict[img_pointer] = result.count
+        self.session.record_prediction(img_pointer, result.count, result.count_dct, model=result.model,
+                                       annotation_path=annotation_fp, content_hash=self.content_hash(img_pointer))
+        self.set_prediction_image(img_pointer, annotation_fp)
+    
+    def restore_prediction(self, img_pointer, prediction):
+        self.brood_count_dict[img_pointer] = prediction['count']
+    
     def open_help(self):
         def on_destroy(event):
             self.help_window_open = False
@@ -979,12 +1448,14 @@ class OysterPage(Page):
             self.progress_bar.push(self.progress)
     
     def to_csv(self, drop_na=True, predict_all=True):
+        import pandas as pd
         # Determine export directory from user settings
         export_dir = SettingsWindow._settings.get('csv_path', '')
         # Full export: ask for folder if not already set
         if predict_all:
             if not export_dir:
-                dir_selected = askdirectory(
+                dir_selected = ui_bus.invoke(
+                    askdirectory,
                     initialdir=get_excel_path('excel'),
                     title='Select folder to save CSV files'
                 )
@@ -994,29 +1465,41 @@ class OysterPage(Page):
                 SettingsWindow._settings['csv_path'] = export_dir
                 self.settings_obj.write_user_settings()
             # Reset data and predict all without individual exports
-            self.excel_obj = OysterExcel()
+            self.reset_excel_obj()
             
             self.disable_move_buttons()
-            self.predict_button.button.config(state='disabled')
-            for img_pointer in range(len(self.images)):
-                self.save_frame()
-                self.img_pointer = img_pointer
-                self.write_frame()
-                self.progress = 100 * img_pointer / len(self.images)
-                self.progress_bar.push(self.progress)
-                if img_pointer not in self.brood_count_dict:
-                    count = self.get_prediction(img_pointer, auto_export=False)
-                    self.predict_counter.push(count)
+            self.predict_button.set_state('disabled')
+            # One predictor, and one model prompt, for the whole batch. Images already counted with the model are
+            # restored from their checkpoints by predict_batch
+            img_pointers = list(range(len(self.images)))
+            completed = True
+            if img_pointers:
+                self.model_error_label.push(None)
+                model_path = self.get_model_dir()
+                if model_path is not None:
+                    completed = self.predict_batch(img_pointers, Predictor(model_path))
             self.progress = 100
             self.progress_bar.push(self.progress)
             self.enable_move_buttons()
-            self.predict_button.button.config(state='normal')
+            self.predict_button.set_state('normal')
+            # A cancelled batch is not exported, the images already counted are kept for the next run
+            if not completed:
+                self.model_error_label.push('Prediction cancelled')
+                return
             
-        data = self.get_all_inputs()
+        if predict_all:
+            data = self.get_all_inputs()
+            file_names = self.file_name_dict
+            counts = self.brood_count_dict
+        else:
+            # Incremental export after a single prediction only needs the current image
+            data = self.get_frame_inputs()
+            file_names = {k: v for k, v in self.file_name_dict.items() if k == self.image_pointer}
+            counts = {k: v for k, v in self.brood_count_dict.items() if k == self.image_pointer}
 
         df = pd.DataFrame.from_dict(data, orient='index')
-        df_file = pd.DataFrame.from_dict(self.file_name_dict, orient='index')
-        df_count = pd.DataFrame.from_dict(self.brood_count_dict, orient='index')
+        df_file = pd.DataFrame.from_dict(file_names, orient='index')
+        df_count = pd.DataFrame.from_dict(counts, orient='index')
      
         df = pd.concat(objs=[df, df_file, df_count], axis=1, ignore_index = True)
         
@@ -1033,18 +1516,16 @@ class OysterPage(Page):
         for col in numeric_columns:
             df[col] = pd.to_numeric(df[col])
 
-        # Append only the last record when doing incremental export
-        if predict_all:
-            df_to_export = df
-        else:
-            df_to_export = df.tail(1)
-
         # Fallback to persistent csv folder when no user setting is provided
         if not export_dir:
             export_dir = get_output_dir('excel')
         base_path = os.path.join(export_dir, f'data{self.excel_obj.id}')
-        self.excel_obj.extend(df_to_export)
-        self.excel_obj.write_csv(base_path=base_path)
+        self.excel_obj.extend(df)
+        # Incremental exports only append the new row to the open data file
+        self.excel_obj.write_csv(base_path=base_path, append=not predict_all)
+        export_format = get_columnar_format()
+        if predict_all and export_format is not None:
+            self.excel_obj.write_columnar(base_path=base_path, format=export_format)
         
     # For backward compatibility
     def to_excel(self, drop_na=True, predict_all=True):
@@ -1059,16 +1540,20 @@ class OysterPage(Page):
         except Exception as e:
             print(f"Warning: Could not create excel directory: {str(e)}")
         
-        file_path = askopenfilename(
+        file_path = ui_bus.invoke(
+            askopenfilename,
             initialdir=initialdir,
             title='Please select a CSV file to open',
-            filetypes=[('CSV Files', '*.csv'), ('Excel Files', '*.xlsx *.xlsb *.xltx *.xltm *.xls *.xlt *.ods')]
+            filetypes=[('CSV Files', '*.csv'), ('Parquet and Arrow Files', '*.parquet *.arrow *.feather'), ('Excel Files', '*.xlsx *.xlsb *.xltx *.xltm *.xls *.xlt *.ods')]
         )
         
-        if file_path == ():
+        if file_path == () or not file_path:
             return
         
-        if Path(file_path).suffix not in ['.csv', '.xlsx', '.xlsb', '.xltx', '.xltm', '.xls', '.xlt', '.ods']:
+        if Path(file_path).suffix not in ['.csv', '.xlsx', '.xlsb', '.xltx', '.xltm', '.xls', '.xlt', '.ods'] and not is_columnar(file_path):
+            return
+        if is_columnar(file_path) and not has_pyarrow():
+            print(f"Error reading {file_path}: pyarrow is not installed")
             return
 
         self.excel_obj.read_csv(file_path)
@@ -1076,7 +1561,13 @@ class OysterPage(Page):
     def clear_all_images(self):
         super().clear_all_images()
         if self.settings['toggles']['clear-output-default']:
-            self.excel_obj = OysterExcel()
+            self.reset_excel_obj()
+    
+    def reset_excel_obj(self):
+        """Replaces the collected oyster data with an empty OysterExcel, closing the data file the old one kept open
+        """
+        self.excel_obj.close()
+        self.excel_obj = OysterExcel()
         
     def open_settings(self):
         Settings(self)
@@ -1091,8 +1582,6 @@ class DevisionPage(Page):
         self.help_window_open = False
         self.egg_count_dict = {}
         self.class_count_dicts = {}
-        self.settings_obj = SettingsWindow()
-        self.settings = self.settings_obj.settings
         self.model_names = ['Frog Egg Counter', 
                             'Xenopus 4 Class Counter',
                             'Select a Model from Folder'
@@ -1103,10 +1592,13 @@ class DevisionPage(Page):
         self.model_select = self.add_input(DropdownBox, text='Select a Model Below', dropdowns=self.model_names)
         
         self.predict_button: IOButton = self.add_settings(IOButton, text='Predict and Annotate', command=self.get_prediction, disable_during_run=True)
-        self.add_settings(IOButton, text='Export to CSV', command=self.to_csv)
-        self.add_settings(IOButton, text='Predict All', command=self.predict_all, disable_during_run=True)
-        self.add_settings(IOButton, text='Settings', command=self.open_settings)
-        self.add_settings(IOButton, text='Help', command=self.open_help)
+        # Exporting reads the count dictionaries Predict All fills, the two never run at the same time
+        self.add_settings(IOButton, text='Export to CSV', command=self.to_csv, flight_key=(id(self), 'csv'))
+        self.batch_button = self.add_settings(IOButton, text='Predict All', command=self.predict_all, disable_during_run=True, flight_key=(id(self), 'csv'))
+        self.add_settings(IOButton, text='Cancel', command=self.cancel_batch, threaded=False)
+        # Both open windows, which is only allowed on the Tk thread
+        self.add_settings(IOButton, text='Settings', command=self.open_settings, threaded=False)
+        self.add_settings(IOButton, text='Help', command=self.open_help, threaded=False)
 
         
         self.predict_counter = self.add_output(Counter, text='Model Count')
@@ -1115,6 +1607,8 @@ class DevisionPage(Page):
 
        
         self.predict_button.bind_out(self.predict_counter)
+        
+        self.restore_session()
     
     def write_frame(self):
         out =  super().write_frame()
@@ -1124,66 +1618,90 @@ class DevisionPage(Page):
     
     def predict_all(self):
         self.disable_move_buttons()
-        self.predict_button.button.config(state='disabled')
-        for img_pointer in range(len(self.images)):
-            self.save_frame()
-            self.img_pointer = img_pointer
-            self.write_frame()
-            self.progress = 100 * img_pointer / len(self.images)
-            self.progress_bar.push(self.progress)
-            if img_pointer not in self.egg_count_dict:
-                count = self.get_prediction(img_pointer)
-                self.predict_counter.push(count)
+        self.predict_button.set_state('disabled')
+        # One predictor, and one model prompt, for the whole batch. Images already counted with the model are
+        # restored from their checkpoints by predict_batch
+        img_pointers = list(range(len(self.images)))
+        if img_pointers:
+            self.model_error_label.push(None)
+            model_dir = self.get_model_dir()
+            if model_dir is not None and not self.predict_batch(img_pointers, Predictor(model_dir)):
+                self.model_error_label.push('Prediction cancelled')
         self.progress = 100
         self.progress_bar.push(self.progress)
         self.enable_move_buttons()
-        self.predict_button.button.config(state='normal')
+        self.predict_button.set_state('normal')
     
-    def get_prediction(self, img_pointer=None):
-        self.model_error_label.push(None)
-        
-        if not img_pointer:
-            img_pointer = self.image_pointer
-        
-        if len(self.images) == 0  or img_pointer >= len(self.images) or img_pointer < 0:
-            return 0
-                
+    def get_model_dir(self):
+        """Resolves the model dropdown into a model directory, showing an error if no model is selected
+
+        Returns:
+            os.PathLike: The model directory, or None if no valid model is selected
+        """
         model_str = self.model_select.value
         if model_str == self.model_names[1]:
             model_dir = get_model_path('models/xenopus-4-class-v2')
-            classes = 4
         elif model_str == self.model_names[0]:
             model_dir = get_model_path('models/frog-egg-counter')
-            classes = 1
         elif model_str == self.model_names[2]:
-            model_dir = get_model_path(askdirectory(title='Please select a model directory'))
-            classes = 1
-
+            model_dir = get_model_path(ui_bus.invoke(askdirectory, title='Please select a model directory'))
         else:
             self.model_error_label.push('Failed to load model: Please select a valid model.')
+            return None
+        return model_dir
+    
+    def get_prediction(self, img_pointer=None, predictor=None):
+        self.model_error_label.push(None)
+        
+        if img_pointer is None:
+            img_pointer = self.image_pointer
+        
+        if len(self.images) == 0  or img_pointer >= len(self.images) or img_pointer < 0:
             return 0
         
-        with Image.open(self.images.paths[img_pointer]) as img:
-            annotate = self.settings['toggles']['annotate-default']
-            api = ModelAPI(model_dir, img, classes, annotate)
-            count, annotation = api.get()
+        # Batch callers pass in one predictor for every image
+        if predictor is None:
+            model_dir = self.get_model_dir()
+            if model_dir is None:
+                return 0
+            predictor = Predictor(model_dir)
+        
+        annotate = self.settings['toggles']['annotate-default']
+        result = predictor.predict(self.open_image(img_pointer), annotate)
+        count, annotation = result.count, result.annotation
         
         if annotation:
-            annotation_fp = get_annotation_path(f"annotations/devisionannotation{self.image_pointer}.png")
-            if self.settings['toggles']['autosave-image-default']:
-                # Ensure annotations directory exists
-                try:
-                    os.makedirs(os.path.dirname(annotation_fp), exist_ok=True)
-                    annotation.save(fp=annotation_fp)
-                except Exception as e:
-                    print(f"Warning: Could not save annotation: {str(e)}")
+            annotation_fp = self.annotation_file(img_pointer)
+            self.save_annotation(annotation, annotation_fp)
         else:
             annotation_fp = None
-        self.class_count_dicts[img_pointer] = api.count_dct.copy()
-        self.egg_count_dict[img_pointer] = count
-        self.set_prediction_image(img_pointer, annotation_fp)
+        self.record_prediction(img_pointer, result, annotation_fp)
         return count
     
+    def annotation_file(self, img_pointer):
+        """Returns the file an annotation of an image is saved to
+
+        Args:
+            img_pointer (int): The index of the annotated image
+
+        Returns:
+            os.PathLike: The annotation file path, or None if annotations are not autosaved
+        """
+        if not self.settings['toggles']['autosave-image-default']:
+            return None
+        return get_annotation_path(f"annotations/devisionannotation{img_pointer}.png")
+    
+    def record_prediction(self, img_pointer, result, annotation_fp):
+        self.class_count_dicts[img_pointer] = result.count_dct.copy()
+        self.egg_count_dict[img_pointer] = result.count
+        self.session.record_prediction(img_pointer, result.count, result.count_dct, model=result.model,
+                                       annotation_path=annotation_fp, content_hash=self.content_hash(img_pointer))
+        self.set_prediction_image(img_pointer, annotation_fp)
+    
+    def restore_prediction(self, img_pointer, prediction):
+        self.class_count_dicts[img_pointer] = prediction['count_dct'].copy()
+        self.egg_count_dict[img_pointer] = prediction['count']
+    
     def open_settings(self):
         Settings(self)
     
@@ -1202,6 +1720,7 @@ class DevisionPage(Page):
             self.help_window_open = True
             
     def to_csv(self):
+        import pandas as pd
         date = datetime.datetime.now()
         files: dict = self.file_name_dict
         counts: dict = self.egg_count_dict
@@ -1223,6 +1742,15 @@ class DevisionPage(Page):
             head = './excel'
         export_dir = Path(head) / 'data-devision.csv'
         df.to_csv(export_dir, index=False)
+        
+        export_format = get_columnar_format()
+        if export_format is not None:
+            columnar_path = export_dir.with_suffix(FORMAT_SUFFIXES[export_format])
+            try:
+                # File names restored from a session are paths
+                write_table(df.assign(Filename=df['Filename'].astype(str)), columnar_path, 'devision-data')
+            except Exception as e:
+                print(f"Error saving {export_format} file: {str(e)}")
                     
                 
 if __name__ == '__main__':
@@ -0,0 +1,448 @@
+# Motivation for this file:
+# Predicting a whole tray one image at a time leaves the CPU idle while TensorFlow runs and leaves TensorFlow
+# idle while images are decoded, normalized, annotated and saved. This file overlaps those steps with a staged
+# pipeline: a pool of decoder threads feeds a single inference thread, which feeds a pool of annotation threads.
+# The stages are connected with bounded queues so only a handful of full resolution images are in memory at once.
+# For CPU-only stations there is also a process pool mode, where every worker process owns its own model, and for
+# images that arrive one at a time, like camera captures, a single background worker
+
+import os
+import queue
+import atexit
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from PIL import Image
+
+# Default thread counts for the CPU bound stages, inference always runs on a single thread
+DECODE_WORKERS = max(1, min(2, (os.cpu_count() or 1) - 1))
+ANNOTATE_WORKERS = max(1, min(2, (os.cpu_count() or 1) - 1))
+
+# Maximum number of images waiting between two stages
+QUEUE_SIZE = 4
+
+# Worker processes used by ProcessPredictionPool when the worker count is not given
+PROCESS_WORKERS = max(1, (os.cpu_count() or 1) // 2)
+
+# Stage names, in pipeline order, used as the keys of progress reports
+STAGES = ('decode', 'infer', 'annotate')
+
+# Queue marker telling the next stage that the previous stage has finished
+_DONE = object()
+
+class PredictionPipeline:
+    def __init__(self, predictor, annotate=True, save=None, progress=None,
+                 decode_workers=DECODE_WORKERS, annotate_workers=ANNOTATE_WORKERS, queue_size=QUEUE_SIZE):
+        """Staged batch predictor that overlaps image decoding, inference and annotation
+
+        Args:
+            predictor (model.Predictor): The predictor every image is run through
+            annotate (bool, optional): Whether annotated images are created. Defaults to True.
+            save (Callable, optional): Called as save(key, prediction) on an annotation thread once an image is finished,
+                                       used to encode and write annotations off the inference thread. Defaults to None.
+            progress (Callable, optional): Called as progress(counts, total) on the calling thread whenever a stage advances,
+                                           counts maps each name in STAGES to the number of images it has finished. Defaults to None.
+            decode_workers (int, optional): Number of decoder threads. Defaults to DECODE_WORKERS.
+            annotate_workers (int, optional): Number of annotation threads. Defaults to ANNOTATE_WORKERS.
+            queue_size (int, optional): Capacity of the queues between stages. Defaults to QUEUE_SIZE.
+        """
+        self.predictor = predictor
+        self.annotate = annotate
+        self.save = save
+        self.progress = progress
+        self.decode_workers = max(1, decode_workers)
+        self.annotate_workers = max(1, annotate_workers)
+        self.queue_size = max(1, queue_size)
+
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._counts = {stage: 0 for stage in STAGES}
+
+    def run(self, jobs):
+        """Runs every job through the pipeline
+
+        Args:
+            jobs (Iterable[tuple]): (key, image) pairs, the image is a path or an already decoded PIL.Image.Image, the key
+                                    is handed back with the result
+
+        Yields:
+            tuple: (key, model.Prediction) pairs on the calling thread, in completion order, or (key, Exception) for images
+                   that could not be read or predicted, the other images carry on
+
+        Raises:
+            Exception: An exception raised by a stage outside of any one image
+        """
+        jobs = list(jobs)
+        total = len(jobs)
+        if total == 0:
+            return
+
+        self._stop.clear()
+        self._counts = {stage: 0 for stage in STAGES}
+
+        job_queue = queue.Queue()
+        infer_queue = queue.Queue(maxsize=self.queue_size)
+        annotate_queue = queue.Queue(maxsize=self.queue_size)
+        out_queue = queue.Queue()
+
+        for job in jobs:
+            job_queue.put(job)
+        for _ in range(self.decode_workers):
+            job_queue.put(_DONE)
+
+        decoders_left = [self.decode_workers]
+
+        def decode():
+            try:
+                while not self._stop.is_set():
+                    job = job_queue.get()
+                    if job is _DONE:
+                        break
+                    key, img = job
+                    try:
+                        if not isinstance(img, Image.Image):
+                            with Image.open(img) as img:
+                                img.load()
+                        arr = self.predictor.prepare(img)
+                    except Exception as e:
+                        self._skip('decode', out_queue, key, e)
+                        continue
+                    self._advance('decode')
+                    self._put(infer_queue, (key, img, arr))
+            except Exception as e:
+                self._fail(out_queue, e)
+            finally:
+                # The last decoder to finish closes the inference stage
+                with self._lock:
+                    decoders_left[0] -= 1
+                    last = decoders_left[0] == 0
+                if last:
+                    self._put(infer_queue, _DONE)
+
+        def infer():
+            try:
+                while not self._stop.is_set():
+                    item = self._get(infer_queue)
+                    if item is _DONE or item is None:
+                        break
+                    key, img, arr = item
+                    try:
+                        lbls, details = self.predictor.infer(arr)
+                    except Exception as e:
+                        self._skip('infer', out_queue, key, e)
+                        continue
+                    del arr
+                    self._advance('infer')
+                    self._put(annotate_queue, (key, img, lbls, details))
+            except Exception as e:
+                self._fail(out_queue, e)
+            finally:
+                for _ in range(self.annotate_workers):
+                    self._put(annotate_queue, _DONE)
+
+        def annotate():
+            try:
+                while not self._stop.is_set():
+                    item = self._get(annotate_queue)
+                    if item is _DONE or item is None:
+                        break
+                    key, img, lbls, details = item
+                    try:
+                        result = self.predictor.finish(img, lbls, details, self.annotate)
+                        if self.save is not None:
+                            self.save(key, result)
+                    except Exception as e:
+                        self._skip('annotate', out_queue, key, e)
+                        continue
+                    self._advance('annotate')
+                    out_queue.put((key, result))
+            except Exception as e:
+                self._fail(out_queue, e)
+            finally:
+                out_queue.put(_DONE)
+
+        threads = [threading.Thread(target=decode, daemon=True) for _ in range(self.decode_workers)]
+        threads.append(threading.Thread(target=infer, daemon=True))
+        threads += [threading.Thread(target=annotate, daemon=True) for _ in range(self.annotate_workers)]
+        for thread in threads:
+            thread.start()
+
+        annotators_left = self.annotate_workers
+        reported = None
+        try:
+            while annotators_left > 0:
+                try:
+                    item = out_queue.get(timeout=0.1)
+                except queue.Empty:
+                    item = None
+
+                # Report progress from the calling thread whenever any stage has moved
+                if self.progress is not None:
+                    with self._lock:
+                        counts = dict(self._counts)
+                    if counts != reported:
+                        reported = counts
+                        self.progress(counts, total)
+
+                if item is None:
+                    continue
+                if item is _DONE:
+                    annotators_left -= 1
+                elif isinstance(item, BaseException):
+                    raise item
+                else:
+                    yield item
+        finally:
+            # Unblocks every stage when the caller stops early or a stage failed
+            self._stop.set()
+
+    def cancel(self):
+        """Stops the pipeline, images already inside a stage are dropped
+        """
+        self._stop.set()
+
+    def _advance(self, stage):
+        with self._lock:
+            self._counts[stage] += 1
+
+    def _skip(self, stage, out_queue, key, exception):
+        # One image failed, it counts as done for its stage and every later stage, the caller reports it
+        with self._lock:
+            for name in STAGES[STAGES.index(stage):]:
+                self._counts[name] += 1
+        out_queue.put((key, exception))
+
+    def _fail(self, out_queue, exception):
+        self._stop.set()
+        out_queue.put(exception)
+
+    def _put(self, q, item):
+        # Bounded put that gives up once the pipeline is stopped so no stage blocks forever
+        while True:
+            try:
+                q.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                if self._stop.is_set():
+                    return
+
+    def _get(self, q):
+        # Blocking get that returns None once the pipeline is stopped
+        while True:
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                if self._stop.is_set():
+                    return None
+
+
+class PredictionWorker:
+    def __init__(self, model_dir, annotate=True, save=None):
+        """Background predictor for images that arrive one at a time, such as camera captures. Images are predicted
+        in arrival order on a single thread while the caller keeps running, and finished results are collected with results().
+        The predictor is built on the worker thread, so a model that is not cached yet never loads on the caller's thread
+
+        Args:
+            model_dir (os.PathLike): The directory containing the .config file for the stardist model
+            annotate (bool, optional): Whether annotated images are created. Defaults to True.
+            save (Callable, optional): Called as save(key, prediction) on the worker thread once an image is finished. Defaults to None.
+        """
+        self.model_dir = model_dir
+        self.annotate = annotate
+        self.save = save
+        
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._discarded = False
+        self._jobs = queue.Queue()
+        self._results = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name='PredictionWorker', daemon=True)
+        self._thread.start()
+    
+    @property
+    def pending(self):
+        """Number of submitted images whose result has not been collected yet
+        """
+        with self._lock:
+            return self._pending
+    
+    def submit(self, key, image):
+        """Queues an image
+
+        Args:
+            key (Hashable): Handed back with the result
+            image (PIL.Image.Image): The decoded image
+        """
+        with self._lock:
+            self._pending += 1
+        self._jobs.put((key, image))
+    
+    def results(self):
+        """Collects every finished result without blocking
+
+        Returns:
+            list[tuple]: (key, model.Prediction) pairs, or (key, Exception) for images that failed
+        """
+        finished = []
+        while True:
+            try:
+                finished.append(self._results.get_nowait())
+            except queue.Empty:
+                break
+        with self._lock:
+            self._pending -= len(finished)
+        return finished
+    
+    def close(self, discard=False):
+        """Stops the worker once the images already queued are finished
+
+        Args:
+            discard (bool, optional): Drop the queued images instead, the image being predicted is neither saved
+                                      nor reported. Defaults to False.
+        """
+        if discard:
+            with self._lock:
+                self._discarded = True
+        self._jobs.put(_DONE)
+    
+    def _run(self):
+        from model import Predictor
+        
+        predictor = None
+        while True:
+            job = self._jobs.get()
+            if job is _DONE:
+                return
+            with self._lock:
+                if self._discarded:
+                    return
+            key, image = job
+            try:
+                if predictor is None:
+                    predictor = Predictor(self.model_dir)
+                result = predictor.predict(image, self.annotate)
+                with self._lock:
+                    if self._discarded:
+                        return
+                if self.save is not None:
+                    self.save(key, result)
+                self._results.put((key, result))
+            except Exception as e:
+                self._results.put((key, e))
+
+
+# The predictor owned by a ProcessPredictionPool worker process, created once by _init_worker
+_worker_predictor = None
+
+def _init_worker(model_dir, threads, cache_mb, cache_dir):
+    global _worker_predictor
+    # Split the cores between workers, TensorFlow reads these before it is first imported
+    os.environ['TF_NUM_INTRAOP_THREADS'] = str(threads)
+    os.environ['TF_NUM_INTEROP_THREADS'] = '1'
+    os.environ['OMP_NUM_THREADS'] = str(threads)
+    
+    from model import Predictor, configure_prediction_cache
+    # A spawned process starts with the default cache, it uses the parent's instead
+    configure_prediction_cache(cache_mb, cache_dir)
+    _worker_predictor = Predictor(model_dir)
+
+def _predict_in_worker(path, annotate, annotation_fp):
+    from model import Prediction
+    
+    with Image.open(path) as img:
+        img.load()
+    result = _worker_predictor.predict(img, annotate)
+    
+    if result.annotation is not None and annotation_fp is not None:
+        try:
+            os.makedirs(os.path.dirname(annotation_fp), exist_ok=True)
+            result.annotation.save(fp=annotation_fp)
+        except Exception as e:
+            print(f"Warning: Could not save annotation: {str(e)}")
+    
+    # Only the small values cross back to the parent, the label image is dropped and the annotation stays on disk
+    return Prediction(result.count, result.count_dct, result.class_dct, labels=None, details=None, model=result.model)
+
+class ProcessPredictionPool:
+    # Pools that have not been closed yet, see close_process_pools
+    _instances = set()
+    
+    def __init__(self, model_dir, workers=PROCESS_WORKERS, cache_mb=None, cache_dir=None):
+        """Batch predictor that spreads images across worker processes, each holding its own cached StarDist2D.
+        Meant for CPU-only stations, where one TensorFlow process cannot keep every core busy through
+        non-maximum suppression and label rendering
+
+        Args:
+            model_dir (os.PathLike): The directory containing the .config file for the stardist model
+            workers (int, optional): Number of worker processes. Defaults to PROCESS_WORKERS.
+            cache_mb (float, optional): Prediction cache budget of the workers, 0 turns their cache off. Defaults to the
+                                        budget of this process's prediction cache.
+            cache_dir (os.PathLike, optional): Prediction cache folder of the workers. Defaults to the folder of this
+                                               process's prediction cache.
+        """
+        from model import prediction_cache_settings
+        
+        self.model_dir = str(model_dir)
+        self.workers = max(1, int(workers))
+        default_mb, default_dir = prediction_cache_settings()
+        self.cache_mb = default_mb if cache_mb is None else cache_mb
+        self.cache_dir = default_dir if cache_dir is None else str(cache_dir)
+        
+        threads = max(1, (os.cpu_count() or 1) // self.workers)
+        # Workers are spawned, forking a process that has already started TensorFlow is unsafe
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_init_worker,
+            initargs=(self.model_dir, threads, self.cache_mb, self.cache_dir)
+        )
+        ProcessPredictionPool._instances.add(self)
+    
+    def run(self, jobs, annotate=True, progress=None):
+        """Runs every job on the worker processes
+
+        Args:
+            jobs (Iterable[tuple]): (key, image path, annotation path) triples, the annotation path may be None
+            annotate (bool, optional): Whether annotated images are created and saved. Defaults to True.
+            progress (Callable, optional): Called as progress(counts, total) on the calling thread after every image,
+                                           with the same counts layout as PredictionPipeline. Defaults to None.
+
+        Yields:
+            tuple: (key, model.Prediction) pairs in completion order, without the label image, or (key, Exception) for
+                   images that could not be read or predicted, the other images carry on
+        """
+        jobs = list(jobs)
+        total = len(jobs)
+        futures = {
+            self._executor.submit(_predict_in_worker, path, annotate, annotation_fp): key
+            for key, path, annotation_fp in jobs
+        }
+        
+        done = 0
+        try:
+            for future in as_completed(futures):
+                try:
+                    result = future.result()
+                except Exception as e:
+                    result = e
+                done += 1
+                if progress is not None:
+                    progress({stage: done for stage in STAGES}, total)
+                yield futures[future], result
+        finally:
+            for future in futures:
+                future.cancel()
+    
+    def close(self):
+        """Shuts down the worker processes
+        """
+        ProcessPredictionPool._instances.discard(self)
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+@atexit.register
+def close_process_pools():
+    """Shuts down every pool that is still open. Also runs at exit, but the desktop app calls it as soon as its window
+    closes, before the interpreter waits on the worker processes
+    """
+    for pool in list(ProcessPredictionPool._instances):
+        pool.close()
@@ -1,11 +1,25 @@
-from bs4 import BeautifulSoup
-import requests
+# requests and BeautifulSoup are imported where they are used, they are slow to import and only needed for a check
+import json
+import os
+import socket
+import threading
+import time
 import webbrowser
+from concurrent.futures import Future
+from urllib.parse import urlsplit
+from image_processing import get_data_path
 
 GITHUB_TAGS = "https://github.com/LSU-Devision/GUI/tags"
 GITHUB_USER_GUIDE = "https://github.com/LSU-Devision/GUI/blob/main/Devision%20GUI%20user%20guide.pdf"
 CURRENT_VERSION = 1.4
 
+# Seconds allowed for connecting to the host and for the tags page request
+CONNECT_TIMEOUT = 1.5
+REQUEST_TIMEOUT = 5.0
+# Seconds a cached result is reused, an offline or failed check is retried sooner than a successful one
+UPDATE_CACHE_TTL = 24 * 60 * 60
+OFFLINE_CACHE_TTL = 5 * 60
+
 
 class Scraper:
     """
@@ -38,17 +52,9 @@ class Scraper:
         :return: true or false depending on if the internet is available
         """
         # initialize the url, page, and soup
-        self.url = "https://www.google.com"
-        # try to request the url
-        try:
-            # request the url
-            self.page = requests.get(self.url)
-        # if the request fails
-        except requests.exceptions.ConnectionError:
-            # return false
-            return False
-        # return true
-        return True
+        self.url = GITHUB_TAGS
+        # a connection attempt with a short timeout, so an offline network fails fast instead of hanging
+        return can_connect(self.url)
 
 
     def check_version(self):
@@ -57,32 +63,17 @@ class Scraper:
         description: method to check if a new version is available
         :return: true or false depending on if a new version is available
         """
-        # create a boolean flag to return, default false for no update required
-        need_update_flag = False
+        import requests
+        from bs4 import BeautifulSoup
+
         # set the url to the tags page
         self.url = GITHUB_TAGS
         # request the tags page
-        self.page = requests.get(self.url)
+        self.page = requests.get(self.url, timeout=(CONNECT_TIMEOUT, REQUEST_TIMEOUT))
         # parse the tags page
         self.soup = BeautifulSoup(self.page.content, 'html.parser')
-        # find all the d4 classes
-        d4_classes = self.soup.find_all(class_="f4 d-inline")
-        # loop through the d4 classes
-        for instance in d4_classes:
-            # split the text of each d4 class by the / to get the versions
-            version_list = instance.text.split("/")
-            # loop through the version list
-            for versions in version_list:
-                # strip the 'v' from the versions
-                versions = versions.strip('v')
-                # check if the version is greater than the current version
-                if CURRENT_VERSION < float(versions):
-                    # set the flag to true
-                    need_update_flag = True
-                    # return the flag as True
-                    return need_update_flag
-        # return the flag as false
-        return need_update_flag
+        # true if any tag is newer than the current version
+        return any(CURRENT_VERSION < version for version in parse_versions(self.soup))
 
     def get_update_page(self):
         return GITHUB_TAGS
@@ -99,4 +90,175 @@ class Scraper:
         :return: void
         """
         webbrowser.open(GITHUB_USER_GUIDE)
-        
\ No newline at end of file
+        
+
+def can_connect(url, timeout=CONNECT_TIMEOUT):
+    """
+    function: can_connect
+    description: opens and closes a TCP connection to the host of a url, a cheap online check that fails within the timeout
+    :param url: the url whose host and port are tried
+    :param timeout: seconds allowed for the name lookup and the connection
+    :return: true or false depending on if the host could be reached
+    """
+    parts = urlsplit(url)
+    port = parts.port or (443 if parts.scheme == 'https' else 80)
+    try:
+        with socket.create_connection((parts.hostname, port), timeout=timeout):
+            return True
+    except OSError:
+        return False
+
+
+def parse_versions(soup):
+    """
+    function: parse_versions
+    description: reads the version numbers from the tag names of a GitHub tags page
+    :param soup: the parsed tags page
+    :return: list of the versions as floats, tags that are not numbers are skipped
+    """
+    versions = []
+    # the tag names are in the f4 d-inline classes, one or more versions separated by /
+    for instance in soup.find_all(class_="f4 d-inline"):
+        for version in instance.text.split("/"):
+            try:
+                versions.append(float(version.strip().strip('v')))
+            except ValueError:
+                continue
+    return versions
+
+
+class UpdateChecker:
+    """
+    class: UpdateChecker
+    description: checks for a new version on a background thread, caching the result on disk so the check
+                 neither blocks the interface nor touches the network more than once per TTL
+    params:
+        tags_url: the tags page to read the versions from, replaceable by a local server in tests
+        cache_path: the json file the last result is stored in, defaults to data/update_check.json in the data folder
+        current_version: the running version
+        ttl: seconds a successful result is reused
+        offline_ttl: seconds an offline result is reused before the network is tried again
+    methods:
+        check(self, force=False)
+        check_async(self, force=False)
+        cached(self)
+    """
+
+    def __init__(self, tags_url=GITHUB_TAGS, cache_path=None, current_version=CURRENT_VERSION,
+                 ttl=UPDATE_CACHE_TTL, offline_ttl=OFFLINE_CACHE_TTL):
+        self.tags_url = tags_url
+        # resolved once, so the cache does not move with the working directory
+        self.cache_path = str(get_data_path('data/update_check.json') if cache_path is None else cache_path)
+        self.current_version = current_version
+        self.ttl = ttl
+        self.offline_ttl = offline_ttl
+
+        self._lock = threading.Lock()
+        # the check in progress, shared by every caller until it finishes
+        self._future = None
+
+    def cached(self):
+        """
+        method: cached
+        description: reads the stored result if it is still fresh for this url and version
+        :return: the result dictionary, or None if there is no fresh result
+        """
+        try:
+            with open(self.cache_path, 'r') as file:
+                result = json.load(file)
+        except (OSError, ValueError):
+            return None
+        if result.get('url') != self.tags_url or result.get('current') != self.current_version:
+            return None
+        # offline results and failed requests are retried sooner
+        ttl = self.ttl if result.get('online') and not result.get('error') else self.offline_ttl
+        if not 0 <= time.time() - result.get('checked', 0) < ttl:
+            return None
+        return result
+
+    def check(self, force=False):
+        """
+        method: check
+        description: checks for a new version, blocking, use check_async from the interface
+        :param force: ignore a cached result
+        :return: dictionary with 'online', 'update' (true if a newer version exists), 'latest' (the newest version
+                 found or None), 'error' (a message or None) and 'checked' (time of the check)
+        """
+        if not force:
+            result = self.cached()
+            if result is not None:
+                return result
+
+        result = {'url': self.tags_url, 'current': self.current_version, 'checked': time.time(),
+                  'online': False, 'update': False, 'latest': None, 'error': None}
+        # offline fast path, a failed connection skips the request entirely
+        if not can_connect(self.tags_url):
+            result['error'] = 'No internet connection'
+        else:
+            result['online'] = True
+            try:
+                result.update(self._read_tags())
+            except Exception as e:
+                result['online'] = not _is_connection_error(e)
+                result['error'] = str(e)
+
+        self._store(result)
+        return result
+
+    def check_async(self, force=False):
+        """
+        method: check_async
+        description: starts a check on a daemon thread, a check already in progress is shared
+        :param force: ignore a cached result
+        :return: a concurrent.futures.Future of the result dictionary of check
+        """
+        with self._lock:
+            if self._future is not None and not self._future.done():
+                return self._future
+            future = self._future = Future()
+
+        # a fresh cached result is returned without starting a thread
+        result = None if force else self.cached()
+        if result is not None:
+            future.set_result(result)
+            return future
+
+        def run():
+            try:
+                future.set_result(self.check(force=True))
+            except Exception as e:
+                future.set_exception(e)
+
+        threading.Thread(target=run, name='UpdateChecker', daemon=True).start()
+        return future
+
+    def _read_tags(self):
+        import requests
+        from bs4 import BeautifulSoup
+
+        page = requests.get(self.tags_url, timeout=(CONNECT_TIMEOUT, REQUEST_TIMEOUT))
+        page.raise_for_status()
+        versions = parse_versions(BeautifulSoup(page.content, 'html.parser'))
+        latest = max(versions) if versions else None
+        return {'latest': latest, 'update': latest is not None and self.current_version < latest}
+
+    def _store(self, result):
+        # written to a temporary file and renamed, so a second window never reads half a result
+        try:
+            directory = os.path.dirname(self.cache_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            temp_path = f'{self.cache_path}.tmp'
+            with open(temp_path, 'w') as file:
+                json.dump(result, file)
+            os.replace(temp_path, self.cache_path)
+        except OSError as e:
+            print(f"Warning: Could not cache the update check: {str(e)}")
+
+
+def _is_connection_error(error):
+    try:
+        import requests
+    except ImportError:
+        return False
+    return isinstance(error, (requests.exceptions.ConnectionError, requests.exceptions.Timeout))
@@ -0,0 +1,310 @@
+# Motivation for this file:
+# A session used to be spread across the ImageList JSON files, the per-image dictionaries held by each page and
+# the exported CSVs, and only the image paths survived a restart. This file keeps the whole session in one embedded
+# SQLite database: the images of every page, the form inputs saved for each image, predictions and per-class counts.
+# Every change is a small transaction on indexed tables, so a season of several thousand images can be reopened,
+# filtered and exported without rewriting or rebuilding everything. Predictions are also checkpointed by image
+# content and model, so a batch interrupted by a crash or restarted on the same folder skips every image it has
+# already counted, whatever its position in the image list
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+# Stored as the database user_version, bump it together with a migration in SessionStore._migrate
+SCHEMA_VERSION = 2
+
+# Bytes read at a time when hashing an image file
+HASH_CHUNK_SIZE = 1 << 20
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS images (
+    page TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    path TEXT,
+    prediction_path TEXT,
+    file_name TEXT,
+    added REAL,
+    PRIMARY KEY (page, position)
+);
+CREATE INDEX IF NOT EXISTS images_path ON images (page, path);
+
+CREATE TABLE IF NOT EXISTS inputs (
+    page TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    frame TEXT NOT NULL,
+    widget INTEGER NOT NULL,
+    value TEXT,
+    PRIMARY KEY (page, position, frame, widget)
+);
+
+CREATE TABLE IF NOT EXISTS predictions (
+    page TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    model TEXT,
+    count INTEGER NOT NULL,
+    annotation_path TEXT,
+    predicted REAL,
+    PRIMARY KEY (page, position)
+);
+CREATE INDEX IF NOT EXISTS predictions_model ON predictions (page, model);
+
+CREATE TABLE IF NOT EXISTS class_counts (
+    page TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    class_id INTEGER NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (page, position, class_id)
+);
+
+CREATE TABLE IF NOT EXISTS content_hashes (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    hash TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS checkpoints (
+    content_hash TEXT NOT NULL,
+    model TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    count_dct TEXT NOT NULL,
+    annotation_path TEXT,
+    annotation_stamp TEXT,
+    predicted REAL,
+    PRIMARY KEY (content_hash, model)
+);
+'''
+
+# Names of the saved widget frames, matching Page.top_frame_saves and Page.output_frame_saves
+FRAMES = ('top', 'output')
+
+class SessionStore:
+    def __init__(self, db_path, page):
+        """The session of one page, stored in a SQLite database that can be shared by every page
+
+        Args:
+            db_path (os.PathLike): The database file, created if it does not exist
+            page (str): The name of the page, every row is scoped to it
+        """
+        self.db_path = Path(db_path)
+        self.page = page
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+
+        # Predictions may be recorded from worker threads, every statement is serialized through the lock
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(str(self.db_path), check_same_thread=False)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('PRAGMA synchronous=NORMAL')
+        self._migrate()
+
+    def _migrate(self):
+        with self._lock, self._connection:
+            version = self._connection.execute('PRAGMA user_version').fetchone()[0]
+            if version > SCHEMA_VERSION:
+                raise RuntimeError(f'{self.db_path} was written by a newer version (schema {version})')
+            self._connection.executescript(SCHEMA)
+            self._connection.execute(f'PRAGMA user_version={SCHEMA_VERSION}')
+
+    def is_empty(self):
+        """Returns whether the page has no images stored
+        """
+        with self._lock:
+            row = self._connection.execute('SELECT 1 FROM images WHERE page=? LIMIT 1', (self.page,)).fetchone()
+        return row is None
+
+    def load(self):
+        """Reads the whole session of the page
+
+        Returns:
+            dict: 'images' and 'prediction_images' path lists, 'inputs' mapping each position to its saved top and output
+                  frame values as (widget id, value) tuples, and 'predictions' mapping each position to a dict of
+                  'count', 'count_dct', 'model' and 'annotation_path'
+        """
+        with self._lock:
+            images = self._connection.execute(
+                'SELECT position, path, prediction_path FROM images WHERE page=? ORDER BY position', (self.page,)
+            ).fetchall()
+            inputs = self._connection.execute(
+                'SELECT position, frame, widget, value FROM inputs WHERE page=? ORDER BY position, frame, widget', (self.page,)
+            ).fetchall()
+            predictions = self._connection.execute(
+                'SELECT position, model, count, annotation_path FROM predictions WHERE page=?', (self.page,)
+            ).fetchall()
+            class_counts = self._connection.execute(
+                'SELECT position, class_id, count FROM class_counts WHERE page=?', (self.page,)
+            ).fetchall()
+
+        state = {
+            'images': [path for _, path, _ in images],
+            'prediction_images': [prediction_path for _, _, prediction_path in images],
+            'inputs': {},
+            'predictions': {}
+        }
+        for position, frame, widget, value in inputs:
+            saves = state['inputs'].setdefault(position, {frame: () for frame in FRAMES})
+            saves[frame] += ((widget, json.loads(value)),)
+        for position, model, count, annotation_path in predictions:
+            state['predictions'][position] = {'count': count, 'count_dct': {}, 'model': model, 'annotation_path': annotation_path}
+        for position, class_id, count in class_counts:
+            if position in state['predictions']:
+                state['predictions'][position]['count_dct'][class_id] = count
+        return state
+
+    def put_images(self, position, paths, prediction_paths=None):
+        """Stores images starting at a position, replacing any image already stored there
+
+        Args:
+            position (int): The position of the first image
+            paths (list[os.PathLike]): The image files
+            prediction_paths (list[os.PathLike], optional): The annotated image of each file, None entries for none. Defaults to None.
+        """
+        if prediction_paths is None:
+            prediction_paths = [None] * len(paths)
+        now = time.time()
+        rows = [
+            (self.page, position + offset, _str(path), _str(prediction_path), Path(path).name if path is not None else None, now)
+            for offset, (path, prediction_path) in enumerate(zip(paths, prediction_paths))
+        ]
+        with self._lock, self._connection:
+            self._connection.executemany('INSERT OR REPLACE INTO images VALUES (?, ?, ?, ?, ?, ?)', rows)
+
+    def set_prediction_image(self, position, path):
+        """Stores the annotated image of an image
+        """
+        with self._lock, self._connection:
+            self._connection.execute(
+                'UPDATE images SET prediction_path=? WHERE page=? AND position=?', (_str(path), self.page, position)
+            )
+
+    def save_inputs(self, position, top, output):
+        """Stores the saved widget values of an image, replacing the previous ones
+
+        Args:
+            position (int): The position of the image
+            top (tuple): (widget id, value) pairs of the top frame
+            output (tuple): (widget id, value) pairs of the output frame
+        """
+        rows = [
+            (self.page, position, frame, widget, json.dumps(value, default=str))
+            for frame, saves in zip(FRAMES, (top, output)) for widget, value in saves
+        ]
+        with self._lock, self._connection:
+            self._connection.execute('DELETE FROM inputs WHERE page=? AND position=?', (self.page, position))
+            self._connection.executemany('INSERT INTO inputs VALUES (?, ?, ?, ?, ?)', rows)
+
+    def record_prediction(self, position, count, count_dct=None, model=None, annotation_path=None, content_hash=None):
+        """Stores the prediction of an image, replacing the previous one
+
+        Args:
+            position (int): The position of the image
+            count (int): The total count
+            count_dct (dict, optional): Count of each class id. Defaults to None.
+            model (str, optional): The model the image was predicted with. Defaults to None.
+            annotation_path (os.PathLike, optional): The saved annotated image. Defaults to None.
+            content_hash (str, optional): The content hash of the image, the prediction is also checkpointed under it
+                                          and the model when both are given. Defaults to None.
+        """
+        if content_hash is not None and model is not None:
+            checkpoint = (content_hash, model, int(count), json.dumps({str(k): int(v) for k, v in (count_dct or {}).items()}),
+                          _str(annotation_path), _stamp(annotation_path), time.time())
+        else:
+            checkpoint = None
+        with self._lock, self._connection:
+            if checkpoint is not None:
+                self._connection.execute('INSERT OR REPLACE INTO checkpoints VALUES (?, ?, ?, ?, ?, ?, ?)', checkpoint)
+            self._connection.execute(
+                'INSERT OR REPLACE INTO predictions VALUES (?, ?, ?, ?, ?, ?)',
+                (self.page, position, model, int(count), _str(annotation_path), time.time())
+            )
+            self._connection.execute('DELETE FROM class_counts WHERE page=? AND position=?', (self.page, position))
+            self._connection.executemany(
+                'INSERT INTO class_counts VALUES (?, ?, ?, ?)',
+                [(self.page, position, int(class_id), int(class_count)) for class_id, class_count in (count_dct or {}).items()]
+            )
+
+    def content_hash(self, path):
+        """Returns the SHA-256 of an image file. Hashes are remembered by path, size and modification time, so an
+        unchanged file is only read once
+
+        Args:
+            path (os.PathLike): The image file
+
+        Returns:
+            str: The hex digest
+
+        Raises:
+            OSError: If the file cannot be read
+        """
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        with self._lock:
+            row = self._connection.execute(
+                'SELECT hash FROM content_hashes WHERE path=? AND size=? AND mtime_ns=?', (path, stat.st_size, stat.st_mtime_ns)
+            ).fetchone()
+        if row is not None:
+            return row[0]
+
+        digest = hashlib.sha256()
+        with open(path, 'rb') as file:
+            for chunk in iter(lambda: file.read(HASH_CHUNK_SIZE), b''):
+                digest.update(chunk)
+        content_hash = digest.hexdigest()
+        with self._lock, self._connection:
+            self._connection.execute(
+                'INSERT OR REPLACE INTO content_hashes VALUES (?, ?, ?, ?)', (path, stat.st_size, stat.st_mtime_ns, content_hash)
+            )
+        return content_hash
+
+    def find_checkpoint(self, content_hash, model):
+        """Returns the checkpointed prediction of an image content with a model
+
+        Args:
+            content_hash (str): The content hash of the image
+            model (str): The model fingerprint
+
+        Returns:
+            dict: 'count', 'count_dct' and 'annotation_path', the annotation path is None unless the annotated image is
+                  still the file written with this prediction. None if the image was never predicted with the model
+        """
+        with self._lock:
+            row = self._connection.execute(
+                'SELECT count, count_dct, annotation_path, annotation_stamp FROM checkpoints WHERE content_hash=? AND model=?',
+                (content_hash, model)
+            ).fetchone()
+        if row is None:
+            return None
+        count, count_dct, annotation_path, annotation_stamp = row
+        # Annotation files are named by position and may since have been overwritten by another image
+        if annotation_path is not None and (annotation_stamp is None or _stamp(annotation_path) != annotation_stamp):
+            annotation_path = None
+        return {'count': count, 'count_dct': {int(k): v for k, v in json.loads(count_dct).items()}, 'annotation_path': annotation_path}
+
+    def clear(self):
+        """Removes every image, input and prediction of the page. Checkpoints are kept, they belong to image contents
+        rather than to the page
+        """
+        with self._lock, self._connection:
+            for table in ('images', 'inputs', 'predictions', 'class_counts'):
+                self._connection.execute(f'DELETE FROM {table} WHERE page=?', (self.page,))
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+def _str(path):
+    return None if path is None else str(path)
+
+def _stamp(path):
+    # Identifies one version of a file, None if there is no file
+    if path is None:
+        return None
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return f'{stat.st_size}:{stat.st_mtime_ns}'
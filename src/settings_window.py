@@ -5,7 +5,7 @@ from ttkbootstrap import Style
 from warning_window import WarningWindow
 
 import webbrowser
-from scrapers import Scraper
+from scrapers import UpdateChecker
 import json
 import pathlib
 from os import path
@@ -13,6 +13,9 @@ import shutil
 
 from functools import partial
 
+# How often the settings window checks whether an update check has finished
+UPDATE_POLL_MS = 100
+
 # Window wrapper for settings, ensures that the window is not open when setting are initialized
 class Settings(tk.Toplevel):
     instance = None
@@ -136,7 +139,11 @@ class SettingsWindow(ttk.Frame):
                                 "annotate-default": true
                             },
 
-                            "theme":"darkly-style"
+                            "theme":"darkly-style",
+                            "prediction-workers": 0,
+                            "image-cache-mb": 512,
+                            "prediction-cache-mb": 1024,
+                            "export-format": "csv"
                         }"""
             try:
                 with open(cls.DEFAULT_SETTINGS, 'w') as file:
@@ -170,7 +177,11 @@ class SettingsWindow(ttk.Frame):
                         "autosave-image-default": True,
                         "annotate-default": True
                     },
-                    "theme": "darkly-style"
+                    "theme": "darkly-style",
+                    "prediction-workers": 0,
+                    "image-cache-mb": 512,
+                    "prediction-cache-mb": 1024,
+                    "export-format": "csv"
                 }
         
         # Create USER_THEMES file if it doesn't exist
@@ -200,6 +211,18 @@ class SettingsWindow(ttk.Frame):
                     cls._settings['csv_path'] = ''
                 if 'annotation_path' not in cls._settings:
                     cls._settings['annotation_path'] = ''
+                # 0 predicts batches in this process, 2 or more uses that many worker processes
+                if 'prediction-workers' not in cls._settings:
+                    cls._settings['prediction-workers'] = 0
+                # Memory budget of decoded full resolution images, in MB
+                if 'image-cache-mb' not in cls._settings:
+                    cls._settings['image-cache-mb'] = 512
+                # Disk budget of cached network outputs, in MB, 0 turns the cache off
+                if 'prediction-cache-mb' not in cls._settings:
+                    cls._settings['prediction-cache-mb'] = 1024
+                # 'parquet' or 'arrow' also writes full exports as typed columnar files, which needs pyarrow
+                if 'export-format' not in cls._settings:
+                    cls._settings['export-format'] = 'csv'
                 json.dump(cls._settings, file, indent=2)
         except Exception as e:
             print(f"Error writing user settings: {e}")
@@ -366,26 +389,55 @@ class SettingsWindow(ttk.Frame):
         # TODO: Update to github api download methods for security
         # This will require a github api key of some kind
         
-        # These are the old SettingsWindow version updater functions
-        def update_select(event):
-        # create the scraper class
-            scraper_class = Scraper()
-            # check if there is an internet connection
-            if scraper_class.check_internet() is False:
+        # The check runs on a background thread and its result is cached on disk, so an offline network
+        # never blocks the window. The Tk thread polls the result with after()
+        self._update_checker = UpdateChecker()
+
+        def show_status(result):
+            if result is None:
+                status = 'command'
+            elif not result['online']:
+                status = 'offline'
+            elif result['error']:
+                status = 'check failed'
+            else:
+                status = 'update available' if result['update'] else 'up to date'
+            self._settings_tree.set('update-version', column='status', value=status)
+
+        def show_result(future):
+            try:
+                if not self._settings_tree.winfo_exists():
+                    return
+            except tk.TclError:
+                return
+            if not future.done():
+                self.after(UPDATE_POLL_MS, show_result, future)
+                return
+
+            result = future.result()
+            show_status(result)
+            if not result['online']:
                 # if there is no internet connection, show an error
                 tk.messagebox.showerror("Error", "No Internet Connection")
-                return
+            elif result['error']:
+                tk.messagebox.showerror("Error", f"Could not check for updates: {result['error']}")
             # check if there is a new version
-            if scraper_class.check_version() is True:
+            elif result['update']:
                 # if there is a new version, ask if the user wants to update
                 flag = tk.messagebox.askyesno("Update", "There is a new version available. Do you want to update?")
                 if flag is True:
                     # open the update page
-                    webbrowser.open(scraper_class.get_update_page())
+                    webbrowser.open(self._update_checker.tags_url)
             # if there is no new version show an info box
             else:
-                tk.messagebox.showinfo("Update", "You are on the latest version") 
-                           
+                tk.messagebox.showinfo("Update", "You are on the latest version")
+
+        def update_select(event):
+            future = self._update_checker.check_async()
+            if not future.done():
+                self._settings_tree.set('update-version', column='status', value='checking...')
+            show_result(future)
+
         # def guide_select(event):
         #     scraper_user_guide_class = Scraper()
         #     # check if there is an internet connection
@@ -411,6 +463,9 @@ class SettingsWindow(ttk.Frame):
         for x, id in zip(settings_text, settings_id): 
             self._settings_tree.insert('version', 'end', iid=id, text=x, values='command', tags=id)
 
+        # Show the last cached result without touching the network
+        show_status(self._update_checker.cached())
+
         # Bind respective functions into tree
         self._settings_tree.tag_configure('update-version', font="TkDefaultFont")
         #self._settings_tree.tag_configure('guide-version', font="TkDefaultFont")
@@ -2,13 +2,230 @@
 # Tkinter widget callbacks are very lowlevel (just one step up from pure implementation of asynchronous
 # programming with event loops and callbacks). This file creates some widgets with some standard IO operations,
 # such as binding one widgets output field to multiple widgets output field (chaining outputs) and creating
-# some examples of callback functions that produce a value without having to implement asnychronous pipes/queues
+# some examples of callback functions that produce a value without having to implement asnychronous pipes/queues.
+# Tk is not thread safe, so widget updates made by button commands on worker threads are queued on a dispatcher
+# and applied on the Tk thread, keeping only the latest update of each widget between two drains. Button commands
+# share one bounded pool of worker threads, a command that is still queued or running is not started twice and
+# long commands can be cancelled
 
 import tkinter.ttk as ttk
 import ttkbootstrap
 from ttkbootstrap.constants import *
 import tkinter as tk
 import threading
+import traceback
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+# How often updates queued from worker threads are applied on the Tk thread
+UI_POLL_MS = 50
+# Worker threads shared by every IOButton command, further commands wait in the queue
+COMMAND_WORKERS = 4
+# How often progress bars refresh the command executor status shown next to them
+STATUS_POLL_MS = 500
+
+class UIDispatcher():
+    def __init__(self):
+        """Runs widget updates made on worker threads on the Tk thread. Queued updates are drained by after() polling,
+        and updates sharing a key are coalesced so only the latest one runs, which bounds the redraws of a widget to
+        one per poll however often a worker updates it
+        """
+        self._lock = threading.Lock()
+        # key -> (function, args), in the order the keys were last updated
+        self._pending = OrderedDict()
+        self._root = None
+        self._job = None
+        self.coalesced = 0
+    
+    def attach(self, widget):
+        """Starts draining on the root window of a widget, called on the Tk thread whenever an IO widget is created
+
+        Args:
+            widget (tkinter.Misc): Any widget of the application
+        """
+        if self._job is not None:
+            return
+        self._root = widget.nametowidget('.')
+        self._job = self._root.after(UI_POLL_MS, self._drain)
+    
+    def on_ui_thread(self):
+        return threading.current_thread() is threading.main_thread()
+    
+    def call(self, func, *args, key=None):
+        """Runs a function on the Tk thread, immediately when already on it, otherwise on the next drain
+
+        Args:
+            func (callable): The function, usually a widget update
+            key (hashable, optional): Queued calls with the same key replace each other, only the latest runs.
+                                      None queues the call without coalescing. Defaults to None.
+        """
+        if self.on_ui_thread():
+            func(*args)
+            return
+        with self._lock:
+            if key is None:
+                key = object()
+            elif key in self._pending:
+                # Moved to the end, so it still runs after anything queued before this update
+                del self._pending[key]
+                self.coalesced += 1
+            self._pending[key] = (func, args)
+    
+    def invoke(self, func, *args, **kwargs):
+        """Runs a function on the Tk thread and waits for its result, used for dialogs and widget reads of worker threads
+
+        Returns:
+            The return value of func
+
+        Raises:
+            RuntimeError: If called off the Tk thread while the interface is not running
+        """
+        if self.on_ui_thread():
+            return func(*args, **kwargs)
+        if self._job is None:
+            raise RuntimeError('The interface is not running, cannot run on the Tk thread')
+        future = Future()
+        
+        def run():
+            try:
+                future.set_result(func(*args, **kwargs))
+            except Exception as e:
+                future.set_exception(e)
+        
+        self.call(run)
+        # Polled so a worker waiting on a closed window is released by stop()
+        while True:
+            try:
+                return future.result(timeout=UI_POLL_MS / 1000)
+            except FutureTimeoutError:
+                if self._job is None:
+                    raise RuntimeError('The interface was closed')
+    
+    def stop(self):
+        """Stops draining once the main loop has ended, queued calls are dropped and waiting workers are released
+        """
+        with self._lock:
+            self._job = None
+            self._pending.clear()
+    
+    def _drain(self):
+        with self._lock:
+            pending, self._pending = self._pending, OrderedDict()
+        for func, args in pending.values():
+            try:
+                func(*args)
+            except Exception as e:
+                print(f"Warning: Interface update failed: {str(e)}")
+        if self._job is None:
+            return
+        try:
+            self._job = self._root.after(UI_POLL_MS, self._drain)
+        except tk.TclError:
+            # The window was closed
+            self._job = None
+
+# Shared by every widget, there is only one Tk thread
+ui_bus = UIDispatcher()
+
+class CommandExecutor():
+    def __init__(self, max_workers=COMMAND_WORKERS):
+        """A bounded pool of worker threads for button commands. A command is single flight: submitting a key that is
+        still queued or running returns None instead of starting it again. Running commands are cancelled
+        cooperatively, they poll cancelled() and stop early
+
+        Args:
+            max_workers (int, optional): The number of worker threads. Defaults to COMMAND_WORKERS.
+        """
+        self._executor = ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix='IOButton')
+        self._lock = threading.Lock()
+        # key -> (future, cancel event) of every queued or running command
+        self._in_flight = {}
+        self._local = threading.local()
+        self._counts = {'queued': 0, 'running': 0, 'completed': 0, 'failed': 0, 'cancelled': 0}
+    
+    def submit(self, key, func, *args, **kwargs):
+        """Queues a command unless the same key is already queued or running
+
+        Args:
+            key (hashable): Identifies the command for single flight and cancellation
+            func (callable): The command
+
+        Returns:
+            concurrent.futures.Future: The future of the command, None if the key was already in flight
+        """
+        with self._lock:
+            if key in self._in_flight:
+                return None
+            event = threading.Event()
+            future = self._executor.submit(self._run, event, func, args, kwargs)
+            self._in_flight[key] = (future, event)
+            self._counts['queued'] += 1
+        future.add_done_callback(lambda future: self._finish(key, future))
+        return future
+    
+    def _run(self, event, func, args, kwargs):
+        with self._lock:
+            self._counts['queued'] -= 1
+            self._counts['running'] += 1
+        self._local.event = event
+        try:
+            return func(*args, **kwargs)
+        finally:
+            self._local.event = None
+            with self._lock:
+                self._counts['running'] -= 1
+    
+    def _finish(self, key, future):
+        with self._lock:
+            self._in_flight.pop(key, None)
+            if future.cancelled():
+                # Cancelled before it started
+                self._counts['queued'] -= 1
+                self._counts['cancelled'] += 1
+            elif future.exception() is not None:
+                self._counts['failed'] += 1
+            else:
+                self._counts['completed'] += 1
+    
+    def cancel(self, key):
+        """Cancels a command, a queued command never starts and a running one sees cancelled() return True
+
+        Returns:
+            bool: False if the key was not in flight
+        """
+        with self._lock:
+            entry = self._in_flight.get(key)
+        if entry is None:
+            return False
+        future, event = entry
+        event.set()
+        future.cancel()
+        return True
+    
+    def cancelled(self):
+        """Returns whether the command running on the calling thread has been cancelled, False outside a command
+        """
+        event = getattr(self._local, 'event', None)
+        return event is not None and event.is_set()
+    
+    def running(self, key):
+        with self._lock:
+            return key in self._in_flight
+    
+    def metrics(self):
+        """Returns the number of queued and running commands, and how many have completed, failed or been cancelled
+        """
+        with self._lock:
+            return dict(self._counts)
+    
+    def shutdown(self):
+        with self._lock:
+            in_flight = list(self._in_flight.values())
+        for _, event in in_flight:
+            event.set()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+command_executor = CommandExecutor()
 
 # This is an object reference to store immutable values, used for carrying variables between callbacks
 class MutImmutable():
@@ -77,6 +294,7 @@ class TkIO(ttk.Frame):
     def __init__(self, parent):
         super().__init__(parent)
         self._value = MutImmutable()
+        ui_bus.attach(self)
     
     #Abstract method
     # I have declined to use the abstract method wrapper as that can potentially run into issues
@@ -148,8 +366,9 @@ class Outputable(TkIO):
     
     @value.setter
     def value(self, inp):
+        # The value is stored right away, the redraw runs on the Tk thread and is coalesced per widget
         self._value[''] = inp
-        self.update()
+        ui_bus.call(self.update, key=(id(self), 'update'))
         
         for (io_obj, transform) in self.outputs:
             out = transform(inp)
@@ -230,7 +449,18 @@ class DropdownBox(Inputable):
             self.ready()
     
 class IOButton(Outputable):
-    def __init__(self, parent, command=lambda: None, command_kwargs={}, disable_during_run=False, **kwargs):
+    def __init__(self, parent, command=lambda: None, command_kwargs={}, disable_during_run=False, threaded=True, flight_key=None, **kwargs):
+        """A button whose command runs on the shared command executor, its return value becomes the button's value
+
+        Args:
+            parent (tkinter.Misc): The parent widget
+            command (callable, optional): The command. Defaults to lambda: None.
+            command_kwargs (dict, optional): Keyword arguments of the command. Defaults to {}.
+            disable_during_run (bool, optional): Disable the button while the command runs. Defaults to False.
+            threaded (bool, optional): Run the command on the executor, False runs short commands such as a cancel
+                                       directly on the Tk thread. Defaults to True.
+            flight_key (hashable, optional): Buttons sharing a key never run at the same time. Defaults to the command.
+        """
         super().__init__(parent)
         
         self.command = command
@@ -238,24 +468,42 @@ class IOButton(Outputable):
         self.button = ttk.Button(self, command=self.run, **kwargs)
         self.button.pack(expand=True, fill=tk.BOTH, side=tk.BOTTOM, anchor=tk.CENTER)
         self.disable=disable_during_run
+        self.threaded = threaded
+        self.flight_key = command if flight_key is None else flight_key
+        
+    def set_state(self, state):
+        """Sets the button state from any thread
+        """
+        ui_bus.call(lambda: self.button.config(state=state), key=(id(self), 'state'))
         
     def run(self):
+        if not self.threaded:
+            self.value = self.command(**self.command_kwargs)
+            return
+        
         def subprocess():
             try:
                 if self.disable == True:
-                    self.button.config(state='disabled')
+                    self.set_state('disabled')
                     
                 self.value = self.command(**self.command_kwargs)
                 
                 if self.disable == True:
-                    self.button.config(state='normal')
+                    self.set_state('normal')
                     
             except Exception as e:
                 if self.disable == True:
-                    self.button.config(state='normal')
+                    self.set_state('normal')
+                traceback.print_exception(type(e), e, e.__traceback__)
                 raise e
-                
-        threading.Thread(target=subprocess).start()
+        
+        # Ignored while the same command is still queued or running
+        command_executor.submit(self.flight_key, subprocess)
+    
+    def cancel(self):
+        """Cancels the button's command if it is queued or running
+        """
+        return command_executor.cancel(self.flight_key)
         
 class Counter(Outputable):
     def __init__(self, parent, **kwargs):
@@ -267,12 +515,10 @@ class Counter(Outputable):
         self.counter.pack(expand=False, side=tk.LEFT, fill=tk.BOTH)
         
     def update(self):
-        self.counter.config(text=self.value)
+        self.counter.config(text='-' if self.value is None else self.value)
     
     def push(self, inp):
         self.value = inp
-        if inp is None:
-            self.counter.config(text='-')
             
 class ErrorLabel(Outputable):
     def __init__(self, parent, **kwargs):
@@ -281,14 +527,10 @@ class ErrorLabel(Outputable):
         self.text_label = ttk.Label(self, relief='solid', foreground='red', font='TkDefaultFont', **kwargs)
         self.text_label.pack(expand=False, side=tk.LEFT, fill=tk.BOTH)
     def update(self):
-        self.text_label.config(text=self.value)
+        self.text_label.config(text='' if self.value is None else str(self.value))
     
     def push(self, inp):
         self.value = inp
-        if inp is None:
-            self.text_label.config(text='')
-        else:
-            self.text_label.config(text=str(inp))
             
 class ProgressBar(Outputable):
     def __init__(self, parent, **kwargs):
@@ -296,6 +538,34 @@ class ProgressBar(Outputable):
         
         self.progress = ttkbootstrap.Progressbar(self, phase=0, value=100, length=500, bootstyle=SUCCESS)
         self.progress.pack(expand=False, side=tk.LEFT, fill=tk.BOTH)
+        # Running and queued commands, so a click that is waiting behind another command is visible
+        self.status = ttk.Label(self, padding=(10, 0))
+        self.status.pack(expand=False, side=tk.LEFT, fill=tk.BOTH)
+        self._status_text = ''
+        self.after(STATUS_POLL_MS, self._poll_status)
+    
+    @staticmethod
+    def describe(metrics):
+        """Summarizes command executor metrics, empty when no command is queued, running or has failed
+
+        Args:
+            metrics (dict): The counts returned by CommandExecutor.metrics
+
+        Returns:
+            str: e.g. '1 running, 2 queued'
+        """
+        return ', '.join(f'{metrics[name]} {name}' for name in ('running', 'queued', 'failed') if metrics[name] > 0)
+    
+    def _poll_status(self):
+        text = self.describe(command_executor.metrics())
+        if text != self._status_text:
+            self._status_text = text
+            self.status.config(text=text)
+        try:
+            self.after(STATUS_POLL_MS, self._poll_status)
+        except tk.TclError:
+            # The window was closed
+            pass
         
     def update(self):
         if self.value == None or self.value == '':
@@ -304,8 +574,4 @@ class ProgressBar(Outputable):
             self.progress.config(phase=1, value=self.value)
 
     def push(self, value):
-        self.value = value
-        if self.value == None or self.value == '':
-            self.progress.config(phase=0, value=100)
-        else:
-            self.progress.config(phase=1, value=self.value)
\ No newline at end of file
+        self.value = value
\ No newline at end of file
@@ -0,0 +1,64 @@
+# Tests for the prediction cache settings of the worker processes in src/pipeline.py
+# The full pool test needs TensorFlow and StarDist and is skipped without them
+#
+# Usage: python -m pytest tests (or python -m unittest discover tests) from the repository root
+
+import importlib.util
+import os
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT / 'src'))
+
+import model
+import pipeline
+from pipeline import ProcessPredictionPool
+
+HAS_STARDIST = all(importlib.util.find_spec(name) is not None for name in ('tensorflow', 'stardist'))
+
+class WorkerCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        # The worker initializer replaces the shared cache and the thread settings of this process
+        cache_patch = mock.patch.object(model, '_prediction_cache', None)
+        cache_patch.start()
+        self.addCleanup(cache_patch.stop)
+        environ_patch = mock.patch.dict(os.environ)
+        environ_patch.start()
+        self.addCleanup(environ_patch.stop)
+
+    def test_init_worker_applies_budget(self):
+        with mock.patch.object(model, 'Predictor'):
+            pipeline._init_worker('models/frog-egg-counter', 1, 0, self.directory.name)
+            self.assertIsNone(model.get_prediction_cache())
+
+            pipeline._init_worker('models/frog-egg-counter', 1, 2, self.directory.name)
+            cache = model.get_prediction_cache()
+            self.assertEqual(cache.budget, 2 * 1024 * 1024)
+            self.assertEqual(str(cache.directory), self.directory.name)
+
+    def test_pool_defaults_to_parent_settings(self):
+        model.configure_prediction_cache(0, self.directory.name)
+        with mock.patch.object(pipeline, 'ProcessPoolExecutor') as executor:
+            pool = ProcessPredictionPool('models/frog-egg-counter', 1)
+            pool.close()
+        self.assertEqual(executor.call_args.kwargs['initargs'][2:], (0, self.directory.name))
+
+    @unittest.skipUnless(HAS_STARDIST, 'TensorFlow and StarDist are not installed')
+    def test_pool_with_budget_zero_writes_no_entries(self):
+        image = ROOT / 'test-images' / 'multiclass-xeno.jpg'
+        pool = ProcessPredictionPool(ROOT / 'models' / 'xenopus-4-class-v2', 1, cache_mb=0, cache_dir=self.directory.name)
+        try:
+            results = list(pool.run([(0, image, None)], annotate=False))
+        finally:
+            pool.close()
+        self.assertEqual(len(results), 1)
+        self.assertEqual(list(Path(self.directory.name).glob('*.npz')), [])
+
+if __name__ == '__main__':
+    unittest.main()
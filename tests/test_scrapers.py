@@ -0,0 +1,223 @@
+# Tests for the cached update check in src/scrapers.py
+# UpdateCheckerTest replaces can_connect and the tags request with stubs to test the cache on its own,
+# LocalServerTest runs the real request against a stand-in tags page served on 127.0.0.1. The internet is never used
+#
+# Usage: python -m pytest tests (or python -m unittest discover tests) from the repository root
+
+import os
+import socket
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from unittest import mock
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / 'src'))
+
+import scrapers
+from scrapers import UpdateChecker, parse_versions
+
+# A trimmed GitHub tags page, one tag name holds two versions
+TAGS_PAGE = b'''<html><body>
+<h2 class="f4 d-inline"><a href="/tag/v1.3">v1.3</a></h2>
+<h2 class="f4 d-inline"><a href="/tag/v1.6">v1.6 / 1.5</a></h2>
+<h2 class="f4 d-inline"><a href="/tag/nightly">nightly</a></h2>
+</body></html>'''
+
+# Seconds the slow page waits before answering, longer than the request timeout used in the tests
+SLOW_DELAY = 1.0
+
+class TagsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path == '/slow':
+            time.sleep(SLOW_DELAY)
+        status = {'/tags': 200, '/slow': 200, '/missing': 404, '/error': 500}.get(self.path, 404)
+        body = TAGS_PAGE if status == 200 else b'no tags here'
+        try:
+            self.send_response(status)
+            self.send_header('Content-Type', 'text/html')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        except OSError:
+            # The client gave up on the slow page
+            pass
+
+    def log_message(self, format, *args):
+        pass
+
+class UpdateCheckerTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.cache_path = os.path.join(self.directory.name, 'update_check.json')
+        self.checker = UpdateChecker(tags_url='http://example.invalid/tags', cache_path=self.cache_path,
+                                     current_version=1.4, ttl=100, offline_ttl=10)
+        self.fetches = 0
+        self.checker._read_tags = self.fetch
+        self.now = 1000.0
+        time_patch = mock.patch.object(scrapers.time, 'time', lambda: self.now)
+        time_patch.start()
+        self.addCleanup(time_patch.stop)
+        self.addCleanup(self.directory.cleanup)
+
+    def fetch(self):
+        self.fetches += 1
+        return {'latest': 1.5, 'update': True}
+
+    def connect(self, online):
+        return mock.patch.object(scrapers, 'can_connect', lambda url: online)
+
+    def test_result_reused_until_ttl(self):
+        with self.connect(True):
+            result = self.checker.check()
+            self.assertTrue(result['online'])
+            self.assertTrue(result['update'])
+            self.assertEqual(result['latest'], 1.5)
+
+            self.now += 99
+            self.assertEqual(self.checker.check(), result)
+            self.assertEqual(self.fetches, 1)
+
+            self.now += 1
+            self.checker.check()
+            self.assertEqual(self.fetches, 2)
+
+    def test_cache_shared_between_checkers(self):
+        with self.connect(True):
+            self.checker.check()
+            other = UpdateChecker(tags_url=self.checker.tags_url, cache_path=self.cache_path, current_version=1.4)
+            self.assertEqual(other.cached()['latest'], 1.5)
+            # A new version or tags page never reuses the stored result
+            newer = UpdateChecker(tags_url=self.checker.tags_url, cache_path=self.cache_path, current_version=1.5)
+            self.assertIsNone(newer.cached())
+
+    def test_force_ignores_cache(self):
+        with self.connect(True):
+            self.checker.check()
+            self.checker.check(force=True)
+        self.assertEqual(self.fetches, 2)
+
+    def test_offline_skips_request_and_retries_sooner(self):
+        with self.connect(False):
+            result = self.checker.check()
+            self.assertFalse(result['online'])
+            self.assertFalse(result['update'])
+            self.assertEqual(result['error'], 'No internet connection')
+            self.assertEqual(self.fetches, 0)
+
+            self.now += 9
+            self.assertEqual(self.checker.check(), result)
+
+        self.now += 1
+        with self.connect(True):
+            result = self.checker.check()
+        self.assertTrue(result['online'])
+        self.assertEqual(self.fetches, 1)
+
+    def test_failed_request_retries_sooner(self):
+        def fail():
+            self.fetches += 1
+            raise ValueError('bad tags page')
+        self.checker._read_tags = fail
+
+        with self.connect(True):
+            result = self.checker.check()
+            self.assertEqual(result['error'], 'bad tags page')
+            self.now += 10
+            self.checker.check()
+        self.assertEqual(self.fetches, 2)
+
+    def test_check_async_returns_cached_result(self):
+        with self.connect(True):
+            first = self.checker.check_async().result(timeout=5)
+            second = self.checker.check_async().result(timeout=5)
+        self.assertEqual(first, second)
+        self.assertEqual(self.fetches, 1)
+
+    def test_default_cache_path_is_absolute(self):
+        self.assertTrue(os.path.isabs(UpdateChecker().cache_path))
+
+class LocalServerTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), TagsHandler)
+        cls.server.daemon_threads = True
+        cls.thread = threading.Thread(target=cls.server.serve_forever, daemon=True)
+        cls.thread.start()
+        cls.base_url = f'http://127.0.0.1:{cls.server.server_address[1]}'
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.cache_path = os.path.join(self.directory.name, 'update_check.json')
+
+    def checker(self, path, current_version=1.4):
+        return UpdateChecker(tags_url=f'{self.base_url}{path}', cache_path=self.cache_path,
+                             current_version=current_version, ttl=100, offline_ttl=10)
+
+    def assert_cached(self, checker, result):
+        cached = checker.cached()
+        self.assertIsNotNone(cached)
+        for field in ('online', 'update', 'latest', 'error'):
+            self.assertEqual(cached[field], result[field])
+
+    def test_parse_versions(self):
+        from bs4 import BeautifulSoup
+        self.assertEqual(parse_versions(BeautifulSoup(TAGS_PAGE, 'html.parser')), [1.3, 1.6, 1.5])
+
+    def test_newer_version_found(self):
+        checker = self.checker('/tags')
+        result = checker.check()
+        self.assertTrue(result['online'])
+        self.assertTrue(result['update'])
+        self.assertEqual(result['latest'], 1.6)
+        self.assertIsNone(result['error'])
+        self.assert_cached(checker, result)
+
+    def test_up_to_date(self):
+        result = self.checker('/tags', current_version=1.6).check()
+        self.assertFalse(result['update'])
+        self.assertEqual(result['latest'], 1.6)
+
+    def test_http_errors(self):
+        for path, status in (('/missing', '404'), ('/error', '500')):
+            with self.subTest(path=path):
+                checker = self.checker(path)
+                result = checker.check()
+                # The server answered, so the station is online even though the page failed
+                self.assertTrue(result['online'])
+                self.assertFalse(result['update'])
+                self.assertIn(status, result['error'])
+                self.assert_cached(checker, result)
+
+    def test_slow_response_times_out(self):
+        checker = self.checker('/slow')
+        start = time.monotonic()
+        with mock.patch.object(scrapers, 'REQUEST_TIMEOUT', 0.2):
+            result = checker.check()
+        self.assertLess(time.monotonic() - start, SLOW_DELAY)
+        self.assertFalse(result['online'])
+        self.assertIsNotNone(result['error'])
+        self.assert_cached(checker, result)
+
+    def test_unreachable_host(self):
+        # A port that was just free, nothing listens on it
+        with socket.socket() as probe:
+            probe.bind(('127.0.0.1', 0))
+            port = probe.getsockname()[1]
+        checker = UpdateChecker(tags_url=f'http://127.0.0.1:{port}/tags', cache_path=self.cache_path, current_version=1.4)
+        result = checker.check()
+        self.assertFalse(result['online'])
+        self.assertEqual(result['error'], 'No internet connection')
+        self.assert_cached(checker, result)
+
+if __name__ == '__main__':
+    unittest.main()